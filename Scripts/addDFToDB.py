@@ -1,14 +1,27 @@
 from app import engine
+from app.Resources.ingest import ingest
+import argparse
+import json
 import pandas as pd
 
-## Adds a Pandas DataFrame to the given table of the Database
-## Returns The DF read from the SQL table as a check.
-def add_df(df, tablename, index = False):
-    df.to_sql(tablename, con = engine, index = index, if_exists = 'replace')
-    return pd.read_sql(tablename, con = engine)
+## Adds a Pandas DataFrame (or a CSV/Parquet export) to the given table of the Database, replacing the
+## rows of the projects it holds. Streams it in chunks, see app/Resources/ingest.py
+## Returns the ingest report: row counts are validated against the database instead of reading it back
+def add_df(df, tablename, index = False, mode = 'replace', chunksize = 50000):
+    if index and isinstance(df, pd.DataFrame):
+        df = df.reset_index()
+    return ingest(df, tablename, mode = mode, chunksize = chunksize)
 
 def get_df_from_db(tablename):
-    return pd.read_sql(tablename, con = engine)
-
+    return pd.read_sql(tablename, con = engine.resolve())
 
 
+## Usage: python -m Scripts.addDFToDB <export.csv|export.parquet> <table> [--mode replace|append|upsert]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Streams an MWD export into the database')
+    parser.add_argument('path')
+    parser.add_argument('table')
+    parser.add_argument('--mode', choices = ['replace', 'append', 'upsert'], default = 'replace')
+    parser.add_argument('--chunksize', type = int, default = 50000)
+    args = parser.parse_args()
+    print(json.dumps(add_df(args.path, args.table, mode = args.mode, chunksize = args.chunksize), indent = 2))
@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+## Benchmarks the endpoints, the clustering functions and the plotting functions on synthetic data (see
+## syntheticMWD.py) loaded into a throwaway SQLite database, or the database given with --database.
+## Results are written as JSON, and compared with a previous run given with --compare.
+## Usage: python -m Scripts.benchmark [--holes N] [--samples N] [--projects N] [--output results.json]
+
+
+def measure(function, repeat = 5, rows = None):
+    """
+    Calls function once under tracemalloc for its peak Python memory, then repeat more times for its
+    latency. The first call is reported separately, as it is the one that fills the caches.
+
+    Returns
+    -------
+    A dictionary of the first, median, min and max latency in seconds, the calls (or rows, if given) per
+    second at the median latency, and the peak memory in bytes.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    first = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    median = statistics.median(times) if times else first
+    return {'first_s': first, 'median_s': median, 'min_s': min(times or [first]), 'max_s': max(times or [first]),
+            'per_second': (rows or 1) / median if median else None, 'peak_bytes': peak}
+
+
+def benchmark_functions(mwd, positions, repeat, models = ('kmeans', 'agglom', 'spectral')):
+    from app.Resources import plotting
+    from app.Resources.Clustering import cluster_data, modify_data
+    from app.Resources.data_access import FEATURES
+    from app.Resources.rollups import build_rollups
+
+    project = mwd[mwd.projectID == mwd.projectID.iloc[0]].reset_index(drop = True)
+    holeID = project.holeID.iloc[0]
+    hole = project[project.holeID == holeID].reset_index(drop = True)
+    hole_positions = positions[positions.projectID == project.projectID.iloc[0]].reset_index(drop = True)
+    features = project[FEATURES]
+    results = {}
+
+    for data_type in ('normalized', 'weighted', 'PCA'):
+        results[f'modify_data[{data_type}]'] = measure(lambda: modify_data(features, data_type), repeat,
+                                                       len(features))
+    data = modify_data(features, 'PCA')
+    for model in models:
+        results[f'cluster_data[{model}]'] = measure(lambda: cluster_data(data, model = model, k = 4), repeat,
+                                                    len(data))
+        results[f'cluster_data[{model},scalable]'] = measure(lambda: cluster_data(
+            data, model = model, k = 4, scalable = True, groups = project.holeID.values), repeat, len(data))
+
+    labels = cluster_data(data, model = 'kmeans', k = 4)
+    hole_labels = first_label_per_hole(project.holeID.values, labels, hole_positions.holeID)
+    rollup = build_rollups(hole, [.5])
+    plots = {
+        'plot_rate': lambda: plotting.plot_rate(holeID, hole, 'PenetrRate'),
+        'plot_hole_features': lambda: plotting.plot_hole_features(hole, holeID, FEATURES, encoded = False),
+        'all_features_update': lambda: plotting.all_features_update(hole, holeID, encoded = False),
+        'build_rollups': lambda: build_rollups(project, [.1, .5, 1.]),
+        'hardness_bar_plot': lambda: plotting.hardness_bar_plot(rollup, holeID, encoded = False),
+        'hardness_bar_plots': lambda: plotting.hardness_bar_plots(rollup, holeID, encoded = False),
+        'highlight_location': lambda: plotting.highlight_location(hole_positions, holeID, encoded = False),
+        'cluster_positions': lambda: plotting.cluster_positions(hole_positions, hole_labels, encoded = False),
+        'encode_all_holes': lambda: plotting.encode_all_holes(project, encoded = False),
+    }
+    for name, plot in plots.items():
+        results[name] = measure(plot, repeat)
+    return results
+
+
+def first_label_per_hole(holes, labels, order):
+    ## The label of the first row of each hole, in the order of the positions
+    first = {}
+    for hole, label in zip(holes, labels):
+        first.setdefault(hole, label)
+    return [first.get(hole, 0) for hole in order]
+
+
+def benchmark_endpoints(app, mwd, repeat):
+    project = mwd[mwd.projectID == mwd.projectID.iloc[0]]
+    projectID = project.projectID.iloc[0]
+    holeID = project.holeID.iloc[0]
+    depth = float(project.Depth.median())
+    entries = [{'holeID': hole, 'depth': depth} for hole in project.holeID.unique()[:50]]
+    requests = {
+        'GetHoleIDs': ('get', f'/{projectID}/GetHoleIDs', None),
+        'AllFeatures': ('get', f'/{projectID}/{holeID}/AllFeatures', None),
+        'AllFeatures[urls]': ('get', f'/{projectID}/{holeID}/AllFeatures?format=urls', None),
+        'HardnessBarChart': ('get', f'/{projectID}/{holeID}/HardnessBarChart', None),
+        'Rollups': ('get', f'/{projectID}/Rollups?resolution=0.5', None),
+        'HardnessMap': ('get', f'/{projectID}/HardnessMap', None),
+        'HardnessMap[image]': ('get', f'/{projectID}/HardnessMap?image=true', None),
+        'AllPlots': ('get', f'/{projectID}/AllPlots', None),
+        'AllPlots[urls]': ('get', f'/{projectID}/AllPlots?format=urls', None),
+        'AllPlots.png': ('get', f'/{projectID}/{holeID}/AllPlots/PenetrRate.png', None),
+        'Cluster': ('get', f'/{projectID}/Cluster', None),
+        'ClusterByEntry': ('get', f'/{projectID}/ClusterByEntry?holeID={holeID}&depth={depth}&limit=100', None),
+        'ClusterByEntry[batch]': ('post', f'/{projectID}/ClusterByEntry/batch', {'entries': entries}),
+        'BlastReports[post]': ('post', f'/{projectID}/BlastReports',
+                               [{'holeID': hole, 'depth': depth, 'report': 'ok', 'score': 3}
+                                for hole in project.holeID.unique()]),
+        'BlastReports': ('get', f'/{projectID}/BlastReports?min_score=1', None),
+        'metrics': ('get', '/metrics', None),
+    }
+    client = app.test_client()
+    results = {}
+    for name, (method, url, body) in requests.items():
+        def call():
+            response = getattr(client, method)(url, json = body) if body is not None else getattr(client, method)(url)
+            if response.status_code >= 400:
+                raise RuntimeError(f'{name}: {url} answered {response.status_code}')
+            response.get_data()
+        results[name] = measure(call, repeat)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True,
+                              check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    ## Prints the median latency of every benchmark relative to a previous run
+    print(f"{'benchmark':45} {'before':>10} {'after':>10} {'ratio':>7}")
+    for group in ('functions', 'endpoints'):
+        for name, result in results[group].items():
+            before = previous.get(group, {}).get(name)
+            if before is None:
+                continue
+            ratio = result['median_s'] / before['median_s'] if before['median_s'] else float('nan')
+            print(f"{group + '.' + name:45} {before['median_s'] * 1000:9.1f}ms {result['median_s'] * 1000:9.1f}ms "
+                  f"{ratio:6.2f}x")
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmarks the MWD API on synthetic data')
+    parser.add_argument('--projects', type = int, default = 1)
+    parser.add_argument('--holes', type = int, default = 20)
+    parser.add_argument('--samples', type = int, default = 200)
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--database', help = 'Database URL to load the data into, a temporary SQLite file if unset')
+    parser.add_argument('--render-workers', type = int, default = 0)
+    parser.add_argument('--skip', choices = ['functions', 'endpoints'], action = 'append', default = [])
+    parser.add_argument('--output', default = 'benchmark.json')
+    parser.add_argument('--compare', help = 'A previous output file to compare with')
+    args = parser.parse_args(argv)
+
+    ## The app reads its configuration from the environment when it is imported, so every cache and the
+    ## database point into a throwaway directory first
+    workdir = tempfile.mkdtemp(prefix = 'mwd-benchmark-')
+    os.environ['DATABASE_LINK'] = args.database or f"sqlite:///{os.path.join(workdir, 'mwd.db')}"
+    os.environ.setdefault('RENDER_CACHE_DIR', os.path.join(workdir, 'renders'))
+    os.environ.setdefault('MODEL_DIR', os.path.join(workdir, 'models'))
+    os.environ['RENDER_WORKERS'] = str(args.render_workers)
+
+    from app import create_app, init_db
+    from Scripts.addDFToDB import add_df
+    from Scripts.syntheticMWD import generate
+
+    mwd, positions = generate(args.projects, args.holes, args.samples)
+    app = create_app('base')
+    results = {'meta': {'commit': git_commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                        'python': sys.version.split()[0], 'platform': platform.platform(),
+                        'projects': args.projects, 'holes': args.holes, 'samples': args.samples,
+                        'rows': len(mwd), 'repeat': args.repeat, 'render_workers': args.render_workers}}
+    with app.app_context():
+        init_db()
+        start = time.perf_counter()
+        add_df(mwd, 'MWD')
+        add_df(positions, 'HolePositions')
+        results['meta']['ingest_s'] = time.perf_counter() - start
+        if 'functions' not in args.skip:
+            results['functions'] = benchmark_functions(mwd, positions, args.repeat)
+    if 'endpoints' not in args.skip:
+        results['endpoints'] = benchmark_endpoints(app, mwd, args.repeat)
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent = 2)
+    print(f'Wrote {args.output}')
+    if args.compare:
+        with open(args.compare) as file:
+            compare({group: results.get(group, {}) for group in ('functions', 'endpoints')}, json.load(file))
+    return results
+
+
+if __name__ == '__main__':
+    main()
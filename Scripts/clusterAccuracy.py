@@ -0,0 +1,21 @@
+from app import create_app
+from app.Resources.Clustering import modify_data, scalability_report
+from app.Resources.data_access import FEATURES, load_project
+import json
+import os
+import sys
+
+## Prints how closely the scalable clustering mode matches exact clustering on a project's MWD data.
+## Usage: python Scripts/clusterAccuracy.py <projectID> [k] [sample_size]
+def accuracy_report(projectID, k = 4, sample_size = 5000, data_type = 'PCA'):
+    app = create_app(os.getenv('ENV') or 'dev')
+    with app.app_context():
+        frame = load_project(projectID)
+    data = modify_data(frame[FEATURES], data_type)
+    return scalability_report(data, k = k, groups = frame.holeID.values, sample_size = sample_size)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    report = accuracy_report(args[0], *[int(arg) for arg in args[1:3]])
+    print(json.dumps(report, indent = 2))
@@ -0,0 +1,95 @@
+import argparse
+import numpy as np
+import pandas as pd
+
+## Synthetic MWD and HolePositions data for benchmarks, shaped like the EPIROC exports: holes drilled on a
+## grid, each logging its sensors every 0.1 depth units through horizontal layers of rock of varying hardness.
+
+## Typical range (low, high) of each sensor in soft and hard rock
+SENSOR_RANGES = {'PenetrRate': (3.5, 0.5), 'PercPressure': (12, 25), 'FeedPressure': (38, 58),
+                 'RotPressure': (45, 72), 'InstPentRate': (3, 0.5)}
+
+
+def generate_project(projectID, holes = 20, samples = 200, layers = 4, spacing = 4.0, seed = 0):
+    """
+    Generates the MWD rows and hole positions of one project.
+
+    Parameters
+    ----------
+    projectID: String
+        The projectID of every row.
+    holes: int
+        The number of holes, laid out on a square grid.
+    samples: int
+        The number of samples logged per hole.
+    layers: int
+        The number of rock layers. Each has a hardness between 0 (soft) and 1 (hard) and a depth that
+        varies smoothly across the site.
+    spacing: float
+        The distance between neighbouring holes.
+    seed: int
+        Seed of the random generator, so the same arguments always give the same data.
+
+    Returns
+    -------
+    The MWD Pandas DataFrame (index, projectID, the sensors, holeID, Depth) and the HolePositions DataFrame.
+    """
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(holes)))
+    grid = np.arange(holes)
+    x = (grid % side) * spacing + rng.normal(0, .3, holes)
+    y = (grid // side) * spacing + rng.normal(0, .3, holes)
+    holeIDs = [f'{projectID}-H{number + 1:03d}' for number in range(holes)]
+
+    hardness = rng.uniform(0, 1, layers)
+    depth = np.arange(samples) * .1
+    # Depth of the top of each layer below each hole, tilted across the site
+    tops = np.sort(rng.uniform(0, depth[-1] if samples > 1 else 1, layers))
+    tilt = rng.normal(0, .05, 2)
+
+    frames = []
+    for hole, (hole_x, hole_y) in enumerate(zip(x, y)):
+        hole_tops = tops + tilt[0] * hole_x + tilt[1] * hole_y
+        layer = np.clip(np.searchsorted(hole_tops, depth) - 1, 0, layers - 1)
+        hard = hardness[layer]
+        frame = {'projectID': projectID}
+        for sensor, (soft_value, hard_value) in SENSOR_RANGES.items():
+            value = soft_value + (hard_value - soft_value) * hard
+            frame[sensor] = value + rng.normal(0, abs(hard_value - soft_value) * .08, samples)
+        frame['holeID'] = holeIDs[hole]
+        frame['Depth'] = depth
+        frames.append(pd.DataFrame(frame))
+
+    mwd = pd.concat(frames, ignore_index = True)
+    mwd.insert(0, 'index', np.arange(len(mwd)))
+    positions = pd.DataFrame({'projectID': projectID, 'holeID': holeIDs, 'start_x': x, 'start_y': y})
+    return mwd, positions
+
+
+def generate(projects = 1, holes = 20, samples = 200, seed = 0):
+    """
+    Generates several projects (see generate_project), named P001, P002...
+
+    Returns
+    -------
+    The MWD and HolePositions Pandas DataFrames of every project.
+    """
+    generated = [generate_project(f'P{number + 1:03d}', holes, samples, seed = seed + number)
+                 for number in range(projects)]
+    return (pd.concat([mwd for mwd, _ in generated], ignore_index = True),
+            pd.concat([positions for _, positions in generated], ignore_index = True))
+
+
+## Usage: python -m Scripts.syntheticMWD <mwd.csv> <positions.csv> [--projects N] [--holes N] [--samples N]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Writes synthetic MWD and HolePositions exports')
+    parser.add_argument('mwd_path')
+    parser.add_argument('positions_path')
+    parser.add_argument('--projects', type = int, default = 1)
+    parser.add_argument('--holes', type = int, default = 20)
+    parser.add_argument('--samples', type = int, default = 200)
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+    mwd, positions = generate(args.projects, args.holes, args.samples, args.seed)
+    mwd.to_csv(args.mwd_path, index = False)
+    positions.to_csv(args.positions_path, index = False)
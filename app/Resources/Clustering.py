@@ -1,9 +1,13 @@
-from sklearn.cluster import KMeans, AgglomerativeClustering as ac, SpectralClustering
+import time
+import numpy as np
 import pandas as pd
-from sklearn.decomposition import PCA
-from sklearn.preprocessing import StandardScaler
+from ..instrumentation import timed
 
-def cluster_data(data, model = 'agglom', k = 5, linkage = 'complete'):
+## scikit-learn is imported inside the functions that use it, so the app starts without loading it
+
+@timed('cluster')
+def cluster_data(data, model = 'agglom', k = 5, linkage = 'complete', scalable = False, groups = None,
+                 sample_size = 5000, connectivity = False):
     """
     Trains a clustering model given the model type, number of clusters, linkage type, and MWD data.
 
@@ -18,11 +22,24 @@ def cluster_data(data, model = 'agglom', k = 5, linkage = 'complete'):
         The number of clusters to use. Default is 4.
     linkage: String
         The type of linkage to be used for Agglomerative clustering. Default is Complete
+    scalable: bool
+        If True, clusters with scalable_cluster_data instead of fitting the model on every row.
+    groups: array-like
+        The holeID of each row, used to stratify the sample of the scalable mode.
+    sample_size: int
+        The number of rows the scalable mode fits Agglomerative/Spectral clustering on.
+    connectivity: bool
+        If True, the scalable mode fits Agglomerative clustering on every row, constrained to a
+        nearest neighbours graph, instead of on a sample.
 
     Returns
     -------
     A list of the cluster labels
     """
+    from sklearn.cluster import KMeans, AgglomerativeClustering as ac, SpectralClustering
+    if scalable:
+        return scalable_cluster_data(data, model = model, k = k, linkage = linkage, groups = groups,
+                                     sample_size = sample_size, connectivity = connectivity)
     if model == 'kmeans':
         km = KMeans(n_clusters=k)
         km_labels = km.fit_predict(data)
@@ -36,6 +53,114 @@ def cluster_data(data, model = 'agglom', k = 5, linkage = 'complete'):
         spec_labels = spectral.fit_predict(data)
         return spec_labels
 
+def scalable_cluster_data(data, model = 'agglom', k = 5, linkage = 'complete', groups = None, sample_size = 5000,
+                          connectivity = False, random_state = 0):
+    """
+    Clusters large data without the quadratic memory of fitting Agglomerative or Spectral clustering
+    on every row. KMeans is fit with MiniBatchKMeans. Agglomerative and Spectral clustering are fit on a
+    sample stratified by hole, and every other row is assigned the label of the nearest cluster
+    centroid of the sample. Agglomerative clustering can instead be fit on every row constrained to a
+    nearest neighbours graph.
+
+    Parameters
+    ----------
+    data: Pandas DataFrame
+        The data to be used for clustering, as for cluster_data.
+    model: String
+        'kmeans', 'agglom', or any other value for Spectral clustering.
+    k: int
+        The number of clusters to use.
+    linkage: String
+        The type of linkage to be used for Agglomerative clustering.
+    groups: array-like
+        The holeID of each row. If given, each hole is sampled in proportion to its number of rows.
+    sample_size: int
+        The number of rows to fit Agglomerative/Spectral clustering on.
+    connectivity: bool
+        If True, Agglomerative clustering is fit with a 10 nearest neighbours connectivity graph.
+    random_state: int
+        Seed of the sampling and of MiniBatchKMeans, so results are reproducible.
+
+    Returns
+    -------
+    A numpy array of the cluster labels of every row.
+    """
+    from sklearn.cluster import MiniBatchKMeans, AgglomerativeClustering as ac, SpectralClustering
+    from sklearn.neighbors import kneighbors_graph
+    X = np.asarray(data, dtype = np.float64)
+    if model == 'kmeans':
+        return MiniBatchKMeans(n_clusters = k, batch_size = 2048, random_state = random_state).fit_predict(X)
+    if model == 'agglom' and connectivity:
+        graph = kneighbors_graph(X, n_neighbors = 10, include_self = False)
+        return ac(n_clusters = k, linkage = linkage, connectivity = graph).fit_predict(X)
+
+    sample = stratified_sample(len(X), sample_size, groups, random_state)
+    if model == 'agglom':
+        sample_labels = ac(n_clusters = k, affinity = 'euclidean', linkage = linkage).fit_predict(X[sample])
+    else:
+        sample_labels = SpectralClustering(n_clusters = k, assign_labels = 'kmeans', affinity = 'rbf',
+                                           random_state = random_state).fit_predict(X[sample])
+    labels = assign_to_prototypes(X, cluster_prototypes(X[sample], sample_labels))
+    labels[sample] = sample_labels  # Sampled rows keep the label they were fit with
+    return labels
+
+def stratified_sample(n_rows, sample_size, groups = None, random_state = 0):
+    """
+    Returns the sorted positions of a random sample of about sample_size rows. If groups is given, every
+    group (hole) is sampled in proportion to its size, with at least one row per group.
+    """
+    if n_rows <= sample_size:
+        return np.arange(n_rows)
+    rng = np.random.RandomState(random_state)
+    if groups is None:
+        return np.sort(rng.choice(n_rows, sample_size, replace = False))
+
+    fraction = sample_size / n_rows
+    positions = pd.Series(np.asarray(groups)).groupby(np.asarray(groups), sort = True).indices
+    picks = [rng.choice(rows, max(1, int(round(len(rows) * fraction))), replace = False)
+             for rows in positions.values()]
+    return np.sort(np.concatenate(picks))
+
+def cluster_prototypes(data, labels):
+    """
+    Returns the centroid of each cluster, with row i holding the centroid of label i.
+    """
+    return pd.DataFrame(np.asarray(data)).groupby(np.asarray(labels)).mean().sort_index().values
+
+def assign_to_prototypes(data, prototypes):
+    """
+    Labels every row with the index of its nearest prototype, in one vectorized (chunked) pass.
+    """
+    from sklearn.metrics import pairwise_distances_argmin
+    return pairwise_distances_argmin(np.asarray(data, dtype = np.float64), prototypes)
+
+def scalability_report(data, k = 4, models = ('kmeans', 'agglom', 'spectral'), linkage = 'complete',
+                       groups = None, sample_size = 5000):
+    """
+    Compares the scalable mode with exact clustering on the same data. Exact clustering fits every row,
+    so only run this on test data small enough for it.
+
+    Returns
+    -------
+    A dictionary holding, for each model, the Adjusted Rand Index between the exact and scalable labels
+    and the seconds each took to fit.
+    """
+    from sklearn.metrics import adjusted_rand_score
+    report = {}
+    for model in models:
+        start = time.perf_counter()
+        exact = cluster_data(data, model = model, k = k, linkage = linkage)
+        exact_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        scaled = cluster_data(data, model = model, k = k, linkage = linkage, scalable = True, groups = groups,
+                              sample_size = sample_size)
+        scaled_time = time.perf_counter() - start
+
+        report[model] = {'rows': len(data), 'adjusted_rand_index': float(adjusted_rand_score(exact, scaled)),
+                         'exact_seconds': exact_time, 'scalable_seconds': scaled_time}
+    return report
+
 def modify_data(data, data_type):
     """
     Normalizes the data, Adds weights to the data if wanted for weighted clustering/WMDS, or computes
@@ -54,12 +179,39 @@ def modify_data(data, data_type):
     -------
     A Pandas DataFrame with the modified data.
     """
-    data = pd.DataFrame(StandardScaler().fit_transform(data), columns = data.columns)
+    return apply_modifier(data, fit_modifier(data, data_type))
+
+@timed('modify')
+def fit_modifier(data, data_type):
+    """
+    Fits the StandardScaler, and the PCA if needed, that modify_data applies for a data_type, so the
+    same transformation can be applied to rows added later.
+
+    Returns
+    -------
+    A dictionary holding the data_type, the fitted scaler, the feature weights and the fitted PCA (None
+    when not used).
+    """
+    from sklearn.decomposition import PCA
+    from sklearn.preprocessing import StandardScaler
+    scaler = StandardScaler().fit(data)
+    modifier = {'data_type': data_type, 'scaler': scaler, 'weights': None, 'pca': None}
     if data_type == 'weighted':
         # Weight values will be tweaked as more features are added
         weights = pd.Series([1.15, 1, 1, 1, 1.25], index=data.columns)
-        data = data * (weights / weights.sum())
+        modifier['weights'] = weights / weights.sum()
     elif data_type == 'PCA':
-        pca_model = PCA(n_components=3)
-        data = pd.DataFrame(pca_model.fit_transform(data), columns = ['PC1', 'PC2', 'PC3'])
+        modifier['pca'] = PCA(n_components=3).fit(scaler.transform(data))
+    return modifier
+
+@timed('modify')
+def apply_modifier(data, modifier):
+    """
+    Normalizes, weights or projects data with a modifier fitted by fit_modifier.
+    """
+    data = pd.DataFrame(modifier['scaler'].transform(data), columns = data.columns)
+    if modifier['weights'] is not None:
+        data = data * modifier['weights']
+    elif modifier['pca'] is not None:
+        data = pd.DataFrame(modifier['pca'].transform(data), columns = ['PC1', 'PC2', 'PC3'])
     return data
@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class FrameCache:
+    """
+    An in-process, memory-bounded LRU cache of DataFrames keyed by (table, projectID).
+
+    Entries are tagged with the data version they were loaded at, and are dropped when that version is
+    stale, when they are older than the TTL, or when the total size of the cache exceeds max_bytes
+    (least recently used entries are evicted first).
+    """
+    def __init__(self, max_bytes=256 * 2 ** 20, ttl=600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (frame, version, nbytes, stored_at)
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def configure(self, max_bytes=None, ttl=None):
+        with self._lock:
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if ttl is not None:
+                self.ttl = ttl
+            self._evict()
+
+    def get(self, key, version=None):
+        """
+        Returns the cached frame for key, or None if it is missing, expired, or was stored at a
+        different data version.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                frame, stored_version, nbytes, stored_at = entry
+                if stored_version != version or (self.ttl and time.monotonic() - stored_at > self.ttl):
+                    self._drop(key)
+                    self.expirations += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return frame
+            self.misses += 1
+            return None
+
+    def peek(self, key):
+        """
+        Returns the cached frame for key whatever its version or age, without counting a hit or miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return None if entry is None else entry[0]
+
+    def put(self, key, frame, version=None):
+        """
+        Stores frame for key at a data version and returns it. Besides DataFrames, any object with an nbytes
+        attribute (e.g. an index built from a project's rows) can be cached.
+        """
+        if hasattr(frame, 'memory_usage'):
+            nbytes = int(frame.memory_usage(index=True, deep=True).sum())
+        else:
+            nbytes = int(frame.nbytes)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if nbytes > self.max_bytes:  # Never worth holding, and would evict everything else
+                return frame
+            self._entries[key] = (frame, version, nbytes, time.monotonic())
+            self._bytes += nbytes
+            self._evict()
+        return frame
+
+    def invalidate(self, table=None, projectID=None):
+        """
+        Drops every entry of the given table and/or project. With no arguments the whole cache is cleared.
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if (table is None or key[0] == table) and (projectID is None or key[1] == projectID):
+                    self._drop(key)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                    'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'expirations': self.expirations,
+                    'keys': [{'key': list(key), 'bytes': entry[2]} for key, entry in self._entries.items()]}
+
+    def _drop(self, key):
+        self._bytes -= self._entries.pop(key)[2]
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+
+# Shared by every request handled by this worker process
+frame_cache = FrameCache()
@@ -0,0 +1,248 @@
+import numpy as np
+import pandas as pd
+from flask import current_app
+from sqlalchemy import select
+from .. import engine
+from ..instrumentation import stage, timed
+from ..models import BlastCluster
+from .cache import FrameCache
+from .Clustering import cluster_data, fit_modifier, apply_modifier, cluster_prototypes, assign_to_prototypes
+from .data_access import FEATURES, load_project, data_version
+from .hole_summary import hole_summary, hole_clusters, store_hole_clusters, dominant_clusters
+from .model_registry import save_model, load_model
+
+# Clustering results of this worker, keyed by ('BlastCluster', projectID, run)
+cluster_cache = FrameCache(max_bytes=64 * 2 ** 20, ttl=0)
+
+
+def run_key(data_type, model, k, linkage, scalable=False):
+    """
+    Returns the identifier of a clustering run, as stored in the run column of BlastCluster.
+    """
+    return f'{data_type}:{model}:{k}:{linkage}' + (':scalable' if scalable else '')
+
+
+def _result(frame, labels, data2D):
+    return pd.DataFrame({'holeID': frame.holeID.values, 'Depth': frame.Depth.values,
+                         'CID': np.asarray(labels, dtype=np.int32),
+                         'x': data2D.PC1.values, 'y': data2D.PC2.values})
+
+
+@timed('cluster')
+def fit_clusters(frame, data_type='PCA', model='agglom', k=4, linkage='complete', scalable=False, sample_size=5000):
+    """
+    Clusters the MWD rows of a project and projects them into 2D.
+
+    Parameters
+    ----------
+    frame: Pandas DataFrame
+        The MWD rows of a project, holding the sensor columns.
+    data_type: String
+        How the data is modified before clustering. See modify_data.
+    model: String
+        The clustering algorithm. See cluster_data.
+    k: int
+        The number of clusters.
+    linkage: String
+        The linkage used by Agglomerative clustering.
+    scalable: bool
+        If True, uses the scalable mode of cluster_data, sampling each hole for Agglomerative/Spectral.
+    sample_size: int
+        The number of rows sampled by the scalable mode.
+
+    Returns
+    -------
+    A Pandas DataFrame with the holeID, Depth, cluster label (CID) and 2D coordinates (x, y) of each row,
+    and the fitted state to save in the model registry for predicting rows added later.
+    """
+    modifier = fit_modifier(frame[FEATURES], data_type)
+    data = apply_modifier(frame[FEATURES], modifier)
+    labels = cluster_data(data, model=model, k=k, linkage=linkage, scalable=scalable,
+                          groups=frame.holeID.values, sample_size=sample_size)
+    projection = modifier if data_type == 'PCA' else fit_modifier(frame[FEATURES], 'PCA')
+    data2D = data if data_type == 'PCA' else apply_modifier(frame[FEATURES], projection)
+
+    state = {'modifier': modifier, 'projection': projection, 'prototypes': cluster_prototypes(data, labels),
+             'fitted_rows': len(frame)}
+    return _result(frame, labels, data2D), state
+
+
+@timed('cluster')
+def extend_clusters(frame, previous, state, max_new_fraction=0.25, max_drift=0.5):
+    """
+    Labels the rows of a project that are missing from a previous result with the saved models, instead
+    of refitting. Rows are matched on (holeID, Depth), and new rows get the label of the nearest cluster
+    prototype.
+
+    Parameters
+    ----------
+    frame: Pandas DataFrame
+        The current MWD rows of the project.
+    previous: Pandas DataFrame
+        A result of fit_clusters/extend_clusters for an older version of the project's rows.
+    state: dictionary
+        The fitted state saved with the previous result.
+    max_new_fraction: float
+        Refit once the rows added since the last fit exceed this fraction of the rows that were fit.
+    max_drift: float
+        Refit when the mean of the new rows in any feature, in standard deviations of the fitted data,
+        moves further than this from the fitted mean.
+
+    Returns
+    -------
+    The Pandas DataFrame result for frame, or None when the refit policy requires a full refit (rows
+    were removed or changed, too many rows were added, or the new rows drifted or miss values).
+    """
+    previous = previous[~_keys(previous).duplicated()]
+    positions = _keys(previous).get_indexer(_keys(frame))
+    new = positions == -1
+    if len(frame) - new.sum() < len(previous):  # Rows were removed or changed
+        return None
+    if len(frame) - state['fitted_rows'] > max_new_fraction * state['fitted_rows']:
+        return None
+
+    labels = np.empty(len(frame), dtype=np.int32)
+    x = np.empty(len(frame))
+    y = np.empty(len(frame))
+    labels[~new] = previous.CID.values[positions[~new]]
+    x[~new] = previous.x.values[positions[~new]]
+    y[~new] = previous.y.values[positions[~new]]
+
+    if new.any():
+        new_rows = frame.loc[new, FEATURES]
+        drift = np.abs(state['modifier']['scaler'].transform(new_rows).mean(axis=0)).max()
+        if not drift <= max_drift:  # Also refit when new rows miss values (a NaN drift)
+            return None
+
+        data = apply_modifier(new_rows, state['modifier'])
+        data2D = data if state['projection'] is state['modifier'] else apply_modifier(new_rows, state['projection'])
+        labels[new] = assign_to_prototypes(data, state['prototypes'])
+        x[new] = data2D.PC1.values
+        y[new] = data2D.PC2.values
+    return _result(frame, labels, pd.DataFrame({'PC1': x, 'PC2': y}))
+
+
+def _keys(frame):
+    return pd.MultiIndex.from_arrays([frame.holeID.astype(str), frame.Depth])
+
+
+def _aligned(stored, frame):
+    # The stored rows in the order of frame, matched on (holeID, Depth), or None unless every row of frame
+    # is stored exactly once. Rows appended by _append sit after the rows stored before them
+    if len(stored) != len(frame):
+        return None
+    if np.array_equal(stored.holeID.astype(str).values, frame.holeID.astype(str).values) and \
+            np.array_equal(stored.Depth.values, frame.Depth.values):
+        return stored
+    keys = _keys(stored)
+    if keys.has_duplicates:
+        return None
+    positions = keys.get_indexer(_keys(frame))
+    if (positions == -1).any():
+        return None
+    return stored.iloc[positions].reset_index(drop=True)
+
+
+def _read_stored(projectID, run):
+    # Every run keeps the rows of a single data version, see _store and _append
+    clusters = BlastCluster.__table__
+    query = select(clusters.c.version, clusters.c.holeID, clusters.c.depth.label('Depth'),
+                   clusters.c.CID, clusters.c.x, clusters.c.y) \
+        .where(clusters.c.projectID == projectID, clusters.c.run == run) \
+        .order_by(clusters.c.row)
+    with stage('db'):
+        stored = pd.read_sql(query, engine.resolve())
+    if stored.empty:
+        return None, None
+    return stored.drop(columns='version'), int(stored.version.iloc[0])
+
+
+def _store(projectID, run, version, result):
+    clusters = BlastCluster.__table__
+    rows = pd.DataFrame({'projectID': projectID, 'run': run, 'row': np.arange(len(result)), 'version': version,
+                         'holeID': result.holeID.astype(str).values, 'depth': result.Depth.values,
+                         'CID': result.CID.values, 'x': result.x.values, 'y': result.y.values})
+    with engine.begin() as conn:
+        conn.execute(clusters.delete().where(clusters.c.projectID == projectID, clusters.c.run == run))
+        conn.execute(clusters.insert(), rows.to_dict(orient='records'))
+
+
+def _append(projectID, run, version, result, new, start):
+    # Stores only the rows of result that are new since the stored rows, numbered after them, and moves
+    # the run to the new data version
+    clusters = BlastCluster.__table__
+    added = result[new]
+    rows = pd.DataFrame({'projectID': projectID, 'run': run, 'row': start + np.arange(len(added)),
+                         'version': version, 'holeID': added.holeID.astype(str).values, 'depth': added.Depth.values,
+                         'CID': added.CID.values, 'x': added.x.values, 'y': added.y.values})
+    with engine.begin() as conn:
+        conn.execute(clusters.update().where(clusters.c.projectID == projectID, clusters.c.run == run)
+                     .values(version=version))
+        if len(rows):
+            conn.execute(clusters.insert(), rows.to_dict(orient='records'))
+
+
+def project_clusters(projectID, data_type='PCA', model='agglom', k=4, linkage='complete', frame=None):
+    """
+    Returns the clustering of a project's MWD rows for the given parameters. Results are looked up in
+    this worker's memory first, then in the BlastCluster table. When the project's data version changed
+    since, the rows added are labelled with the models saved in the model registry, and the clustering
+    is only refit when the refit policy of extend_clusters requires it. Projects with more rows than
+    CLUSTER_SCALABLE_ROWS are clustered with the scalable mode of cluster_data.
+
+    Returns
+    -------
+    A Pandas DataFrame with the columns holeID, Depth, CID, x and y, aligned with the rows of
+    load_project(projectID).
+    """
+    config = current_app.config
+    frame = load_project(projectID) if frame is None else frame
+    scalable = len(frame) > config['CLUSTER_SCALABLE_ROWS']
+    run = run_key(data_type, model, k, linkage, scalable)
+    version = data_version('MWD', projectID)
+    key = ('BlastCluster', projectID, run)
+
+    previous = cluster_cache.peek(key)
+    result = cluster_cache.get(key, version)
+    if result is not None:
+        return result
+
+    stored, stored_version = _read_stored(projectID, run)
+    if stored is not None and stored_version == version:
+        aligned = _aligned(stored, frame)
+        if aligned is not None:
+            return cluster_cache.put(key, aligned, version)
+    previous = stored if stored is not None else previous
+
+    state = load_model(projectID, run)
+    result = None
+    if state is not None and previous is not None:
+        result = extend_clusters(frame, previous, state, config['CLUSTER_REFIT_FRACTION'],
+                                 config['CLUSTER_DRIFT_THRESHOLD'])
+    if result is not None and stored is not None and not _keys(stored).has_duplicates:
+        # Only the rows labelled since the stored version are written
+        _append(projectID, run, version, result, _keys(stored).get_indexer(_keys(frame)) == -1, len(stored))
+    else:
+        if result is None:
+            result, state = fit_clusters(frame, data_type, model, k, linkage, scalable,
+                                         config['CLUSTER_SAMPLE_SIZE'])
+        _store(projectID, run, version, result)
+    state['version'] = version
+    save_model(projectID, run, state)
+
+    store_hole_clusters(projectID, run, version, result)
+    return cluster_cache.put(key, result, version)
+
+
+def project_hole_clusters(projectID, data_type='PCA', model='agglom', k=4, linkage='complete'):
+    """
+    Returns the most common cluster of each hole of a project, as a Series by holeID. Read from the
+    HoleCluster table when the clustering of the current data was already computed, otherwise the
+    project is clustered with project_clusters.
+    """
+    n_rows = hole_summary(projectID).row_count.sum()
+    run = run_key(data_type, model, k, linkage, n_rows > current_app.config['CLUSTER_SCALABLE_ROWS'])
+    dominant = hole_clusters(projectID, run, data_version('MWD', projectID))
+    if dominant is None:
+        dominant = dominant_clusters(project_clusters(projectID, data_type, model, k, linkage))
+    return dominant
@@ -0,0 +1,157 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from flask import current_app, has_app_context
+from ..config import Config
+
+
+class MappedProject:
+    """
+    The MWD rows of one project at one data version, memory mapped from the column store:
+
+    sensors.npy: float32 array of shape (features, rows), so each sensor column is contiguous
+    depth.npy: float64 array of the depth of each row
+    holes.npy: int32 array of the index of each row's hole in meta['holes']
+    meta.json: the projectID, version, feature names, sorted holeIDs and the first row of each hole
+
+    Rows are sorted by holeID and depth, so every hole is a contiguous slice of each array. The arrays
+    can also come from elsewhere, e.g. shared memory (see shared_frames.py).
+    """
+    def __init__(self, meta, sensors, depth, codes):
+        self.meta = meta
+        self.sensors = sensors
+        self.depth = depth
+        self.codes = codes
+        self.holes = meta['holes']
+        self.offsets = meta['offsets']  # Row where each hole starts, plus the number of rows
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, 'meta.json')) as file:
+            meta = json.load(file)
+        return cls(meta, np.load(os.path.join(directory, 'sensors.npy'), mmap_mode='r'),
+                   np.load(os.path.join(directory, 'depth.npy'), mmap_mode='r'),
+                   np.load(os.path.join(directory, 'holes.npy'), mmap_mode='r'))
+
+    def frame(self, start=0, stop=None):
+        """
+        Returns rows start:stop as a DataFrame with the columns of data_access.MWD_COLUMNS. The sensor
+        columns are a view of the mapped file, so only the pages read are loaded.
+        """
+        stop = len(self.depth) if stop is None else stop
+        frame = pd.DataFrame(self.sensors[:, start:stop].T, columns=self.meta['features'], copy=False)
+        frame.insert(0, 'projectID', pd.Categorical.from_codes(np.zeros(stop - start, dtype=np.int8),
+                                                               [self.meta['projectID']]))
+        frame['holeID'] = pd.Categorical.from_codes(self.codes[start:stop], self.holes)
+        frame['Depth'] = self.depth[start:stop]
+        return frame
+
+    def hole(self, holeID):
+        """
+        Returns the rows of a hole, or an empty frame if the project has no such hole.
+        """
+        position = np.searchsorted(self.holes, holeID)
+        if position == len(self.holes) or self.holes[position] != holeID:
+            return self.frame(0, 0)
+        return self.frame(self.offsets[position], self.offsets[position + 1]).reset_index(drop=True)
+
+
+class ColumnStore:
+    """
+    An optional local store of the MWD sensor columns of each project, as memory mapped .npy files under
+    <COLUMN_STORE_DIR>/<projectID>/<data version>/. Disabled unless COLUMN_STORE_DIR is set. Files are
+    written on ingest (see ingest.py) or on the first read of a version, and the files of older versions
+    are removed.
+    """
+    def __init__(self):
+        self._mapped = {}  # projectID -> MappedProject of the last version opened
+        self._lock = threading.Lock()
+
+    def root(self):
+        return current_app.config['COLUMN_STORE_DIR'] if has_app_context() else Config.COLUMN_STORE_DIR
+
+    def enabled(self):
+        return bool(self.root())
+
+    def _directory(self, projectID, version):
+        return os.path.join(self.root(), _safe(projectID), str(version))
+
+    def open(self, projectID, version):
+        """
+        Returns the MappedProject of a project at a data version, or None if it is not stored.
+        """
+        with self._lock:
+            mapped = self._mapped.get(projectID)
+            if mapped is not None and mapped.meta['version'] == version:
+                return mapped
+            try:
+                mapped = MappedProject.load(self._directory(projectID, version))
+            except OSError:
+                return None
+            self._mapped[projectID] = mapped
+            return mapped
+
+    def _versions(self, projectID):
+        # The data versions stored for a project, by directory name
+        try:
+            names = os.listdir(os.path.join(self.root(), _safe(projectID)))
+        except FileNotFoundError:
+            return {}
+        return {int(name): name for name in names if name.isdigit()}
+
+    def write(self, projectID, version, frame, features):
+        """
+        Stores the MWD rows of a project at a data version (see pack_project), and removes the older versions.
+        Nothing is written when a newer version is already stored, e.g. by a worker that saw the change first.
+        """
+        if any(stored > int(version) for stored in self._versions(projectID)):
+            return
+        directory = self._directory(projectID, version)
+        os.makedirs(os.path.dirname(directory), exist_ok=True)
+        temp = tempfile.mkdtemp(dir=os.path.dirname(directory), prefix=f'{version}.', suffix='.tmp')
+
+        packed = pack_project(projectID, version, frame, features)
+        np.save(os.path.join(temp, 'sensors.npy'), packed.sensors)
+        np.save(os.path.join(temp, 'depth.npy'), packed.depth)
+        np.save(os.path.join(temp, 'holes.npy'), packed.codes)
+        with open(os.path.join(temp, 'meta.json'), 'w') as file:
+            json.dump(packed.meta, file)
+
+        try:
+            os.replace(temp, directory)
+        except OSError:  # Another worker stored the version first
+            shutil.rmtree(temp, ignore_errors=True)
+        self._prune(projectID, int(version))
+
+    def _prune(self, projectID, version):
+        # Removes the versions older than version; newer ones, written meanwhile by other workers, are kept
+        project_dir = os.path.join(self.root(), _safe(projectID))
+        for stored, name in self._versions(projectID).items():
+            if stored < version:
+                shutil.rmtree(os.path.join(project_dir, name), ignore_errors=True)
+
+
+def pack_project(projectID, version, frame, features):
+    """
+    Returns the MWD rows of a project as the in-memory arrays of a MappedProject. frame must hold the
+    holeID, Depth and feature columns, sorted by Depth within each hole.
+    """
+    holes, codes = np.unique(frame.holeID.astype(str).values, return_inverse=True)
+    order = np.argsort(codes, kind='stable')  # Keeps the depth order within each hole
+    frame, codes = frame.iloc[order], codes[order]
+    offsets = np.searchsorted(codes, np.arange(len(holes) + 1))
+    meta = {'projectID': str(projectID), 'version': version, 'features': list(features),
+            'holes': holes.tolist(), 'offsets': offsets.tolist()}
+    return MappedProject(meta, np.ascontiguousarray(frame[features].values.T, dtype=np.float32),
+                         frame.Depth.values.astype(np.float64), codes.astype(np.int32))
+
+
+def _safe(name):
+    return ''.join(char if char.isalnum() or char in '-_.' else '_' for char in str(name))
+
+
+column_store = ColumnStore()
@@ -0,0 +1,217 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import column, distinct, literal_column, select, table
+from .. import engine
+from ..models import DataVersion
+from .cache import frame_cache
+from .column_store import column_store
+from .shared_frames import shared_frames
+from ..instrumentation import stage
+
+# Sensor columns of the MWD table used for plotting and clustering
+FEATURES = ['PenetrRate', 'PercPressure', 'FeedPressure', 'RotPressure', 'InstPentRate']
+# Columns loaded for the routes. The features sit at positions 1:6, where the plotting functions expect them
+MWD_COLUMNS = ['projectID'] + FEATURES + ['holeID', 'Depth']
+POSITION_COLUMNS = ['projectID', 'holeID', 'start_x', 'start_y']
+
+
+def _query(tablename, columns=None, order_by=(), **filters):
+    """
+    Builds a parameterized SELECT over a table, projected to the given columns and filtered on equality
+    of each keyword argument.
+
+    Parameters
+    ----------
+    tablename: String
+        The name of the table to query.
+    columns: list of String
+        The columns to select, in order. If None, every column of the table is selected.
+    order_by: tuple of String
+        The columns to sort the rows by.
+    filters:
+        Column name to value pairs, bound as query parameters.
+
+    Returns
+    -------
+    A SQLAlchemy Select object.
+    """
+    names = list(dict.fromkeys(list(columns or []) + list(filters) + list(order_by)))
+    tbl = table(tablename, *[column(name) for name in names])
+    fields = [tbl.c[name] for name in columns] if columns else [literal_column('*')]
+
+    query = select(*fields).select_from(tbl)
+    for name, value in filters.items():
+        query = query.where(tbl.c[name] == value)
+    return query.order_by(*[tbl.c[name] for name in order_by])
+
+
+def _read(query):
+    with stage('db'):
+        return pd.read_sql(query, engine.resolve())
+
+
+def compact(frame):
+    """
+    Shrinks a frame for caching: holeID/projectID become categoricals and the sensor columns float32.
+    """
+    frame = frame.copy()
+    for name in ('projectID', 'holeID'):
+        if name in frame.columns:
+            frame[name] = frame[name].astype('category')
+    for name in FEATURES:
+        if name in frame.columns:
+            frame[name] = frame[name].astype(np.float32)
+    return frame
+
+
+def data_version(tablename, projectID):
+    """
+    Returns the current data version of a project in a table, or 0 if it was never recorded.
+    """
+    versions = DataVersion.__table__
+    query = select(versions.c.version).where(versions.c.tablename == tablename,
+                                             versions.c.projectID == projectID)
+    with engine.connect() as conn:
+        return conn.execute(query).scalar() or 0
+
+
+def project_stamp(projectID):
+    """
+    Returns a string identifying the current data versions of a project's MWD rows and hole positions,
+    for keying artifacts rendered from either.
+    """
+    versions = DataVersion.__table__
+    query = select(versions.c.tablename, versions.c.version).where(
+        versions.c.projectID == projectID, versions.c.tablename.in_(['MWD', 'HolePositions']))
+    with engine.connect() as conn:
+        found = dict(conn.execute(query).fetchall())
+    return f"{found.get('MWD', 0)}.{found.get('HolePositions', 0)}"
+
+
+def bump_data_version(tablename, projectIDs=(), replaced=False):
+    """
+    Increments the data version of the given projects of a table after their rows changed, and drops
+    them from this process' cache. If the whole table was replaced, every project recorded for the
+    table is bumped as well.
+    """
+    versions = DataVersion.__table__
+    projectIDs = {str(projectID) for projectID in projectIDs}
+    with engine.begin() as conn:
+        versions.create(bind=conn, checkfirst=True)
+        bump = versions.update().where(versions.c.tablename == tablename)
+        if not replaced:
+            bump = bump.where(versions.c.projectID.in_(projectIDs))
+        conn.execute(bump.values(version=versions.c.version + 1))
+
+        known = select(versions.c.projectID).where(versions.c.tablename == tablename)
+        missing = projectIDs - {row[0] for row in conn.execute(known)}
+        if missing:
+            conn.execute(versions.insert(), [{'tablename': tablename, 'projectID': projectID, 'version': 1}
+                                             for projectID in missing])
+
+    if replaced:
+        frame_cache.invalidate(table=tablename)
+    else:
+        for projectID in projectIDs:
+            frame_cache.invalidate(table=tablename, projectID=projectID)
+
+
+def _cached(tablename, projectID, load):
+    # Only the default projection is cached, so every route shares one frame per project
+    version = data_version(tablename, projectID)
+    frame = frame_cache.get((tablename, projectID), version)
+    if frame is None:
+        frame = frame_cache.put((tablename, projectID), compact(load()), version)
+    return frame
+
+
+def load_project(projectID, columns=MWD_COLUMNS):
+    """
+    Reads the MWD rows of one project, sorted by holeID and Depth so each hole is contiguous.
+    Served by the (projectID, holeID, Depth) index, and cached per worker for the default columns.
+    With the column store enabled the default columns are mapped from its files instead, which are
+    written from the database on the first read of a data version. With shared memory frames enabled,
+    they are mapped from a segment shared by every worker of the machine.
+    """
+    query = _query('MWD', columns, order_by=('holeID', 'Depth'), projectID=projectID)
+    if columns != MWD_COLUMNS:
+        return _read(query)
+    mapped = _shared(projectID, query)
+    if mapped is not None:
+        return mapped.frame()
+    if column_store.enabled():
+        version = data_version('MWD', projectID)
+        mapped = column_store.open(projectID, version)
+        if mapped is None:
+            frame = _read(query)
+            column_store.write(projectID, version, frame, FEATURES)
+            mapped = column_store.open(projectID, version)
+            if mapped is None:  # A newer version is stored, this one was not written
+                return _cached('MWD', projectID, lambda: frame)
+        return mapped.frame()
+    return _cached('MWD', projectID, lambda: _read(query))
+
+
+def _shared(projectID, query, version=None):
+    # The project's rows from shared memory, or None if disabled or unavailable. The first worker to read
+    # a version fills the segment, from the column store if it holds it
+    if not shared_frames.enabled():
+        return None
+    version = data_version('MWD', projectID) if version is None else version
+
+    def load():
+        stored = column_store.open(projectID, version) if column_store.enabled() else None
+        return stored.frame() if stored is not None else _read(query)
+    return shared_frames.project(projectID, version, load, FEATURES)
+
+
+def load_hole(projectID, holeID, columns=MWD_COLUMNS):
+    """
+    Reads the MWD rows of a single hole of a project, sorted by Depth. If the project is already cached
+    or in the column store, the hole is sliced from it instead.
+    """
+    if columns == MWD_COLUMNS:
+        version = data_version('MWD', projectID)
+        if shared_frames.enabled():
+            query = _query('MWD', columns, order_by=('holeID', 'Depth'), projectID=projectID)
+            mapped = _shared(projectID, query, version)
+            if mapped is not None:
+                return mapped.hole(holeID)
+        if column_store.enabled():
+            mapped = column_store.open(projectID, version)
+            if mapped is not None:
+                return mapped.hole(holeID)
+        project = frame_cache.get(('MWD', projectID), version)
+        if project is not None:
+            return project[project.holeID == holeID].reset_index(drop=True)
+    query = _query('MWD', columns, order_by=('Depth',), projectID=projectID, holeID=holeID)
+    return _read(query)
+
+
+def sync_column_store(projectID):
+    """
+    Writes the current MWD rows of a project to the column store, if it is enabled.
+    """
+    if column_store.enabled():
+        query = _query('MWD', MWD_COLUMNS, order_by=('holeID', 'Depth'), projectID=projectID)
+        column_store.write(projectID, data_version('MWD', projectID), _read(query), FEATURES)
+
+
+def load_positions(projectID, columns=POSITION_COLUMNS):
+    """
+    Reads the hole positions of a project, sorted by holeID to match the hole order of load_project.
+    """
+    query = _query('HolePositions', columns, order_by=('holeID',), projectID=projectID)
+    if columns != POSITION_COLUMNS:
+        return _read(query)
+    return _cached('HolePositions', projectID, lambda: _read(query))
+
+
+def hole_ids(projectID):
+    """
+    Returns the sorted list of distinct holeIDs drilled in a project.
+    """
+    tbl = table('MWD', column('holeID'), column('projectID'))
+    query = select(distinct(tbl.c.holeID)).where(tbl.c.projectID == projectID).order_by(tbl.c.holeID)
+    with engine.connect() as conn:
+        return [row[0] for row in conn.execute(query)]
@@ -0,0 +1,57 @@
+import numpy as np
+from .cache import frame_cache
+from .data_access import load_project, data_version
+
+
+class DepthIndex:
+    """
+    Nearest-depth lookup over the MWD rows of a project. The rows of load_project are sorted by holeID
+    and Depth, so each hole is a contiguous, depth sorted segment, found with np.searchsorted instead of
+    masking the whole project frame.
+    """
+    def __init__(self, frame):
+        holes = frame.holeID.astype('category')
+        codes = holes.cat.codes.values
+        starts = np.r_[0, np.flatnonzero(np.diff(codes)) + 1] if len(codes) else np.array([], dtype=int)
+        ends = np.r_[starts[1:], len(codes)]
+        self.depth = frame.Depth.values
+        self.segments = {str(holes.cat.categories[codes[start]]): (start, end) for start, end in zip(starts, ends)}
+
+    @property
+    def nbytes(self):
+        # Approximate memory held, for the byte bound of the frame cache
+        return self.depth.nbytes + 200 * len(self.segments)
+
+    def nearest(self, holeIDs, depths):
+        """
+        Returns the row position (in load_project's order) of the row of each hole nearest to each depth,
+        or -1 where the project has no such hole. On a tie the shallower row is returned.
+        """
+        holeIDs = np.asarray(holeIDs, dtype=str)
+        depths = np.asarray(depths, dtype=float)
+        rows = np.full(len(depths), -1, dtype=np.int64)
+        for hole in np.unique(holeIDs):
+            if hole not in self.segments:
+                continue
+            start, end = self.segments[hole]
+            queries = np.flatnonzero(holeIDs == hole)
+            segment = self.depth[start:end]
+            right = np.clip(np.searchsorted(segment, depths[queries]), 0, len(segment) - 1)
+            left = np.clip(right - 1, 0, len(segment) - 1)
+            closer_left = np.abs(depths[queries] - segment[left]) <= np.abs(segment[right] - depths[queries])
+            rows[queries] = start + np.where(closer_left, left, right)
+        return rows
+
+
+def depth_index(projectID, frame=None):
+    """
+    Returns the DepthIndex of a project's current MWD rows, building it from frame (or load_project)
+    when the project's data version changed. Indexes are held in this worker's frame cache, so they count
+    against its memory bound like the frames they are built from.
+    """
+    version = data_version('MWD', projectID)
+    index = frame_cache.get(('DepthIndex', projectID), version)
+    if index is None:
+        index = frame_cache.put(('DepthIndex', projectID),
+                                DepthIndex(load_project(projectID) if frame is None else frame), version)
+    return index
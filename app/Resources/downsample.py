@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+
+def lttb(x, y, points):
+    """
+    Largest-Triangle-Three-Buckets downsampling: keeps the first and last rows, and from each of points - 2
+    equal-count buckets in between, the row forming the largest triangle with the row kept in the previous
+    bucket and the mean of the next bucket. Peaks and troughs of the curve are preserved.
+
+    Parameters
+    ----------
+    x: numpy array
+        The sorted x coordinate of each row (the depth).
+    y: numpy array
+        The value of each row.
+    points: int
+        The number of rows to keep.
+
+    Returns
+    -------
+    A sorted numpy array of the positions of the rows kept.
+    """
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+    every = (n - 2) / (points - 2)
+    # Bucket bounds, and the mean of each bucket in one pass; the last row is the 'bucket' after the last one
+    bounds = np.minimum((np.arange(points - 1) * every).astype(np.int64) + 1, n - 1)
+    bounds[-1] = n - 1
+    counts = np.diff(np.append(bounds, n))
+    mean_x = np.add.reduceat(x, bounds) / counts
+    mean_y = np.add.reduceat(y, bounds) / counts
+
+    kept = np.empty(points, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(points - 2):
+        start, end = bounds[bucket], bounds[bucket + 1]
+        next_x, next_y = mean_x[bucket + 1], mean_y[bucket + 1]
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    return kept
+
+
+def min_max(x, y, points):
+    """
+    Min/max downsampling: splits the x range into points // 2 equal buckets and keeps the rows with the
+    smallest and largest value of each, so every spike stays visible.
+
+    Returns
+    -------
+    A sorted numpy array of the positions of the rows kept.
+    """
+    n = len(x)
+    buckets = max(1, points // 2)
+    if n <= points:
+        return np.arange(n)
+    span = x[-1] - x[0]
+    bucket = np.zeros(n, dtype=np.int64) if span <= 0 else \
+        np.minimum(((x - x[0]) / span * buckets).astype(np.int64), buckets - 1)
+    groups = pd.Series(y).groupby(bucket)
+    return np.unique(np.concatenate([groups.idxmin().values, groups.idxmax().values]))
+
+
+METHODS = {'lttb': lttb, 'minmax': min_max}
+
+
+def downsample_series(frame, features, points, method='lttb'):
+    """
+    Downsamples each feature curve of a hole against its depth.
+
+    Parameters
+    ----------
+    frame: Pandas DataFrame
+        The rows of a hole, sorted by Depth.
+    features: list of String
+        The feature columns to downsample.
+    points: int
+        The largest number of points to return per feature.
+    method: String
+        'lttb' or 'minmax'.
+
+    Returns
+    -------
+    A dictionary of feature -> (depths, values) float32 numpy arrays. Rows missing the depth or the value
+    are dropped first.
+    """
+    select = METHODS[method]
+    depth = frame.Depth.values.astype(np.float64)
+    series = {}
+    for feature in features:
+        values = frame[feature].values.astype(np.float64)
+        present = ~(np.isnan(depth) | np.isnan(values))
+        x, y = depth[present], values[present]
+        kept = select(x, y, points)
+        series[feature] = (x[kept].astype(np.float32), y[kept].astype(np.float32))
+    return series
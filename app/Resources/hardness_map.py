@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+from flask import current_app
+from ..instrumentation import timed
+from .cache import frame_cache
+from .data_access import FEATURES, load_project, load_positions, project_stamp
+from .plotting import HARDNESS_NAMES
+from .rollups import depth_rollups
+
+
+@timed('hardness_map')
+def compute_hardness_map(frame, rollups, positions, percentiles=(10, 50, 90)):
+    """
+    Computes the hardness and feature percentiles of every hole of a project at once.
+
+    Parameters
+    ----------
+    frame: Pandas DataFrame
+        The MWD rows of the project, as returned by load_project.
+    rollups: Pandas DataFrame
+        The project's depth rollups at the resolution the hardness is classified at (see rollups.py).
+    positions: Pandas DataFrame
+        The hole positions of the project, joined on holeID.
+    percentiles: tuple of int
+        The percentiles of each feature to compute.
+
+    Returns
+    -------
+    A Pandas DataFrame with a row per hole, sorted by holeID: its start_x/start_y, depth range, the share
+    of its binned depth in each hardness class, its dominant class (hardness, -1 without any PenetrRate)
+    and the <feature>_p<percentile> columns.
+    """
+    holes = frame.holeID.astype(str).values
+    grouped = frame[FEATURES].groupby(holes, sort=True)
+    levels = [q / 100 for q in percentiles]
+    quantiles = grouped.quantile(levels).unstack().reindex(columns=pd.MultiIndex.from_product([FEATURES, levels]))
+    quantiles.columns = [f'{feature}_p{percentile}' for feature in FEATURES for percentile in percentiles]
+    result = frame.Depth.groupby(holes, sort=True).agg(['min', 'max']) \
+        .rename(columns={'min': 'depth_min', 'max': 'depth_max'}).join(quantiles)
+
+    # Share of each hole's classified bins in each class, from one crosstab of the rollups
+    classified = rollups[rollups.hardness >= 0]
+    shares = pd.crosstab(classified.holeID.astype(str).values, classified.hardness.values, normalize='index') \
+        .reindex(columns=range(len(HARDNESS_NAMES)), fill_value=0.0)
+    shares.columns = HARDNESS_NAMES
+    result = result.join(shares)
+    result[HARDNESS_NAMES] = result[HARDNESS_NAMES].fillna(0.0)
+    dominant = result[HARDNESS_NAMES].values.argmax(axis=1)
+    result['hardness'] = np.where(result[HARDNESS_NAMES].values.sum(axis=1) > 0, dominant, -1)
+
+    result.index.name = 'holeID'
+    positions = positions[['holeID', 'start_x', 'start_y']].astype({'holeID': str}).drop_duplicates('holeID')
+    return positions.merge(result.reset_index(), on='holeID', how='right')
+
+
+def hardness_map(projectID, percentiles=(10, 50, 90)):
+    """
+    Returns the hardness map of a project (see compute_hardness_map), cached per worker until the project's
+    MWD rows or hole positions change.
+    """
+    stamp = project_stamp(projectID)
+    key = ('HardnessMap', projectID, tuple(percentiles))
+    result = frame_cache.get(key, stamp)
+    if result is None:
+        rollups = depth_rollups(projectID, current_app.config['HARDNESS_RESOLUTION'])
+        result = frame_cache.put(key, compute_hardness_map(load_project(projectID), rollups,
+                                                           load_positions(projectID), percentiles), stamp)
+    return result
@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+from .. import engine
+from ..models import HoleAggregate
+from .data_access import FEATURES, load_project
+from .plotting import HARDNESS_NAMES, hardness_classes
+
+COUNT_COLUMNS = ['rows'] + HARDNESS_NAMES + [feature + '_n' for feature in FEATURES]
+
+
+def batch_aggregates(frame):
+    """
+    Aggregates MWD rows per hole in a single groupby pass: the row count, depth range, the number of samples
+    of each PenetrRate hardness class, and for each feature the count, mean and sum of squared deviations
+    from the mean (m2) of its non-missing values. A feature missing from every row counts 0 values.
+
+    Returns
+    -------
+    A Pandas DataFrame with a row per holeID and the columns of the HoleAggregate table.
+    """
+    rates = frame.PenetrRate.values.astype(float)
+    classes = np.where(np.isnan(rates), -1, hardness_classes(rates))
+    # Features without any value are object columns of None, which groupby mean/var would leave out
+    values = frame.assign(holeID=frame.holeID.astype(str).values,
+                          **{name: classes == number for number, name in enumerate(HARDNESS_NAMES)})
+    values[FEATURES] = values[FEATURES].astype(float)
+    groups = values.groupby('holeID', sort=True)
+    aggregates = groups.agg(rows=('Depth', 'size'), depth_min=('Depth', 'min'), depth_max=('Depth', 'max'),
+                            **{name: (name, 'sum') for name in HARDNESS_NAMES})
+    counts, means = groups[FEATURES].count(), groups[FEATURES].mean()
+    m2 = groups[FEATURES].var(ddof=0) * counts
+    for feature in FEATURES:
+        aggregates[feature + '_n'] = counts[feature]
+        aggregates[feature + '_mean'] = means[feature]
+        aggregates[feature + '_m2'] = m2[feature].fillna(0)
+    return aggregates.reset_index()
+
+
+def merge_aggregates(current, batch):
+    """
+    Combines the aggregates of the same holes over two sets of rows (e.g. the stored aggregates and a new
+    batch), with the parallel form of Welford's algorithm for the means and m2, so no earlier rows are
+    read again. Holes missing from either side keep the aggregates of the other.
+    """
+    holes = pd.Index(sorted(set(current.holeID) | set(batch.holeID)), name='holeID')
+    merged = pd.DataFrame(index=holes)
+    left = current.set_index('holeID').astype(float).reindex(holes)
+    right = batch.set_index('holeID').astype(float).reindex(holes)
+
+    merged['rows'] = left.rows.fillna(0) + right.rows.fillna(0)
+    for name in HARDNESS_NAMES:
+        merged[name] = left[name].fillna(0) + right[name].fillna(0)
+    merged['depth_min'] = np.fmin(left.depth_min, right.depth_min)
+    merged['depth_max'] = np.fmax(left.depth_max, right.depth_max)
+    for feature in FEATURES:
+        n_a, n_b = left[feature + '_n'].fillna(0), right[feature + '_n'].fillna(0)
+        mean_a, mean_b = left[feature + '_mean'].fillna(0), right[feature + '_mean'].fillna(0)
+        n = n_a + n_b
+        delta = mean_b - mean_a
+        with np.errstate(invalid='ignore', divide='ignore'):
+            merged[feature + '_n'] = n
+            merged[feature + '_mean'] = (mean_a + delta * n_b / n).where(n > 0)
+            merged[feature + '_m2'] = (left[feature + '_m2'].fillna(0) + right[feature + '_m2'].fillna(0)
+                                       + delta ** 2 * n_a * n_b / n).where(n > 0, 0)
+    merged[COUNT_COLUMNS] = merged[COUNT_COLUMNS].astype(np.int64)
+    return merged.reset_index()
+
+
+def _rows(projectID, aggregates):
+    return aggregates.astype(object).where(aggregates.notna(), None).assign(projectID=projectID) \
+        .to_dict(orient='records')
+
+
+def update_hole_aggregates(conn, projectID, frame):
+    """
+    Adds MWD rows of a project to the stored aggregates of their holes, in the caller's transaction. On
+    PostgreSQL the holes' rows are locked first, so concurrent batches of the same hole are applied in turn.
+    """
+    aggregates = HoleAggregate.__table__
+    batch = batch_aggregates(frame)
+    query = select(aggregates).where(aggregates.c.projectID == projectID,
+                                     aggregates.c.holeID.in_(batch.holeID.tolist()))
+    if conn.dialect.name == 'postgresql':
+        query = query.with_for_update()
+    current = pd.DataFrame(conn.execute(query).fetchall(), columns=[c.name for c in aggregates.c]) \
+        .drop(columns='projectID')
+    merged = merge_aggregates(current, batch) if len(current) else batch
+    conn.execute(aggregates.delete().where(aggregates.c.projectID == projectID,
+                                           aggregates.c.holeID.in_(batch.holeID.tolist())))
+    conn.execute(aggregates.insert(), _rows(projectID, merged))
+    return merged
+
+
+def rebuild_hole_aggregates(projectID):
+    """
+    Recomputes the aggregates of every hole of a project from its current MWD rows, after a bulk ingest.
+    """
+    aggregates = HoleAggregate.__table__
+    rows = _rows(projectID, batch_aggregates(load_project(projectID)))
+    with engine.begin() as conn:
+        aggregates.create(bind=conn, checkfirst=True)
+        conn.execute(aggregates.delete().where(aggregates.c.projectID == projectID))
+        if rows:
+            conn.execute(aggregates.insert(), rows)
+
+
+def hole_aggregates(projectID, holeIDs=None):
+    """
+    Returns the stored aggregates of a project's holes (all of them, or the given holeIDs), sorted by holeID,
+    with the standard deviation (ddof=0, as StandardScaler) of each feature.
+    """
+    aggregates = HoleAggregate.__table__
+    query = select(*[c for c in aggregates.c if c.name != 'projectID']) \
+        .where(aggregates.c.projectID == projectID).order_by(aggregates.c.holeID)
+    if holeIDs is not None:
+        query = query.where(aggregates.c.holeID.in_(list(holeIDs)))
+    frame = pd.read_sql(query, engine.resolve())
+    for feature in FEATURES:
+        frame[feature + '_std'] = np.sqrt(frame[feature + '_m2'] / frame[feature + '_n'].where(frame[feature + '_n'] > 0))
+    return frame
+
+
+def feature_stats(projectID):
+    """
+    Returns the count, mean and variance (ddof=0) of each feature over every MWD row of a project, combined
+    from the hole aggregates, as a DataFrame indexed by feature.
+    """
+    holes = hole_aggregates(projectID)
+    stats = {}
+    for feature in FEATURES:
+        n, mean, m2 = holes[feature + '_n'], holes[feature + '_mean'].fillna(0), holes[feature + '_m2'].fillna(0)
+        total = n.sum()
+        project_mean = (n * mean).sum() / total if total else np.nan
+        # Total m2 is the holes' m2 plus the spread of the hole means around the project mean
+        project_m2 = m2.sum() + (n * (mean - project_mean) ** 2).sum() if total else np.nan
+        stats[feature] = {'n': int(total), 'mean': project_mean, 'var': project_m2 / total if total else np.nan}
+    return pd.DataFrame.from_dict(stats, orient='index')
+
+
+def running_scaler(projectID):
+    """
+    Returns a StandardScaler fitted to a project's MWD rows from its running feature statistics, without
+    reading the rows.
+    """
+    from sklearn.preprocessing import StandardScaler
+    stats = feature_stats(projectID)
+    scaler = StandardScaler()
+    scaler.mean_ = stats['mean'].values.astype(float)
+    scaler.var_ = stats['var'].values.astype(float)
+    scaler.scale_ = np.where(scaler.var_ > 0, np.sqrt(scaler.var_), 1.0)
+    scaler.n_samples_seen_ = int(stats['n'].min())
+    scaler.n_features_in_ = len(FEATURES)
+    return scaler
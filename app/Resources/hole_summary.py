@@ -0,0 +1,133 @@
+import pandas as pd
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from .. import engine
+from ..instrumentation import stage
+from ..models import HoleSummary, HoleCluster
+from .cache import frame_cache
+from .data_access import FEATURES, load_project, load_positions, project_stamp
+
+
+# holeID of the row stored for a project without any hole
+_EMPTY = ''
+
+
+def summarize_holes(frame, positions=None):
+    """
+    Summarizes the MWD rows of a project per hole in a single groupby pass.
+
+    Parameters
+    ----------
+    frame: Pandas DataFrame
+        The MWD rows of a project, as returned by load_project.
+    positions: Pandas DataFrame
+        The hole positions of the project, joined on holeID if given.
+
+    Returns
+    -------
+    A Pandas DataFrame with a row per hole, sorted by holeID: the offset of its first row in frame, its
+    row count, the min/max of Depth and of each feature, and its start_x/start_y position.
+    """
+    aggregations = {'row_offset': ('_row', 'min'), 'row_count': ('_row', 'size'),
+                    'depth_min': ('Depth', 'min'), 'depth_max': ('Depth', 'max')}
+    for feature in FEATURES:
+        aggregations[feature + '_min'] = (feature, 'min')
+        aggregations[feature + '_max'] = (feature, 'max')
+    summary = frame.assign(_row=range(len(frame)), holeID=frame.holeID.astype(str)) \
+        .groupby('holeID').agg(**aggregations).reset_index()
+    if positions is not None:
+        summary = summary.merge(positions[['holeID', 'start_x', 'start_y']].astype({'holeID': str}),
+                                on='holeID', how='left')
+    else:
+        summary['start_x'] = summary['start_y'] = None
+    return summary
+
+
+def refresh_hole_summary(projectID):
+    """
+    Rebuilds the HoleSummary rows of a project from its current MWD rows and hole positions. A project
+    without rows (e.g. an unknown projectID) is stored as a single row with an empty holeID, so it is not
+    rebuilt on every read.
+    """
+    stamp = project_stamp(projectID)
+    summary = summarize_holes(load_project(projectID), load_positions(projectID))
+    rows = summary.astype(object).where(summary.notna(), None).assign(projectID=projectID, stamp=stamp) \
+        .to_dict(orient='records')
+    if not rows:
+        rows = [{'projectID': projectID, 'holeID': _EMPTY, 'stamp': stamp, 'row_count': 0}]
+    summaries = HoleSummary.__table__
+    try:
+        with engine.begin() as conn:
+            summaries.create(bind=conn, checkfirst=True)
+            conn.execute(summaries.delete().where(summaries.c.projectID == projectID))
+            conn.execute(summaries.insert(), rows)
+    except IntegrityError:  # Another worker rebuilt it at the same time
+        pass
+    return frame_cache.put(('HoleSummary', projectID), summary, stamp)
+
+
+def hole_summary(projectID):
+    """
+    Returns the hole summary of a project (see summarize_holes), from this worker's cache or the
+    HoleSummary table. It is rebuilt if the project's data changed since it was stored.
+    """
+    stamp = project_stamp(projectID)
+    summary = frame_cache.get(('HoleSummary', projectID), stamp)
+    if summary is not None:
+        return summary
+
+    summaries = HoleSummary.__table__
+    query = select(*[c for c in summaries.c if c.name not in ('projectID', 'stamp')]) \
+        .where(summaries.c.projectID == projectID, summaries.c.stamp == stamp).order_by(summaries.c.holeID)
+    with stage('db'):
+        summary = pd.read_sql(query, engine.resolve())
+    if summary.empty:
+        return refresh_hole_summary(projectID)
+    summary = summary[summary.holeID != _EMPTY].reset_index(drop=True)
+    return frame_cache.put(('HoleSummary', projectID), summary, stamp)
+
+
+def hole_depths(projectID):
+    """
+    Returns the drilled depth (max - min Depth) of each hole of a project, as a Series by holeID.
+    """
+    summary = hole_summary(projectID)
+    return pd.Series((summary.depth_max - summary.depth_min).values, index=summary.holeID.values)
+
+
+def dominant_clusters(result):
+    """
+    Returns the most common cluster label (CID) of each hole in a clustering result, as a Series by holeID.
+    """
+    return pd.crosstab(result.holeID.astype(str).values, result.CID.values).idxmax(axis=1)
+
+
+def store_hole_clusters(projectID, run, version, result):
+    clusters = HoleCluster.__table__
+    dominant = dominant_clusters(result)
+    rows = [{'projectID': projectID, 'run': run, 'holeID': hole, 'version': version, 'CID': int(cid)}
+            for hole, cid in dominant.items()]
+    try:
+        with engine.begin() as conn:
+            clusters.create(bind=conn, checkfirst=True)
+            conn.execute(clusters.delete().where(clusters.c.projectID == projectID, clusters.c.run == run))
+            if rows:
+                conn.execute(clusters.insert(), rows)
+    except IntegrityError:
+        pass
+    return dominant
+
+
+def hole_clusters(projectID, run, version):
+    """
+    Returns the stored dominant cluster of each hole for a clustering run at a data version, as a Series
+    by holeID, or None if it was not stored for that version.
+    """
+    clusters = HoleCluster.__table__
+    query = select(clusters.c.holeID, clusters.c.CID) \
+        .where(clusters.c.projectID == projectID, clusters.c.run == run, clusters.c.version == version)
+    with engine.connect() as conn:
+        rows = conn.execute(query).fetchall()
+    if not rows:
+        return None
+    return pd.Series({hole: cid for hole, cid in rows}).sort_index()
@@ -0,0 +1,445 @@
+import io
+import json
+import logging
+import threading
+import time
+from queue import Empty, Full, Queue
+import numpy as np
+import pandas as pd
+from sqlalchemy import and_, bindparam, column, func, inspect, select, table
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from .. import engine
+from ..models import ensure_indexes, HoleAggregate
+from .data_access import FEATURES, bump_data_version, sync_column_store
+from .hole_aggregates import rebuild_hole_aggregates, update_hole_aggregates
+from .hole_summary import refresh_hole_summary
+from .rollups import refresh_hole_rollups, refresh_rollups
+
+logger = logging.getLogger(__name__)
+
+# Columns identifying a row of each table, used by the upsert mode
+TABLE_KEYS = {'MWD': ['projectID', 'holeID', 'Depth'], 'HolePositions': ['projectID', 'holeID']}
+
+# Columns a streamed sample may set. Its projectID and holeID are those of the stream
+SAMPLE_COLUMNS = FEATURES + ['Depth', 'Time']
+
+# Functions called with (tablename, projectIDs) after every ingest, registered with @post_ingest
+_post_ingest = []
+
+
+class IngestError(Exception):
+    """
+    Raised when the rows written do not match the rows read. The ingest is rolled back.
+    """
+
+
+def post_ingest(function):
+    _post_ingest.append(function)
+    return function
+
+
+# Rewrites the column store files of the projects ingested, so readers map the new rows
+@post_ingest
+def _sync_column_store(tablename, projectIDs):
+    if tablename == 'MWD':
+        for projectID in projectIDs:
+            sync_column_store(projectID)
+
+
+# Rebuilds the per-hole summaries of the projects ingested
+@post_ingest
+def _refresh_hole_summary(tablename, projectIDs):
+    if tablename in ('MWD', 'HolePositions'):
+        for projectID in projectIDs:
+            refresh_hole_summary(projectID)
+
+
+# Recomputes the running aggregates of the holes of the projects ingested
+@post_ingest
+def _rebuild_hole_aggregates(tablename, projectIDs):
+    if tablename == 'MWD':
+        for projectID in projectIDs:
+            rebuild_hole_aggregates(projectID)
+
+
+# Rebuilds the depth rollups of the projects ingested
+@post_ingest
+def _refresh_rollups(tablename, projectIDs):
+    if tablename == 'MWD':
+        for projectID in projectIDs:
+            refresh_rollups(projectID)
+
+
+def read_chunks(source, chunksize=50000):
+    """
+    Yields the rows of an export as DataFrames of at most chunksize rows.
+
+    Parameters
+    ----------
+    source: Pandas DataFrame, path or iterable of DataFrames
+        A CSV (optionally compressed) or Parquet file is streamed from disk rather than read whole.
+    chunksize: int
+        The number of rows per chunk.
+
+    Raises
+    ------
+    ImportError if source is a Parquet file and pyarrow is not installed.
+    """
+    if isinstance(source, pd.DataFrame):
+        for start in range(0, len(source), chunksize):
+            yield source.iloc[start:start + chunksize]
+    elif isinstance(source, str) and '.parquet' in source.lower():
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('Reading Parquet exports needs pyarrow, which is not installed '
+                              '(pip install pyarrow), or convert the export to CSV') from None
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    elif isinstance(source, str):
+        # Identifiers stay strings in every chunk, whatever the values of that chunk look like
+        yield from pd.read_csv(source, chunksize=chunksize, dtype={'projectID': str, 'holeID': str})
+    else:
+        yield from source
+
+
+def _copy(conn, tablename, chunk):
+    # PostgreSQL: streams the chunk through COPY as CSV
+    buffer = io.StringIO()
+    chunk.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    columns = ', '.join(f'"{name}"' for name in chunk.columns)
+    statement = f'COPY "{tablename}" ({columns}) FROM STDIN WITH (FORMAT csv)'
+    try:
+        with conn.connection.cursor() as cursor:
+            cursor.copy_expert(statement, buffer)
+    except conn.dialect.dbapi.Error as error:
+        # Raised as the SQLAlchemy exceptions (e.g. IntegrityError) that conn.execute would have raised
+        raise DBAPIError.instance(statement, None, error, conn.dialect.dbapi.Error, dialect=conn.dialect) from error
+
+
+def _records(chunk):
+    # Python values with None for missing ones, which every DBAPI driver can bind
+    return chunk.astype(object).where(chunk.notna(), None).to_dict(orient='records')
+
+
+def _insert(conn, tablename, chunk):
+    if conn.dialect.name == 'postgresql':
+        _copy(conn, tablename, chunk)
+    else:
+        tbl = table(tablename, *[column(name) for name in chunk.columns])
+        conn.execute(tbl.insert(), _records(chunk))
+
+
+def _delete_keys(conn, tablename, chunk, keys):
+    # Deletes the rows of the table matching the keys of the chunk, returning how many were deleted
+    if conn.dialect.name == 'postgresql':
+        conn.exec_driver_sql('TRUNCATE _ingest_stage')
+        _copy(conn, '_ingest_stage', chunk[keys])
+        match = ' AND '.join(f't."{key}" = s."{key}"' for key in keys)
+        return conn.exec_driver_sql(f'DELETE FROM "{tablename}" t USING _ingest_stage s WHERE {match}').rowcount
+    tbl = table(tablename, *[column(key) for key in keys])
+    delete = tbl.delete().where(and_(*[tbl.c[key] == bindparam('_' + key) for key in keys]))
+    rows = _records(chunk[keys].drop_duplicates())
+    return conn.execute(delete, [{'_' + key: row[key] for key in keys} for row in rows]).rowcount
+
+
+def _stats(conn, tablename, projectIDs, numeric, grouped):
+    # Row count and column sums of each project, the checksums compared after writing
+    tbl = table(tablename, *[column(name) for name in ['projectID'] + numeric])
+    sums = [func.coalesce(func.sum(tbl.c[name]), 0) for name in numeric]
+    if not grouped:
+        row = conn.execute(select(func.count(), *sums).select_from(tbl)).fetchone()
+        return {None: (row[0], np.array(row[1:], dtype=float))}
+    query = select(tbl.c.projectID, func.count(), *sums).where(tbl.c.projectID.in_(list(projectIDs))) \
+        .group_by(tbl.c.projectID)
+    stats = {projectID: (0, np.zeros(len(numeric))) for projectID in projectIDs}
+    for row in conn.execute(query):
+        stats[row[0]] = (row[1], np.array(row[2:], dtype=float))
+    return stats
+
+
+def ingest(source, tablename, mode='replace', chunksize=50000, keys=None):
+    """
+    Streams an export into a table in chunks, inside a single transaction, so readers keep seeing the
+    previous rows until the whole export is written and validated.
+
+    Parameters
+    ----------
+    source: Pandas DataFrame, path or iterable of DataFrames
+        The rows to write. See read_chunks.
+    tablename: String
+        The table to write to. It is created from the first chunk if it does not exist.
+    mode: String
+        'replace' replaces the rows of every projectID in the export (the whole table if it has no
+        projectID column), 'append' adds the rows, and 'upsert' replaces the rows with the same keys.
+    chunksize: int
+        The number of rows written at once.
+    keys: list of String
+        The columns identifying a row for 'upsert'. Defaults to TABLE_KEYS of the table.
+
+    Rows are written with COPY on PostgreSQL and executemany elsewhere. Afterwards the row count (and,
+    for 'replace' and 'append', the sum of every numeric column) of each project is compared with the
+    export; on a mismatch IngestError is raised and nothing is written.
+
+    Returns
+    -------
+    A dictionary with the number of rows and chunks written, the projectIDs and the time taken.
+    """
+    if mode not in ('replace', 'append', 'upsert'):
+        raise ValueError(f'Unknown ingest mode {mode}')
+    keys = keys or TABLE_KEYS.get(tablename)
+    if mode == 'upsert' and not keys:
+        raise ValueError(f'No key columns to upsert {tablename} on')
+
+    start = time.perf_counter()
+    rows = n_chunks = 0
+    created = False
+    before = {}  # projectID -> (count, sums) before the ingest
+    written = {}  # projectID -> (count, sums) of the export
+    deleted = 0
+    numeric = None
+    grouped = None
+    with engine.begin() as conn:
+        for chunk in read_chunks(source, chunksize):
+            if chunk.empty:
+                continue
+            if numeric is None:  # First chunk
+                grouped = 'projectID' in chunk.columns
+                numeric = [name for name in chunk.columns
+                           if pd.api.types.is_numeric_dtype(chunk[name]) and name not in ('index', 'projectID')]
+                if not inspect(conn).has_table(tablename):
+                    chunk.head(0).to_sql(tablename, conn, index=False)
+                    created = True
+                if mode == 'upsert' and conn.dialect.name == 'postgresql':
+                    key_columns = ', '.join(f'"{key}"' for key in keys)
+                    conn.exec_driver_sql(f'CREATE TEMP TABLE _ingest_stage ON COMMIT DROP AS '
+                                         f'SELECT {key_columns} FROM "{tablename}" WITH NO DATA')
+
+            chunk_stats = {None: chunk} if not grouped else dict(tuple(chunk.groupby('projectID', sort=False)))
+            new = [projectID for projectID in chunk_stats if projectID not in before]
+            if new:
+                before.update(_stats(conn, tablename, new, numeric, grouped))
+                if mode == 'replace':
+                    tbl = table(tablename, column('projectID'))
+                    conn.execute(tbl.delete() if not grouped else tbl.delete().where(tbl.c.projectID.in_(new)))
+            if mode == 'upsert':
+                deleted += _delete_keys(conn, tablename, chunk, keys)
+
+            _insert(conn, tablename, chunk)
+            for projectID, part in chunk_stats.items():
+                count, sums = written.get(projectID, (0, np.zeros(len(numeric))))
+                written[projectID] = (count + len(part), sums + part[numeric].sum().values.astype(float))
+            rows += len(chunk)
+            n_chunks += 1
+            logger.info('Ingested chunk %d of %s (%d rows)', n_chunks, tablename, rows)
+
+        if written:
+            _validate(_stats(conn, tablename, list(written), numeric, grouped), before, written, mode, deleted)
+
+    projectIDs = [projectID for projectID in written if projectID is not None]
+    if created:
+        ensure_indexes()
+    bump_data_version(tablename, projectIDs, replaced=not grouped)
+    for hook in _post_ingest:
+        hook(tablename, projectIDs)
+    return {'table': tablename, 'mode': mode, 'rows': rows, 'chunks': n_chunks,
+            'projectIDs': [str(projectID) for projectID in projectIDs],
+            'seconds': round(time.perf_counter() - start, 3)}
+
+
+def _validate(after, before, written, mode, deleted):
+    if mode == 'upsert':  # Only the total count is known, as deleted rows may belong to any project
+        expected = sum(before[p][0] for p in written) - deleted + sum(written[p][0] for p in written)
+        found = sum(after[p][0] for p in written)
+        if found != expected:
+            raise IngestError(f'Expected {expected} rows after the upsert, found {found}')
+        return
+    for projectID, (count, sums) in written.items():
+        expected_count, expected_sums = count, sums
+        if mode == 'append':
+            expected_count, expected_sums = count + before[projectID][0], sums + before[projectID][1]
+        found_count, found_sums = after[projectID]
+        if found_count != expected_count:
+            raise IngestError(f'Project {projectID}: expected {expected_count} rows, found {found_count}')
+        if not np.allclose(found_sums, expected_sums, rtol=1e-6, equal_nan=True):
+            raise IngestError(f'Project {projectID}: column checksums do not match the export')
+
+
+def sample_row(sample):
+    """
+    Validates a streamed sample, a dictionary with a numeric Depth and every sensor column, and returns it
+    restricted to SAMPLE_COLUMNS. Samples missing a sensor are refused, as the clustering and its incremental
+    labelling (see cluster_store.py) need every feature of every row.
+
+    Raises
+    ------
+    ValueError if the sample is not a dictionary, misses the Depth or a sensor, or has a non numeric or
+    non finite value.
+    """
+    if not isinstance(sample, dict):
+        raise ValueError('Expected a JSON object')
+    row = {}
+    for name in FEATURES + ['Depth']:
+        if sample.get(name) is None:
+            raise ValueError(f'The sample has no {name}')
+        try:
+            row[name] = float(sample[name])
+        except (TypeError, ValueError):
+            raise ValueError(f'{name} is not a number')
+        if not np.isfinite(row[name]):
+            raise ValueError(f'{name} is not a finite number')
+    if sample.get('Time') is not None:
+        row['Time'] = str(sample['Time'])
+    return row
+
+
+def publish_samples(projectID, holeID):
+    """
+    Makes the samples appended to a hole visible to readers: bumps the project's data version and rebuilds
+    the hole's depth rollups. The other per-project artifacts are rebuilt lazily on their next read.
+    """
+    bump_data_version('MWD', [projectID])
+    refresh_hole_rollups(projectID, holeID)
+
+
+def append_samples(projectID, holeID, samples, attempts=3, publish=True):
+    """
+    Appends a batch of streamed samples of a hole to the MWD table and adds them to the hole's running
+    aggregates (see hole_aggregates.py), in one short transaction, then publishes them (see publish_samples).
+
+    Parameters
+    ----------
+    samples: list of dict
+        Rows as returned by sample_row.
+    attempts: int
+        Times the batch is tried when a concurrent stream of the project took the same row indexes.
+    publish: bool
+        If False, the batch is not published yet, so several batches invalidate the project's artifacts once.
+
+    Returns
+    -------
+    The hole's aggregates after the batch, as a dictionary.
+    """
+    frame = pd.DataFrame.from_records(samples, columns=SAMPLE_COLUMNS)
+    # A sensor missing from every sample would otherwise be an object column of None
+    frame[FEATURES + ['Depth']] = frame[FEATURES + ['Depth']].astype(float)
+    if frame.Time.isna().all():  # Not every MWD table has the Time column
+        frame = frame.drop(columns='Time')
+    frame.insert(0, 'projectID', projectID)
+    frame['holeID'] = holeID
+    mwd = table('MWD', column('index'), column('projectID'))
+    for attempt in range(attempts):
+        try:
+            with engine.begin() as conn:
+                HoleAggregate.__table__.create(bind=conn, checkfirst=True)
+                last = conn.execute(select(func.max(mwd.c.index)).where(mwd.c.projectID == projectID)).scalar()
+                frame['index'] = np.arange(len(frame)) + (-1 if last is None else last) + 1
+                _insert(conn, 'MWD', frame)
+                aggregates = update_hole_aggregates(conn, projectID, frame)
+            break
+        except IntegrityError:
+            if attempt == attempts - 1:
+                raise
+    if publish:
+        publish_samples(projectID, holeID)
+    return aggregates.astype(object).where(aggregates.notna(), None).to_dict(orient='records')[0]
+
+
+_END = object()
+
+
+def _offer(queue, item, stop):
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=.5)
+            return True
+        except Full:
+            pass
+    return False
+
+
+def _read_lines(lines, queue, stop):
+    # Moves the lines of a stream to a queue, so the stream's batches are written on time while no line
+    # arrives. Once stop is set, the line being read is dropped and the thread ends
+    try:
+        for line in lines:
+            if not _offer(queue, line, stop):
+                return
+        _offer(queue, _END, stop)
+    except Exception as error:
+        _offer(queue, error, stop)
+
+
+def stream_samples(projectID, holeID, lines, batch_rows=500, batch_seconds=2.0, publish_seconds=10.0):
+    """
+    Appends the samples of an NDJSON stream (one JSON object per line, see sample_row) of a hole as they
+    arrive, in batches of batch_rows samples, or fewer once batch_seconds passed since the last batch, also
+    while the stream pauses. The batches are published (see publish_samples) at most every publish_seconds,
+    and when the stream ends.
+
+    An invalid line stops the stream: the samples before it are kept, and the summary holds the error. The
+    lines are read on a daemon thread, which may then still wait on the next line; the rest of the stream is
+    not read. It ends once that read returns, which the WSGI server causes by closing the connection after
+    the response (a client that keeps sending gets an error rather than having its samples stored).
+
+    Returns
+    -------
+    A dictionary with the number of rows and batches written, the hole's aggregates after the last batch,
+    and an error message if the stream stopped early.
+    """
+    summary = {'projectID': projectID, 'holeID': holeID, 'rows': 0, 'batches': 0, 'aggregates': None}
+    batch = []
+    last_flush = last_publish = time.monotonic()
+    unpublished = False
+
+    def flush(final=False):
+        nonlocal batch, last_flush, last_publish, unpublished
+        if batch:
+            summary['aggregates'] = append_samples(projectID, holeID, batch, publish=False)
+            summary['rows'] += len(batch)
+            summary['batches'] += 1
+            batch = []
+            unpublished = True
+        last_flush = time.monotonic()
+        if unpublished and (final or last_flush - last_publish >= publish_seconds):
+            publish_samples(projectID, holeID)
+            last_publish, unpublished = last_flush, False
+
+    def timeout():
+        # Seconds until the batch is due to be written or the written batches to be published
+        due = [last_flush + batch_seconds] if batch else []
+        due += [last_publish + publish_seconds] if unpublished else []
+        return max(min(due) - time.monotonic(), 0) if due else None
+
+    queue, stop = Queue(maxsize=2 * batch_rows), threading.Event()
+    threading.Thread(target=_read_lines, args=(lines, queue, stop), name='stream', daemon=True).start()
+    number = 0
+    try:
+        while True:
+            try:
+                line = queue.get(timeout=timeout())
+            except Empty:
+                flush()
+                continue
+            if line is _END:
+                break
+            if isinstance(line, Exception):  # Reading the stream failed
+                flush(final=True)
+                raise line
+            number += 1
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                batch.append(sample_row(json.loads(line)))
+            except ValueError as error:
+                flush(final=True)
+                summary['error'] = f'Line {number}: {error}'
+                return summary
+            if len(batch) >= batch_rows or time.monotonic() - last_flush >= batch_seconds:
+                flush()
+    finally:
+        stop.set()
+    flush(final=True)
+    return summary
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from .. import db
+from ..models import Job
+
+logger = logging.getLogger(__name__)
+
+# Job functions by kind, registered with @job_kind. Each is called as function(projectID, params, progress)
+# inside an app context, where progress(fraction) reports how far along it is, and returns a JSON
+# serializable result
+_kinds = {}
+
+# The job threads of this worker process. Executors do not survive a fork, so it is tied to the pid that made it
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+
+
+def job_kind(kind):
+    def register(function):
+        _kinds[kind] = function
+        return function
+    return register
+
+
+ACTIVE = ('queued', 'running')
+
+
+def _worker():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _lock:
+            if _executor is None or _executor_pid != os.getpid():
+                app = current_app._get_current_object()
+                _executor = ThreadPoolExecutor(max_workers=app.config['JOB_WORKERS'], thread_name_prefix='job')
+                _executor_pid = os.getpid()
+                threading.Thread(target=_heartbeat, args=(app,), name='job-heartbeat', daemon=True).start()
+    return _executor
+
+
+# Refreshes the updated time of this worker's queued and running jobs, for as long as the worker lives
+def _heartbeat(app):
+    pid, worker = os.getpid(), _worker()
+    while _executor_pid == pid:
+        with app.app_context():
+            try:
+                Job.query.filter(Job.worker == worker, Job.status.in_(ACTIVE)) \
+                    .update({'updated': datetime.utcnow()}, synchronize_session=False)
+                db.session.commit()
+            except Exception:
+                logger.exception('Job heartbeat failed')
+                db.session.rollback()
+            finally:
+                db.session.remove()
+        time.sleep(app.config['JOB_HEARTBEAT_SECONDS'])
+
+
+def fail_stale_jobs(*criteria):
+    """
+    Marks the queued and running jobs (matching criteria, if given) that their worker stopped refreshing for
+    JOB_STALE_SECONDS as failed, e.g. after the worker was killed, so they are no longer deduplicated against.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['JOB_STALE_SECONDS'])
+    Job.query.filter(Job.status.in_(ACTIVE), Job.updated < cutoff, *criteria) \
+        .update({'status': 'failed', 'active_key': None, 'error': 'The worker running the job stopped'},
+                synchronize_session=False)
+    db.session.commit()
+
+
+def job_key(kind, projectID, params, stamp):
+    """
+    Returns the deduplication key of a job: a hash of its kind, project, parameters and the data stamp
+    of the project, so identical requests on unchanged data share a job.
+    """
+    return hashlib.sha1(json.dumps([kind, projectID, params, stamp], sort_keys=True).encode()).hexdigest()
+
+
+def submit_job(kind, projectID, params, stamp):
+    """
+    Creates a job and queues it on this worker's job threads. If an identical job is already queued or
+    running, that job is returned instead. Only one such job can exist at a time, as the active_key of
+    queued and running jobs is unique; jobs whose worker stopped (see fail_stale_jobs) do not count.
+
+    Returns
+    -------
+    The Job, and whether it was newly created.
+    """
+    key = job_key(kind, projectID, params, stamp)
+    fail_stale_jobs(Job.active_key == key)
+    existing = Job.query.filter(Job.active_key == key).first()
+    if existing is not None:
+        return existing, False
+
+    executor = _get_executor()
+    job = Job(id=uuid.uuid4().hex, kind=kind, projectID=projectID, params=json.dumps(params), key=key,
+              active_key=key, worker=_worker(), status='queued', progress=0.0)
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:  # Another request created the same job at the same time
+        db.session.rollback()
+        existing = Job.query.filter(Job.active_key == key).first()
+        if existing is not None:
+            return existing, False
+        raise
+    executor.submit(_run, current_app._get_current_object(), job.id)
+    return job, True
+
+
+# Numpy scalars left in results (e.g. by DataFrame.to_dict) are stored as their Python values
+def _native(value):
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _update(job_id, **values):
+    Job.query.filter_by(id=job_id).update(values)
+    db.session.commit()
+
+
+def _run(app, job_id):
+    with app.app_context():
+        job = Job.query.get(job_id)
+        kind, projectID, params = job.kind, job.projectID, json.loads(job.params)
+        _update(job_id, status='running')
+        try:
+            result = _kinds[kind](projectID, params, lambda fraction: _update(job_id, progress=float(fraction)))
+            _update(job_id, status='done', active_key=None, progress=1.0,
+                    result=json.dumps(result, default=_native))
+        except Exception as error:
+            logger.exception('Job %s (%s) failed', job_id, kind)
+            db.session.rollback()
+            _update(job_id, status='failed', active_key=None, error=f'{type(error).__name__}: {error}')
+        finally:
+            db.session.remove()
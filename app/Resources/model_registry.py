@@ -0,0 +1,51 @@
+import os
+import re
+import threading
+from flask import current_app
+
+# Models already read by this worker, keyed by path: path -> (modification time, state)
+_loaded = {}
+_lock = threading.Lock()
+
+
+def _path(projectID, run):
+    safe = lambda name: re.sub(r'[^A-Za-z0-9_.-]', '_', str(name))
+    return os.path.join(current_app.config['MODEL_DIR'], safe(projectID), safe(run) + '.joblib')
+
+
+def save_model(projectID, run, state):
+    """
+    Serializes the fitted models of a project's clustering run (scaler, PCA, cluster prototypes and the
+    bookkeeping used by the refit policy) to MODEL_DIR with joblib. The file is replaced atomically, so
+    other workers never read a partial model.
+    """
+    import joblib
+    path = _path(projectID, run)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp = f'{path}.{os.getpid()}.tmp'
+    joblib.dump(state, temp)
+    os.replace(temp, path)
+    with _lock:
+        _loaded[path] = (os.path.getmtime(path), state)
+
+
+def load_model(projectID, run):
+    """
+    Returns the state saved by save_model for a project's clustering run, or None if there is none.
+    """
+    path = _path(projectID, run)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _lock:
+        loaded = _loaded.get(path)
+    if loaded is not None and loaded[0] == mtime:
+        return loaded[1]
+
+    import joblib
+    state = joblib.load(path)
+    with _lock:
+        _loaded[path] = (mtime, state)
+    return state
+
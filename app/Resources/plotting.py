@@ -1,23 +1,49 @@
-import matplotlib.pyplot as plt
 import io
 import base64
 import pandas as pd
 import numpy as np
-from matplotlib.patches import Patch
+from ..instrumentation import timed
 
+# Increment when the look of any plot changes, so previously rendered images are not served from the cache
+RENDER_VERSION = 3
 
+
+## Plots are drawn on standalone Figures with an Agg canvas rather than through pyplot, so no global
+## state is shared and they can be rendered from any thread or process. matplotlib is imported on the
+## first plot, so the app starts without loading it
+def _subplots(figsize):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig, fig.add_subplot()
+
+
+def _png(fig, **savefig_kwargs):
+    bytes_image = io.BytesIO()
+    fig.savefig(bytes_image, format='png', **savefig_kwargs)
+    return bytes_image.getvalue()
+
+
+## Encode the png bytes to base64, and convert from bytes to string to return
+@timed('encode')
+def _encode(png):
+    return base64.b64encode(png).decode()
+
+
+@timed('plot_rate')
 def plot_rate(holeID, df, feature):
-    fig, ax = plt.subplots(figsize = (5, 12))
+    fig, ax = _subplots(figsize = (5, 12))
     hole = df[df.holeID == holeID]
     X = hole[feature].values
     Y = hole.Depth
 
     ax.plot(X, Y, color='aqua')
     ax.set_facecolor('black')
-    plt.gca().invert_yaxis()
-    plt.ylabel('Depth')
-    plt.xlabel(feature)
-    plt.title('Hole: ' + holeID)
+    ax.invert_yaxis()
+    ax.set_ylabel('Depth')
+    ax.set_xlabel(feature)
+    ax.set_title('Hole: ' + holeID)
 
     bytes_image = io.BytesIO()
     fig.savefig(bytes_image, format='png')
@@ -26,36 +52,37 @@ def plot_rate(holeID, df, feature):
     return bytes_image
 
 
-def encode_all_holes(df):
+@timed('encode_all_holes')
+def encode_all_holes(df, encoded=True):
     list_of_dicts = []
-    holeIDs = set(df.holeID)
-
-    for hole in holeIDs:
-        specific_df = df[df.holeID == hole]  # Grabs the entries of the specific holeID
-        depth = specific_df.Depth.max() - specific_df.Depth.min()  # Calculates the overall depth
-        temp_dict = {'holeID': hole, 'depth': depth}  # Creates a dictionary for each holeID
-        fig, ax = plt.subplots(figsize = (5, 12))  # Generate the figure and axis before loop for reuseability for efficiency
-        for feature in df.columns[1:6]:  # Loop over all relevant features
-            ax.plot(specific_df[feature].values, specific_df.Depth, color='aqua')
-            ax.set_facecolor('black')
-            plt.gca().invert_yaxis()
-            plt.ylabel('Depth')
-            plt.xlabel(feature)
-            plt.title('Hole: ' + hole)
-            bytes_image = io.BytesIO()
-            fig.savefig(bytes_image, format='png')
-            bytes_image.seek(0)
-            ## Clear the figure, axis, and close plot to reuse
-            plt.cla()
-            ## Encode the bytes image to base64, and convert from bytes to string to return
-            img_base64 = base64.b64encode(bytes_image.read())
-            temp_dict[feature] = img_base64.decode()
+
+    for hole, specific_df in df.groupby('holeID', sort=False, observed=True):  # The entries of each holeID
         ## Append the holeID dictionary to the overall list
-        list_of_dicts.append(temp_dict)
+        list_of_dicts.append(plot_hole_features(specific_df, hole, df.columns[1:6], encoded))
     return list_of_dicts
 
 
-def all_features_update(df, holeID):
+@timed('plot_hole_features')
+def plot_hole_features(specific_df, hole, features, encoded=True):
+    depth = specific_df.Depth.max() - specific_df.Depth.min()  # Calculates the overall depth
+    temp_dict = {'holeID': hole, 'depth': depth}  # Creates a dictionary for each holeID
+    fig, ax = _subplots(figsize = (5, 12))  # Generate the figure and axis before loop for reuseability for efficiency
+    for feature in features:  # Loop over all relevant features
+        ax.plot(specific_df[feature].values, specific_df.Depth, color='aqua')
+        ax.set_facecolor('black')
+        ax.invert_yaxis()
+        ax.set_ylabel('Depth')
+        ax.set_xlabel(feature)
+        ax.set_title('Hole: ' + hole)
+        png = _png(fig)
+        ## Clear the axis to reuse
+        ax.cla()
+        temp_dict[feature] = _encode(png) if encoded else png
+    return temp_dict
+
+
+@timed('all_features_update')
+def all_features_update(df, holeID, encoded=True):
     colors = ['aqua', 'salmon', 'darkviolet', 'palegreen', 'navajowhite']
     color_dict = dict(zip(df.columns[1:6], colors))
     xlim_dict = dict(zip(df.columns[1:6], [[0, 4.5], [9, 28], [33.5 , 62.5], [40, 76], [0, 4]]))
@@ -63,44 +90,36 @@ def all_features_update(df, holeID):
     specific_df = df[df.holeID == holeID]  # Grabs the entries of the specific holeID
     depth = specific_df.Depth.max() - specific_df.Depth.min()  # Calculates the overall depth
     temp_dict = {'holeID': holeID, 'depth': depth}  # Creates a dictionary for each holeID
-    fig, ax = plt.subplots(figsize=(5, 12))  # Generate the figure and axis before loop for reuseability for efficiency
+    fig, ax = _subplots(figsize=(5, 12))  # Generate the figure and axis before loop for reuseability for efficiency
 
     # Plot The First Feature:
     line, = ax.plot(specific_df[df.columns[1]].values, specific_df.Depth, color=color_dict[df.columns[1]])
     ax.set_facecolor('grey')
     ax.axes.yaxis.set_ticks(range(int(np.floor(specific_df.Depth.min())),
                                   int(np.ceil(specific_df.Depth.max())) + 1))
-    plt.ylim([0, int(np.ceil(specific_df.Depth.max()))])
-    plt.xlim(xlim_dict[df.columns[1]])
-    plt.gca().invert_yaxis()
-    plt.ylabel('Depth')
-    plt.xlabel(df.columns[1])
-    plt.title(r"$\bf{" + holeID + ": " + df.columns[1] + "}$")
-    plt.grid()
-    bytes_image = io.BytesIO()
-    fig.savefig(bytes_image, format='png', bbox_inches='tight')
-    bytes_image.seek(0)
-    img_base64 = base64.b64encode(bytes_image.read())
-    temp_dict[df.columns[1]] = img_base64.decode()
+    ax.set_ylim([0, int(np.ceil(specific_df.Depth.max()))])
+    ax.set_xlim(xlim_dict[df.columns[1]])
+    ax.invert_yaxis()
+    ax.set_ylabel('Depth')
+    ax.set_xlabel(df.columns[1])
+    ax.set_title(r"$\bf{" + holeID + ": " + df.columns[1] + "}$")
+    ax.grid()
+    png = _png(fig, bbox_inches='tight')
+    temp_dict[df.columns[1]] = _encode(png) if encoded else png
 
     for feature in df.columns[2:6]:
-        plt.xlim(xlim_dict[feature])
+        ax.set_xlim(xlim_dict[feature])
         line.set_xdata(specific_df[feature].values)
         line.set_color(color_dict[feature])
-        plt.xlabel(feature)
-        plt.title(r"$\bf{" + holeID + ": " + feature + "}$")
-        fig.canvas.draw()
-        fig.canvas.flush_events()
+        ax.set_xlabel(feature)
+        ax.set_title(r"$\bf{" + holeID + ": " + feature + "}$")
 
-        bytes_image = io.BytesIO()
-        fig.savefig(bytes_image, format='png', bbox_inches='tight')
-        bytes_image.seek(0)
-        img_base64 = base64.b64encode(bytes_image.read())
-        temp_dict[feature] = img_base64.decode()
-    plt.close(fig)
+        png = _png(fig, bbox_inches='tight')
+        temp_dict[feature] = _encode(png) if encoded else png
     return temp_dict
 
 
+@timed('plot_all_features')
 def plot_all_features(df, holeID):
     soft = .8
     hard = 1.8
@@ -111,38 +130,38 @@ def plot_all_features(df, holeID):
     specific_df = df[df.holeID == holeID]  # Grabs the entries of the specific holeID
     depth = specific_df.Depth.max() - specific_df.Depth.min()  # Calculates the overall depth
     temp_dict = {'holeID': holeID, 'depth': depth}  # Creates a dictionary for each holeID
-    fig, ax = plt.subplots(figsize = (5, 13))  # Generate the figure and axis before loop for reuseability for efficiency
+    fig, ax = _subplots(figsize = (5, 13))  # Generate the figure and axis before loop for reuseability for efficiency
 
     for feature in df.columns[1:6]:  # Loop over all relevant features
         ax.plot(specific_df[feature].values, specific_df.Depth, color=color_dict[feature])
 
-        #plt.xlim([0, 4.5])
+        #ax.set_xlim([0, 4.5])
         ax.set_facecolor('grey')
         ax.axes.yaxis.set_ticks(range(int(np.floor(specific_df.Depth.min())),
                                       int(np.ceil(specific_df.Depth.max())) + 1))
-        plt.ylim([0, int(np.ceil(specific_df.Depth.max()))])
+        ax.set_ylim([0, int(np.ceil(specific_df.Depth.max()))])
 
-        plt.gca().invert_yaxis()
-        plt.ylabel('Depth')
-        plt.xlabel(feature)
-        plt.title(r"$\bf{" + holeID + ": " + feature + "}$")
-        plt.grid()
+        ax.invert_yaxis()
+        ax.set_ylabel('Depth')
+        ax.set_xlabel(feature)
+        ax.set_title(r"$\bf{" + holeID + ": " + feature + "}$")
+        ax.grid()
         bytes_image = io.BytesIO()
         fig.savefig(bytes_image, format='png', bbox_inches = 'tight')
         bytes_image.seek(0)
-        ## Clear the figure, axis, and close plot to reuse
-        plt.cla()
+        ## Clear the axis to reuse
+        ax.cla()
         ## Encode the bytes image to base64, and convert from bytes to string to return
         img_base64 = base64.b64encode(bytes_image.read())
         temp_dict[feature] = img_base64.decode()
-    plt.close(fig)
     return temp_dict
 
 
+@timed('plot_cluster')
 def plot_cluster(data2D, projectID, labels, model = 'Agglomerative', mode = 'PCA'):
     axis_labels = ['PC1', 'PC2'] if (mode == 'PCA' or mode == 'unweighted') else ['x', 'y']
 
-    fig, ax = plt.subplots(figsize=(15, 12))
+    fig, ax = _subplots(figsize=(15, 12))
 
     model_title = 'Agglomerative' if model == 'agglom' else 'KMeans' if model =='kmeans' else 'Spectral'
 
@@ -166,93 +185,159 @@ def plot_cluster(data2D, projectID, labels, model = 'Agglomerative', mode = 'PCA
     fig.savefig(bytes_image, format='png', bbox_inches = 'tight', rasterized = True)
     bytes_image.seek(0)
     img_base64 = base64.b64encode(bytes_image.read())
-    plt.close(fig)
     return img_base64.decode()
 
 
-def hardness_bar_plot(df, holeID, projectID, color_version = 0):
-    step = 1 if projectID == 'Montana' else 3 # Sets the step size for binning rows together (Not needed for montana)
-    soft = 1.8 # Sets boundary for hard rock
-    hard = .8 # Sets boundary for soft rock
-    color_combos = [['tab:cyan', 'tab:gray', 'tab:orange'], ['red', 'black', 'gold'],
-              ['red', 'yellow', 'blue']]
-    colors = dict(zip(['hard', 'medium', 'soft'], color_combos[color_version]))
-
-    hole = df[df.holeID == holeID] # Grabs the entries of the specific holeID
-
-    fig, ax = plt.subplots(figsize=(1, 12))
-    #plt.ylim([hole.Depth.min(), hole.Depth.max()])
-    plt.ylim([0, hole.Depth.max()])
-    #ax.axes.yaxis.set_ticks(range(int(np.ceil(hole.Depth.min())), int(np.floor(hole.Depth.max())) + 1))
-    ax.axes.yaxis.set_ticks(range(int(np.floor(hole.Depth.min())), int(np.ceil(hole.Depth.max())) + 1))
-    plt.gca().invert_yaxis()
-    plt.ylabel('Depth (meters)')
-
-    binned = hole.groupby(hole.index // step).PenetrRate.mean()
-    binned = pd.DataFrame(binned, columns=['PenetrRate'])
-    binned['Hardness'] = binned.PenetrRate.map(
-        lambda rate: 'soft' if rate >= soft else 'hard' if rate <= hard else 'medium')
-    depth_per = (hole.Depth.max() - hole.Depth.min()) / len(binned)
-
-    coord = hole.Depth.min()
-    for entry in binned.iterrows():
-        rectangle = plt.Rectangle((0, coord), 1, depth_per, fc=colors[entry[1][-1]], linewidth=0, figure = fig)
-        ax.add_patch(rectangle)
-        del rectangle
-
-        coord += depth_per
-
-    legend_elements = [Patch(facecolor='white', label='No Data'),
-                       Patch(facecolor=color_combos[color_version][0], label='hard'),
-                       Patch(facecolor=color_combos[color_version][1], label='medium'),
-                       Patch(facecolor=color_combos[color_version][2], label='soft')]
-
+# Names of the hardness classes, by class number of hardness_classes
+HARDNESS_NAMES = ['hard', 'medium', 'soft']
+# Colors of the hard, medium and soft classes for each color_version of the hardness bar charts
+HARDNESS_COLORS = [['tab:cyan', 'tab:gray', 'tab:orange'], ['red', 'black', 'gold'],
+                   ['red', 'yellow', 'blue']]
+
+
+def hardness_classes(rates, soft = 1.8, hard = .8):
+    """
+    Classifies penetration rates as hard (0, rate <= hard), medium (1) or soft (2, rate >= soft) rock.
+    """
+    rates = np.asarray(rates, dtype=float)
+    return np.select([rates >= soft, rates <= hard], [2, 0], default=1)
+
+
+def hardness_bar_plot(df, holeID, projectID, color_version = 0, encoded = True):
+    """
+    Renders the hardness bar chart of a hole from MWD rows (of the hole, or of several holes), binned at the
+    HARDNESS_RESOLUTION of the configuration like the stored rollups. projectID is no longer used: every
+    project is binned by depth the same way.
+    """
+    from flask import current_app, has_app_context
+    from ..config import Config
+    config = current_app.config if has_app_context() else vars(Config)
+    resolution = float(config['HARDNESS_RESOLUTION'])
+    hole = df[(df.holeID.astype(str) == str(holeID)) & df.Depth.notna()]
+    # The bins and classes of rollups.build_rollups, from the PenetrRate alone
+    rates = hole.PenetrRate.groupby(np.floor(hole.Depth.values / resolution + 1e-9).astype(np.int64)).mean()
+    rollup = pd.DataFrame({'holeID': str(holeID), 'resolution': resolution, 'bin': rates.index.values,
+                           'hardness': np.where(rates.isna(), -1, hardness_classes(rates))})
+    return hardness_rollup_plot(rollup, holeID, color_version, encoded)
+
+
+def hardness_rollup_plot(rollup, holeID, color_version = 0, encoded = True):
+    """
+    Renders the hardness bar chart of a hole in one color version from its depth rollup (see
+    hardness_bar_plots).
+    """
+    return hardness_bar_plots(rollup, holeID, color_versions = (color_version,), encoded = encoded)[0]
+
+
+@timed('hardness_bar_plots')
+def hardness_bar_plots(rollup, holeID, color_versions = (0, 1, 2), encoded = True):
+    """
+    Renders the hardness bar chart of a hole once for each color version, from the hole's depth rollup
+    (see rollups.py) at one resolution. The hardness classes of the bins are drawn as a single raster
+    image, which is recolored for every version instead of redrawing the bars. Depths without samples
+    are left blank (No Data).
+
+    Returns
+    -------
+    A list with the image of each color version, in the order of color_versions.
+    """
+    rollup = rollup[rollup.holeID.astype(str) == str(holeID)]
+    resolution = rollup.resolution.iloc[0] if len(rollup) else 1.0
+    first, last = (int(rollup.bin.min()), int(rollup.bin.max())) if len(rollup) else (0, 0)
+    # The class of every bin from the first to the last bin drilled, NaN where a bin has no PenetrRate
+    classes = np.full(last - first + 1, np.nan)
+    hardness = rollup.hardness.values.astype(float)
+    classes[rollup.bin.values.astype(int) - first] = np.where(hardness >= 0, hardness, np.nan)
+    top, bottom = first * resolution, (last + 1) * resolution
+
+    fig, ax = _subplots(figsize=(1, 12))
+    # One pixel per bin from the top of the first bin to the bottom of the last, blank where masked
+    image = ax.imshow(np.ma.masked_invalid(classes.reshape(-1, 1)), aspect = 'auto', interpolation = 'nearest',
+                      vmin = 0, vmax = 2, extent = (0, 1, bottom, top))
+    ax.set_xlim([0, 1])
+    ax.set_ylim([0, bottom])
+    ax.axes.yaxis.set_ticks(range(int(np.floor(top)), int(np.ceil(bottom)) + 1))
+    ax.invert_yaxis()
+    ax.set_ylabel('Depth (meters)')
     ax.axes.xaxis.set_ticks([])
-    #plt.title(holeID + ' Hardness', weight = 'bold')
-    plt.legend(handles=legend_elements, bbox_to_anchor=[1, 1.008], facecolor = 'darkgrey')
-    #plt.subplots_adjust(top = 0.25, bottom = 0.2)
-
-    bytes_image = io.BytesIO()
-    fig.savefig(bytes_image, format='png', bbox_inches = 'tight')
-    bytes_image.seek(0)
-    img_base64 = base64.b64encode(bytes_image.read())
-    plt.close(fig)
-    return img_base64.decode()
-
-
-def highlight_location(pos, holeID):
-    fig, ax = plt.subplots(figsize=(5, 4))
-    pos[pos.holeID != holeID].plot.scatter('start_x', 'start_y', s=100, ax=ax, color='black')
-    pos[pos.holeID == holeID].plot.scatter('start_x', 'start_y', s=200, color='aqua', ax=ax, edgecolors='black')
-    plt.ylabel('Northing' + r' $\longrightarrow$')
-    plt.xlabel('Easting' + r' $\longrightarrow$')
+    #ax.set_title(holeID + ' Hardness', weight = 'bold')
+
+    from matplotlib.colors import ListedColormap
+    from matplotlib.patches import Patch
+    images = []
+    for color_version in color_versions:
+        colors = HARDNESS_COLORS[color_version]
+        image.set_cmap(ListedColormap(colors))
+        legend_elements = [Patch(facecolor='white', label='No Data'),
+                           Patch(facecolor=colors[0], label='hard'),
+                           Patch(facecolor=colors[1], label='medium'),
+                           Patch(facecolor=colors[2], label='soft')]
+        legend = ax.legend(handles=legend_elements, bbox_to_anchor=[1, 1.008], facecolor = 'darkgrey')
+        #plt.subplots_adjust(top = 0.25, bottom = 0.2)
+
+        png = _png(fig, bbox_inches = 'tight')
+        images.append(_encode(png) if encoded else png)
+        legend.remove()
+    return images
+
+
+@timed('highlight_location')
+def highlight_location(pos, holeID, encoded=True):
+    fig, ax = _subplots(figsize=(5, 4))
+    x, y = pos.start_x.values, pos.start_y.values
+    selected = (pos.holeID == holeID).values
+    ax.scatter(x[~selected], y[~selected], s=100, color='black')
+    ax.scatter(x[selected], y[selected], s=200, color='aqua', edgecolors='black')
+    ax.set_ylabel('Northing' + r' $\longrightarrow$')
+    ax.set_xlabel('Easting' + r' $\longrightarrow$')
+    ax.set_yticks([])
+    ax.set_xticks([])
+    ax.set_ylim([pos.start_y.min() - 12, pos.start_y.max() + 12])
+    png = _png(fig, bbox_inches='tight')
+    return _encode(png) if encoded else png
+
+
+@timed('cluster_positions')
+def cluster_positions(pos, labels, encoded=True):
+    # Each hole is numbered in order of first appearance, and labelled at every one of its positions
+    numbers = pd.factorize(pos.holeID)[0] + 1
+    x, y = pos.start_x.values, pos.start_y.values
+
+    fig, ax = _subplots(figsize=(12, 8))
+    ax.scatter(x, y, s=160, c=labels, cmap='viridis', edgecolors='black')
+    for label_x, label_y, num in zip(x - .6, y + .75, numbers):
+        ax.text(x=label_x, y=label_y, s=str(num))
+    ax.set_ylim([pos.start_y.min() - 12, pos.start_y.max() + 15])
+    ax.set_ylabel(' '.join(('Northing', r'$\longrightarrow$')))
+    ax.set_xlabel(' '.join(('Easting', r'$\longrightarrow$')))
     ax.set_yticks([])
     ax.set_xticks([])
-    plt.ylim([pos.start_y.min() - 12, pos.start_y.max() + 12])
-    bytes_image = io.BytesIO()
-    fig.savefig(bytes_image, format='png', bbox_inches='tight')
-    bytes_image.seek(0)
-    img_base64 = base64.b64encode(bytes_image.read())
-    plt.close(fig)
-    return img_base64.decode()
-
-
-def cluster_positions(pos, labels):
-    holeID_dict = {hole: idx + 1 for idx, hole in enumerate(pos.holeID.unique())}
 
-    fig, ax = plt.subplots(figsize=(12, 8))
-    ax.scatter(pos['start_x'], pos['start_y'], s=160, c=labels, cmap='viridis', edgecolors='black')
-    for hole, num in holeID_dict.items():
-        ax.text(x=pos[pos.holeID == hole].start_x - .6, y=pos[pos.holeID == hole].start_y + .75, s=str(num))
-    plt.ylim([pos.start_y.min() - 12, pos.start_y.max() + 15])
-    plt.ylabel(' '.join(('Northing', r'$\longrightarrow$')))
-    plt.xlabel(' '.join(('Easting', r'$\longrightarrow$')))
+    png = _png(fig, bbox_inches='tight')
+    return _encode(png) if encoded else png
+
+
+@timed('hardness_map_plot')
+def hardness_map_plot(hardness, projectID, color_version = 0, encoded = True):
+    """
+    Draws the plan view of a project's holes colored by their dominant hardness class, from the hardness map
+    (see hardness_map.py). Holes without a position are left out, holes without a class are drawn white.
+    """
+    hardness = hardness[hardness.start_x.notna() & hardness.start_y.notna()]
+    colors = np.array(['white'] + HARDNESS_COLORS[color_version], dtype=object)
+    fig, ax = _subplots(figsize=(12, 8))
+    ax.scatter(hardness.start_x.values, hardness.start_y.values, s=160,
+               c=list(colors[hardness.hardness.values.astype(int) + 1]), edgecolors='black')
+
+    from matplotlib.patches import Patch
+    legend_elements = [Patch(facecolor=color, edgecolor='black', label=name)
+                       for color, name in zip(colors, ['No Data'] + HARDNESS_NAMES)]
+    ax.legend(handles=legend_elements, loc='upper right', facecolor='darkgrey')
+    ax.set_title(projectID + ' Hardness', weight='bold')
+    ax.set_ylabel(' '.join(('Northing', r'$\longrightarrow$')))
+    ax.set_xlabel(' '.join(('Easting', r'$\longrightarrow$')))
     ax.set_yticks([])
     ax.set_xticks([])
 
-    bytes_image = io.BytesIO()
-    fig.savefig(bytes_image, format='png', bbox_inches='tight')
-    bytes_image.seek(0)
-    img_base64 = base64.b64encode(bytes_image.read())
-    plt.close(fig)
-    return img_base64.decode()
+    png = _png(fig, bbox_inches='tight')
+    return _encode(png) if encoded else png
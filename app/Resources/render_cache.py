@@ -0,0 +1,166 @@
+import calendar
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from flask import current_app, request, Response
+from werkzeug.http import http_date
+
+
+def artifact_key(kind, projectID, versions, holeID=None, feature=None, **style):
+    """
+    Returns the key of a rendered artifact: a hash of the plot kind, project, hole, feature, style
+    parameters and the data versions the artifact was rendered from. The key doubles as the ETag.
+    """
+    parts = [kind, projectID, holeID, feature, versions] + sorted(style.items())
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+class RenderCache:
+    """
+    Rendered images (and small JSON documents rendered along with them) stored on local disk under
+    <root>/<projectID>/<data version>/<key>, shared by every worker of the machine. The artifacts of
+    versions older than the one being served are removed by a periodic sweep (see sweep), once nothing
+    has been written to them for a grace period, so a slow request of an older version never loses the
+    directory it writes to.
+    """
+    SWEEP_INTERVAL = 60  # Seconds between sweeps of a project, per worker
+    SWEEP_GRACE = 120  # Seconds a version's directory must be idle before it is removed
+
+    def __init__(self):
+        self._swept = {}  # projectID -> time of this worker's last sweep
+        self._lock = threading.Lock()
+
+    def _root(self):
+        return current_app.config['RENDER_CACHE_DIR']
+
+    def _path(self, projectID, version, key):
+        return os.path.join(self._root(), _safe(projectID), _safe(version), key)
+
+    def get(self, projectID, version, key):
+        try:
+            with open(self._path(projectID, version, key), 'rb') as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def modified(self, projectID, version, key):
+        """
+        Returns the time the artifact was stored, or None if it is not cached.
+        """
+        try:
+            return os.path.getmtime(self._path(projectID, version, key))
+        except OSError:
+            return None
+
+    def put(self, projectID, version, key, artifact):
+        path = self._path(projectID, version, key)
+        temp = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # A temp file of its own, as request and job threads of a process may render the same key at once
+            fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.',
+                                        suffix='.tmp')
+            with os.fdopen(fd, 'wb') as file:
+                file.write(artifact)
+            os.replace(temp, path)
+        except OSError:  # The version was swept meanwhile, the artifact is served without being cached
+            if temp is not None:
+                try:
+                    os.remove(temp)
+                except OSError:
+                    pass
+        return artifact
+
+    def state(self, projectID, version, keys):
+        """
+        Returns the ETag and Last-Modified time (None unless every artifact is cached) of a response made
+        of the artifacts with the given keys.
+        """
+        keys = sorted(keys)
+        etag = keys[0] if len(keys) == 1 else artifact_key('bundle', projectID, version, keys=tuple(keys))
+        times = [self.modified(projectID, version, key) for key in keys]
+        return etag, None if not times or None in times else max(times)
+
+    def get_many(self, projectID, version, keys, render):
+        """
+        Returns the artifacts of a dictionary of name -> key. The missing ones are rendered with
+        render(missing names), which returns a dictionary holding at least those names.
+        """
+        artifacts = {name: self.get(projectID, version, key) for name, key in keys.items()}
+        missing = [name for name, artifact in artifacts.items() if artifact is None]
+        if missing:
+            rendered = render(missing)
+            for name in missing:
+                artifacts[name] = self.put(projectID, version, keys[name], rendered[name])
+            self.sweep(projectID, version)
+        return artifacts
+
+    def sweep(self, projectID, version):
+        """
+        Removes the project's artifacts of the data versions older than version, at most once every
+        SWEEP_INTERVAL seconds per worker. Versions are project stamps ('<MWD>.<HolePositions>'), older when
+        no part is newer; directories written to in the last SWEEP_GRACE seconds are kept.
+        """
+        now = time.time()
+        with self._lock:
+            if now - self._swept.get(projectID, 0) < self.SWEEP_INTERVAL:
+                return
+            self._swept[projectID] = now
+        current = _parts(version)
+        project_dir = os.path.join(self._root(), _safe(projectID))
+        try:
+            names = os.listdir(project_dir)
+        except OSError:
+            return
+        for name in names:
+            parts = _parts(name)
+            if current is None or parts is None or len(parts) != len(current) or parts == current or \
+                    any(part > newest for part, newest in zip(parts, current)):
+                continue
+            directory = os.path.join(project_dir, name)
+            try:
+                if now - os.path.getmtime(directory) < self.SWEEP_GRACE:
+                    continue
+            except OSError:
+                continue
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def _parts(version):
+    try:
+        return tuple(int(part) for part in str(version).split('.'))
+    except ValueError:
+        return None
+
+
+def _safe(name):
+    return ''.join(char if char.isalnum() or char in '-_.' else '_' for char in str(name))
+
+
+def not_modified(etag, last_modified=None):
+    """
+    Returns a 304 response if the request's If-None-Match (or If-Modified-Since) matches the artifact,
+    otherwise None.
+    """
+    if request.if_none_match:
+        matched = request.if_none_match.contains(etag)
+    elif last_modified is not None and request.if_modified_since is not None:
+        matched = int(last_modified) <= calendar.timegm(request.if_modified_since.utctimetuple())
+    else:
+        matched = False
+    if not matched:
+        return None
+    response = Response(status=304)
+    response.headers.update(cache_headers(etag, last_modified))
+    return response
+
+
+def cache_headers(etag, last_modified=None):
+    return {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache',
+            'Last-Modified': http_date(last_modified if last_modified is not None else time.time())}
+
+
+render_cache = RenderCache()
@@ -0,0 +1,86 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+from ..instrumentation import stage
+
+# The render pool of this worker process. Pools do not survive a fork, so it is tied to the pid that made it
+_pool = None
+_pool_pid = None
+_lock = threading.Lock()
+
+
+def _get_pool(workers):
+    global _pool, _pool_pid
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # Render processes come from a forkserver rather than forking a (possibly threaded) web worker
+            context = multiprocessing.get_context('forkserver' if os.name == 'posix' else 'spawn')
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _discard_pool(pool):
+    # Drops a broken pool, unless another thread already replaced it, and releases its processes and threads
+    global _pool
+    with _lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def render_iter(tasks, workers=None):
+    """
+    Runs render tasks across the render process pool, yielding (index, result) pairs as they finish.
+
+    Parameters
+    ----------
+    tasks: list of (function, args, kwargs) tuples
+        The plotting functions to call. They and their arguments are pickled, so pass only the slice of
+        the data each plot needs.
+    workers: int
+        The number of render processes. Defaults to the RENDER_WORKERS config. With 0 (or a single task)
+        the tasks run in this process.
+
+    At most twice as many tasks as workers are submitted at once, so a large request does not pickle
+    all of its data up front.
+    """
+    workers = current_app.config['RENDER_WORKERS'] if workers is None else workers
+    if workers <= 0 or len(tasks) <= 1:
+        for index, (function, args, kwargs) in enumerate(tasks):
+            yield index, function(*args, **kwargs)
+        return
+
+    pool = _get_pool(workers)
+    pending = {}
+    try:
+        for index, (function, args, kwargs) in enumerate(tasks):
+            while len(pending) >= 2 * workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+            pending[pool.submit(function, *args, **kwargs)] = index
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+    except BrokenProcessPool:
+        _discard_pool(pool)  # A render process died, start a fresh pool for the next request
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def render_all(tasks, workers=None):
+    """
+    Runs render tasks across the render process pool (see render_iter) and returns their results in order.
+    """
+    results = [None] * len(tasks)
+    with stage('render'):
+        for index, result in render_iter(tasks, workers):
+            results[index] = result
+    return results
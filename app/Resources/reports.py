@@ -0,0 +1,92 @@
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from .. import engine
+from ..models import BlastReport
+
+# Rows per INSERT statement, keeping the number of bound parameters within every driver's limit
+BATCH_SIZE = 500
+
+
+def report_rows(projectID, reports):
+    """
+    Validates a list of report dictionaries and returns them as BlastReport rows of the project. Later
+    reports of the same holeID replace earlier ones.
+
+    Raises
+    ------
+    ValueError if a report has no holeID, or a depth or score of the wrong type.
+    """
+    rows = {}
+    for number, report in enumerate(reports):
+        if not isinstance(report, dict) or report.get('holeID') in (None, ''):
+            raise ValueError(f'Report {number} has no holeID')
+        try:
+            row = {'projectID': projectID, 'holeID': str(report['holeID']),
+                   'depth': None if report.get('depth') is None else float(report['depth']),
+                   'report': None if report.get('report') is None else str(report['report']),
+                   'score': None if report.get('score') is None else int(report['score'])}
+        except (TypeError, ValueError):
+            raise ValueError(f'Report {number} has an invalid depth or score')
+        rows[row['holeID']] = row
+    return list(rows.values())
+
+
+def upsert_reports(projectID, reports):
+    """
+    Inserts the reports of a project in a single transaction, replacing the existing reports of the same
+    holeIDs. Uses INSERT ... ON CONFLICT DO UPDATE on PostgreSQL and SQLite, and a bulk delete and insert
+    elsewhere.
+
+    Returns
+    -------
+    The number of reports written.
+    """
+    rows = report_rows(projectID, reports)
+    table = BlastReport.__table__
+    with engine.begin() as conn:
+        dialect = {'postgresql': postgresql, 'sqlite': sqlite}.get(conn.dialect.name)
+        for start in range(0, len(rows), BATCH_SIZE):
+            batch = rows[start:start + BATCH_SIZE]
+            if dialect is not None:
+                insert = dialect.insert(table).values(batch)
+                conn.execute(insert.on_conflict_do_update(
+                    index_elements=[table.c.projectID, table.c.holeID],
+                    set_={name: insert.excluded[name] for name in ('depth', 'report', 'score')}))
+            else:
+                conn.execute(table.delete().where(table.c.projectID == projectID,
+                                                  table.c.holeID.in_([row['holeID'] for row in batch])))
+                conn.execute(table.insert(), batch)
+    return len(rows)
+
+
+def delete_reports(projectID, holeIDs):
+    """
+    Deletes the reports of the given holes of a project, returning how many were deleted.
+    """
+    table = BlastReport.__table__
+    with engine.begin() as conn:
+        return conn.execute(table.delete().where(table.c.projectID == projectID,
+                                                 table.c.holeID.in_([str(hole) for hole in holeIDs]))).rowcount
+
+
+def query_reports(projectID, holeIDs=None, min_score=None, max_score=None, min_depth=None, max_depth=None,
+                  offset=0, limit=None):
+    """
+    Returns the reports of a project as dictionaries, sorted by holeID, filtered by holes and by ranges of
+    score and depth (bounds are inclusive, None for unbounded). Served by the (projectID, score) and
+    (projectID, depth) indexes.
+    """
+    table = BlastReport.__table__
+    query = select(table).where(table.c.projectID == projectID)
+    if holeIDs:
+        query = query.where(table.c.holeID.in_(holeIDs))
+    for col, low, high in ((table.c.score, min_score, max_score), (table.c.depth, min_depth, max_depth)):
+        if low is not None:
+            query = query.where(col >= low)
+        if high is not None:
+            query = query.where(col <= high)
+    query = query.order_by(table.c.holeID).offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
+    with engine.connect() as conn:
+        return [dict(row._mapping) for row in conn.execute(query)]
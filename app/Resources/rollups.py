@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+from flask import current_app, has_app_context
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from .. import engine
+from ..config import Config
+from ..instrumentation import stage
+from ..models import DepthRollup
+from .cache import frame_cache
+from .data_access import FEATURES, load_project, load_hole, data_version
+from .plotting import hardness_classes
+
+ROLLUP_COLUMNS = ['holeID', 'resolution', 'bin', 'rows', 'depth_top', 'hardness'] + \
+    [f'{feature}_{name}' for feature in FEATURES for name in ('mean', 'min', 'max')]
+
+
+def resolutions():
+    """
+    Returns the sorted bin heights the rollups are built at: ROLLUP_RESOLUTIONS and HARDNESS_RESOLUTION.
+    """
+    config = current_app.config if has_app_context() else vars(Config)
+    return sorted({float(value) for value in config['ROLLUP_RESOLUTIONS']} | {float(config['HARDNESS_RESOLUTION'])})
+
+
+def build_rollups(frame, resolutions):
+    """
+    Bins the MWD rows of one or more holes by depth at each resolution, with one groupby pass per resolution.
+
+    Parameters
+    ----------
+    frame: Pandas DataFrame
+        MWD rows holding the holeID, Depth and feature columns, in any order.
+    resolutions: list of float
+        The bin heights.
+
+    Returns
+    -------
+    A Pandas DataFrame with the ROLLUP_COLUMNS, a row per (holeID, resolution, bin) holding rows: the
+    row count of the bin, depth_top: the top of the bin, the mean/min/max of every feature, and
+    hardness: the class of the mean PenetrRate of the bin (see plotting.hardness_classes).
+    Rows without a depth are left out.
+    """
+    frame = frame[frame.Depth.notna()]
+    holes = frame.holeID.astype(str).values
+    aggregations = {'rows': ('Depth', 'size')}
+    for feature in FEATURES:
+        for name in ('mean', 'min', 'max'):
+            aggregations[f'{feature}_{name}'] = (feature, name)
+
+    rollups = []
+    for resolution in resolutions:
+        bins = np.floor(frame.Depth.values / resolution + 1e-9).astype(np.int64)
+        rollup = frame.assign(holeID=holes, bin=bins).groupby(['holeID', 'bin'], sort=True) \
+            .agg(**aggregations).reset_index()
+        rollup['resolution'] = resolution
+        rollup['depth_top'] = rollup.bin * resolution
+        rollup['hardness'] = np.where(rollup.PenetrRate_mean.isna(), -1, hardness_classes(rollup.PenetrRate_mean))
+        rollups.append(rollup)
+    if not rollups:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS)
+    return pd.concat(rollups, ignore_index=True)[ROLLUP_COLUMNS]
+
+
+def _rows(projectID, version, rollups):
+    return rollups.astype(object).where(rollups.notna(), None).assign(projectID=projectID, version=version) \
+        .to_dict(orient='records')
+
+
+def refresh_rollups(projectID):
+    """
+    Rebuilds the DepthRollup rows of a project from its current MWD rows.
+    """
+    version = data_version('MWD', projectID)
+    rollups = build_rollups(load_project(projectID), resolutions())
+    table = DepthRollup.__table__
+    try:
+        with engine.begin() as conn:
+            table.create(bind=conn, checkfirst=True)
+            conn.execute(table.delete().where(table.c.projectID == projectID))
+            if len(rollups):
+                conn.execute(table.insert(), _rows(projectID, version, rollups))
+    except IntegrityError:  # Another worker rebuilt them at the same time
+        pass
+    return version
+
+
+def refresh_hole_rollups(projectID, holeID):
+    """
+    Rebuilds the DepthRollup rows of one hole after samples were appended to it (see ingest.publish_samples),
+    and marks the other holes' rows, which did not change, as current. The other holes' rows are only kept
+    when all of the project's rows are of the previous data version (or already current); otherwise, e.g.
+    when the project has no rollups yet or another change was published in between, every hole is rebuilt
+    with refresh_rollups.
+    """
+    version = data_version('MWD', projectID)
+    table = DepthRollup.__table__
+    with engine.begin() as conn:
+        table.create(bind=conn, checkfirst=True)
+        oldest, newest = conn.execute(select(func.min(table.c.version), func.max(table.c.version))
+                                      .where(table.c.projectID == projectID)).one()
+    if oldest is None or oldest != newest or oldest not in (version - 1, version):
+        refresh_rollups(projectID)
+        return
+    hole = load_hole(projectID, holeID, columns=['holeID', 'Depth'] + FEATURES)
+    rollups = build_rollups(hole, resolutions())
+    try:
+        with engine.begin() as conn:
+            conn.execute(table.delete().where(table.c.projectID == projectID, table.c.holeID == holeID))
+            if len(rollups):
+                conn.execute(table.insert(), _rows(projectID, version, rollups))
+            conn.execute(table.update().where(table.c.projectID == projectID).values(version=version))
+    except IntegrityError:
+        pass
+
+
+def depth_rollups(projectID, resolution, holeIDs=None):
+    """
+    Returns the depth rollups of a project at a resolution, for every hole or the given holeIDs, sorted by
+    holeID and depth. They are rebuilt first if the project's MWD rows changed since they were stored.
+
+    Raises
+    ------
+    ValueError if the rollups are not built at this resolution (see resolutions).
+    """
+    resolution = float(resolution)
+    if resolution not in resolutions():
+        raise ValueError(f"Rollups are built at resolutions {', '.join(map(str, resolutions()))}")
+    version = data_version('MWD', projectID)
+    rollups = frame_cache.get(('DepthRollup', projectID, resolution), version)
+    if rollups is None:
+        table = DepthRollup.__table__
+        query = select(*[table.c[name] for name in ROLLUP_COLUMNS]).where(
+            table.c.projectID == projectID, table.c.resolution == resolution, table.c.version == version) \
+            .order_by(table.c.holeID, table.c.bin)
+        with stage('db'):
+            rollups = pd.read_sql(query, engine.resolve())
+        if rollups.empty and refresh_rollups(projectID) == version:
+            with stage('db'):
+                rollups = pd.read_sql(query, engine.resolve())
+        rollups = frame_cache.put(('DepthRollup', projectID, resolution), rollups, version)
+    if holeIDs is not None:
+        rollups = rollups[rollups.holeID.isin([str(holeID) for holeID in holeIDs])].reset_index(drop=True)
+    return rollups
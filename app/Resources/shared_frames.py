@@ -0,0 +1,288 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import numpy as np
+from flask import current_app, has_app_context
+from ..config import Config
+from .column_store import MappedProject, pack_project
+
+logger = logging.getLogger(__name__)
+
+# Segment layout: an 8 byte ready flag (set last by the process that fills the segment), the 8 byte length
+# of a JSON header, the 8 byte pid of the process filling the segment, the header, then the sensor, depth and
+# hole code arrays, each aligned to 8 bytes
+_PREFIX = 24
+_ALIGN = 8
+
+
+def _aligned(offset):
+    return -(-offset // _ALIGN) * _ALIGN
+
+
+def _segment_name(projectID, version):
+    return f"mwd_{hashlib.sha1(str(projectID).encode()).hexdigest()[:16]}_{version}"
+
+
+def _untrack(shm):
+    # The resource tracker would unlink the segment when this worker exits, while other workers still use it
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+
+class _Abandoned(Exception):
+    pass
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedFrames:
+    """
+    MWD rows of projects held once per machine in POSIX shared memory, and mapped read-only by every
+    worker, so the number of workers does not multiply the memory taken by the project data.
+
+    A segment holds one project at one data version. The first worker to need it claims it (a marker file
+    <SHARED_MEMORY_DIR>/<segment>.filling holding its pid), loads the rows and fills it; the others wait for
+    its ready flag and map it, and take over if the worker filling it died. Each worker using a segment
+    holds a reference (a marker file <SHARED_MEMORY_DIR>/<segment>.<pid>). When a project's data version
+    changes, workers move to the new segment, and a segment of an old version is unlinked once no live
+    worker references it.
+    """
+    def __init__(self):
+        self._attached = {}  # projectID -> (version, SharedMemory, MappedProject)
+        self._retired = []  # SharedMemory of old versions, closed once no frame uses their buffers
+        self._lock = threading.Lock()
+
+    def _config(self, name):
+        return current_app.config[name] if has_app_context() else getattr(Config, name)
+
+    def enabled(self):
+        return bool(self._config('SHARED_MEMORY_FRAMES'))
+
+    def _ref_dir(self):
+        directory = self._config('SHARED_MEMORY_DIR')
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def project(self, projectID, version, load, features):
+        """
+        Returns the MappedProject of a project at a data version, backed by shared memory. load() returns
+        the project's rows (see column_store.pack_project) when this worker has to fill the segment.
+        Returns None if shared memory is unavailable, so the caller can fall back to a private copy.
+        """
+        with self._lock:
+            attached = self._attached.get(projectID)
+            if attached is not None and attached[0] == version:
+                return attached[2]
+        try:
+            shm, mapped = self._attach_or_create(projectID, version, load, features)
+        except (OSError, TimeoutError, ValueError):
+            logger.exception('Shared memory unavailable for project %s', projectID)
+            return None
+
+        with self._lock:
+            previous = self._attached.get(projectID)
+            self._attached[projectID] = (version, shm, mapped)
+        self._reference(shm.name)
+        if previous is not None:
+            self._release(previous[1])
+        self._collect(projectID, keep=shm.name)
+        return mapped
+
+    def _attach_or_create(self, projectID, version, load, features, timeout=60):
+        from multiprocessing import shared_memory
+        name = _segment_name(projectID, version)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                shm = shared_memory.SharedMemory(name=name)
+            except FileNotFoundError:
+                pass
+            else:
+                _untrack(shm)
+                try:
+                    return shm, self._map(shm, deadline)
+                except _Abandoned:  # The worker filling it died, it is filled again by whoever claims it
+                    shm.close()
+            if self._claim(name):
+                try:
+                    return self._fill(name, projectID, version, load, features)
+                finally:
+                    _remove(self._claim_path(name))
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'Shared memory segment {name} was never filled')
+            time.sleep(.05)
+
+    def _claim_path(self, name):
+        return os.path.join(self._ref_dir(), f'{name}.filling')
+
+    def _claimant(self, name):
+        # The pid of the worker filling a segment, 0 if none (or it did not write its pid yet)
+        try:
+            with open(self._claim_path(name)) as file:
+                return int(file.read() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _claim(self, name):
+        # Claims the filling of a segment. A claim left by a worker that died is taken over
+        path = self._claim_path(name)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                pid = self._claimant(name)
+                if pid == 0 or _alive(pid):
+                    return False
+                _remove(path)
+                continue
+            with os.fdopen(fd, 'w') as file:
+                file.write(str(os.getpid()))
+            return True
+        return False
+
+    def _fill(self, name, projectID, version, load, features):
+        # Loads the rows and fills the segment, holding its claim. A segment left unfilled by a worker that
+        # died is replaced, and nothing is left behind if loading or filling fails
+        from multiprocessing import shared_memory
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            pass
+        else:
+            _untrack(shm)
+            if np.frombuffer(shm.buf, dtype=np.uint64, count=1)[0] == 1:  # Filled by the previous claimant
+                return shm, self._map(shm)
+            shm.close()
+            self._unlink(name)
+
+        packed = pack_project(projectID, version, load(), features)
+        header = json.dumps(packed.meta).encode()
+        offsets, size = [], _aligned(_PREFIX + len(header))
+        for array in (packed.sensors, packed.depth, packed.codes):
+            offsets.append(size)
+            size = _aligned(size + array.nbytes)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=max(size, 1))
+        _untrack(shm)
+        try:
+            flags = np.frombuffer(shm.buf, dtype=np.uint64, count=3)
+            flags[2] = os.getpid()
+            flags[1] = len(header)
+            shm.buf[_PREFIX:_PREFIX + len(header)] = header
+            for offset, array in zip(offsets, (packed.sensors, packed.depth, packed.codes)):
+                target = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf, offset=offset)
+                target[...] = array
+            flags[0] = 1  # Ready
+            del flags, target
+        except BaseException:
+            flags = target = None  # Views of the buffer keep it from closing
+            shm.close()
+            shm.unlink()
+            raise
+        return shm, self._map(shm)
+
+    def _map(self, shm, deadline=None):
+        flags = np.frombuffer(shm.buf, dtype=np.uint64, count=3)
+        deadline = time.monotonic() + 60 if deadline is None else deadline
+        while flags[0] != 1:
+            pid = int(flags[2]) or self._claimant(shm.name)
+            if flags[0] != 1 and (pid == 0 or not _alive(pid)):
+                del flags
+                raise _Abandoned(shm.name)
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'Shared memory segment {shm.name} was never filled')
+            time.sleep(.05)
+        header_length = int(flags[1])
+        del flags
+        meta = json.loads(bytes(shm.buf[_PREFIX:_PREFIX + header_length]))
+        rows, n_features = meta['offsets'][-1], len(meta['features'])
+
+        offset = _aligned(_PREFIX + header_length)
+        arrays = []
+        for shape, dtype in (((n_features, rows), np.float32), ((rows,), np.float64), ((rows,), np.int32)):
+            array = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            array.flags.writeable = False
+            arrays.append(array)
+            offset = _aligned(offset + array.nbytes)
+        return MappedProject(meta, *arrays)
+
+    def _reference(self, name):
+        open(os.path.join(self._ref_dir(), f'{name}.{os.getpid()}'), 'a').close()
+
+    def _references(self, name):
+        # The live workers referencing a segment. Markers of workers that died are removed
+        live = []
+        for marker in os.listdir(self._ref_dir()):
+            segment, _, pid = marker.rpartition('.')
+            if segment != name or not pid.isdigit():
+                continue
+            if _alive(int(pid)):
+                live.append(int(pid))
+            else:
+                _remove(os.path.join(self._ref_dir(), marker))
+        return live
+
+    def _release(self, shm):
+        _remove(os.path.join(self._ref_dir(), f'{shm.name}.{os.getpid()}'))
+        if not self._references(shm.name):
+            self._unlink(shm.name)
+        with self._lock:
+            self._retired.append(shm)
+            retired, self._retired = self._retired, []
+        for old in retired:
+            try:
+                old.close()
+            except BufferError:  # Frames of the old version are still in use, retry on the next release
+                with self._lock:
+                    self._retired.append(old)
+
+    def _collect(self, projectID, keep):
+        # Unlinks the unreferenced segments of the project's older versions, left by workers that exited.
+        # Newer versions, and segments a live worker is still filling, are left alone
+        prefix, _, newest = keep.rpartition('_')
+        names = {marker.rpartition('.')[0] for marker in os.listdir(self._ref_dir())}
+        for name in names:
+            head, _, version = name.rpartition('_')
+            if head != prefix or not version.isdigit() or int(version) >= int(newest):
+                continue
+            claimant = self._claimant(name)
+            if claimant and _alive(claimant):
+                continue
+            if not self._references(name):
+                self._unlink(name)
+
+    def _unlink(self, name):
+        from multiprocessing import shared_memory
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            return
+        _untrack(shm)
+        shm.close()
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+shared_frames = SharedFrames()
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+from .cache import frame_cache
+from .data_access import load_positions, data_version
+
+
+class SpatialIndex:
+    """
+    Location lookups over the hole positions (start_x, start_y) of a project, on a KD-tree. Holes are
+    kept in holeID order, so a hole's position in the tree is found with np.searchsorted. Holes without
+    a position are left out.
+    """
+    def __init__(self, positions):
+        from scipy.spatial import cKDTree
+        positions = positions.dropna(subset=['start_x', 'start_y']).astype({'holeID': str}) \
+            .drop_duplicates('holeID').sort_values('holeID')
+        self.holes = positions.holeID.values
+        self.xy = positions[['start_x', 'start_y']].values.astype(np.float64)
+        self.tree = cKDTree(self.xy if len(self.xy) else np.empty((0, 2)))
+
+    def __len__(self):
+        return len(self.holes)
+
+    @property
+    def nbytes(self):
+        # Approximate memory held (the tree about doubles the coordinates), for the frame cache's byte bound
+        return self.holes.nbytes + 3 * self.xy.nbytes
+
+    def positions(self, holeIDs):
+        """
+        Returns the row of each holeID in the index, or -1 where the hole has no position.
+        """
+        holeIDs = np.asarray(holeIDs, dtype=str)
+        rows = np.clip(np.searchsorted(self.holes, holeIDs), 0, max(len(self.holes) - 1, 0))
+        found = (self.holes[rows] == holeIDs) if len(self.holes) else np.zeros(len(holeIDs), dtype=bool)
+        return np.where(found, rows, -1)
+
+    def coordinates(self, holeIDs):
+        """
+        Returns the (x, y) of each holeID as an array of shape (n, 2), NaN where the hole has no position.
+        """
+        rows = self.positions(holeIDs)
+        xy = np.full((len(rows), 2), np.nan)
+        xy[rows >= 0] = self.xy[rows[rows >= 0]]
+        return xy
+
+    def frame(self, rows):
+        return pd.DataFrame({'holeID': self.holes[rows], 'start_x': self.xy[rows, 0], 'start_y': self.xy[rows, 1]})
+
+    def nearest(self, x, y, k=5, exclude=None):
+        """
+        Returns the k holes nearest to (x, y), nearest first, as a DataFrame with a distance column. The
+        hole exclude (e.g. the hole the query is centred on) is left out.
+        """
+        count = min(k + (exclude is not None), len(self))
+        if count == 0:
+            return self.frame([]).assign(distance=[])
+        distances, rows = self.tree.query([x, y], k=count)
+        distances, rows = np.atleast_1d(distances), np.atleast_1d(rows)
+        keep = self.holes[rows] != exclude if exclude is not None else np.ones(len(rows), dtype=bool)
+        return self.frame(rows[keep][:k]).assign(distance=distances[keep][:k])
+
+    def within_radius(self, x, y, radius):
+        """
+        Returns the holes within radius of (x, y), nearest first, as a DataFrame with a distance column.
+        """
+        rows = np.asarray(self.tree.query_ball_point([x, y], r=radius), dtype=np.int64)
+        distances = np.hypot(self.xy[rows, 0] - x, self.xy[rows, 1] - y)
+        order = np.argsort(distances, kind='stable')
+        return self.frame(rows[order]).assign(distance=distances[order])
+
+    def within_box(self, min_x, min_y, max_x, max_y):
+        """
+        Returns the holes inside a bounding box (edges included), in holeID order.
+        """
+        inside = (self.xy[:, 0] >= min_x) & (self.xy[:, 0] <= max_x) & \
+                 (self.xy[:, 1] >= min_y) & (self.xy[:, 1] <= max_y)
+        return self.frame(np.flatnonzero(inside))
+
+
+def spatial_index(projectID):
+    """
+    Returns the SpatialIndex of a project's current hole positions, rebuilding it when the project's
+    HolePositions data version changed. Indexes are held in this worker's frame cache.
+    """
+    version = data_version('HolePositions', projectID)
+    index = frame_cache.get(('SpatialIndex', projectID), version)
+    if index is None:
+        index = frame_cache.put(('SpatialIndex', projectID), SpatialIndex(load_positions(projectID)), version)
+    return index
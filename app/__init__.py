@@ -1,20 +1,49 @@
 import os
+# Plots are only ever rendered off-screen. Set before anything can import matplotlib
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+import click
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from .config import config_by_name
-from sqlalchemy import create_engine
+from . import instrumentation
+from .config import Config, config_by_name
+from .database import LazyEngine, PoolMetrics, SharedEngineSQLAlchemy
 
-db = SQLAlchemy()
-engine = create_engine(os.environ.get('DATABASE_LINK'))
+# A single engine (and pool) per worker process, used by both the models and the pandas queries. It is
+# created on first use, with the pool options of the configuration create_app was given
+pool_metrics = PoolMetrics()
+engine = LazyEngine(Config, pool_metrics)
+db = SharedEngineSQLAlchemy(engine)
 
 
 # Creates and returns the app with a specific configuration
 def create_app(config_name):
     app = Flask(__name__)
     app.config.from_object(config_by_name[config_name])
+    engine.configure(app.config)
     db.init_app(app)
+    instrumentation.init_app(app)
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Creates the missing tables and indexes."""
+        init_db()
+        click.echo('Database initialized')
 
     with app.app_context():
         from . import routes
-        db.create_all()
+        from .Resources.cache import frame_cache
+        frame_cache.configure(app.config['FRAME_CACHE_MAX_BYTES'], app.config['FRAME_CACHE_TTL'])
+        # The schema is normally created by `flask init-db` (the release step of the Procfile), so booting a
+        # worker does not wait on the database
+        if app.config['INIT_DB_ON_BOOT']:
+            init_db()
         return app
+
+
+# Creates the tables of the models and their indexes, skipping the ones that exist, after migrating tables
+# created with an older primary key (see models.migrate_tables). Needs an app context
+def init_db():
+    from .models import ensure_indexes, migrate_tables
+    migrate_tables()
+    db.create_all()
+    ensure_indexes()
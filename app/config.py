@@ -1,3 +1,4 @@
+import os
 from os import environ, path
 from dotenv import load_dotenv, find_dotenv
 
@@ -11,11 +12,64 @@ class Config:
     DEBUG = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_DATABASE_URI = environ.get('DATABASE_LINK')
+    # Create missing tables when the app starts, instead of with `flask init-db`
+    INIT_DB_ON_BOOT = environ.get('INIT_DB_ON_BOOT', '0') == '1'
+    # Connection pool of the engine shared by the models and pandas, per worker process
+    DB_POOL_SIZE = int(environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(environ.get('DB_MAX_OVERFLOW', 5))
+    DB_POOL_TIMEOUT = int(environ.get('DB_POOL_TIMEOUT', 30))  # Seconds to wait for a free connection
+    DB_POOL_RECYCLE = int(environ.get('DB_POOL_RECYCLE', 1800))  # Seconds before a connection is replaced
+    DB_POOL_PRE_PING = environ.get('DB_POOL_PRE_PING', '1') == '1'
+    DB_STATEMENT_TIMEOUT = int(environ.get('DB_STATEMENT_TIMEOUT', 60000))  # Milliseconds, PostgreSQL only
+    # Per-worker cache of project DataFrames
+    FRAME_CACHE_MAX_BYTES = int(environ.get('FRAME_CACHE_MAX_BYTES', 256 * 2 ** 20))
+    FRAME_CACHE_TTL = int(environ.get('FRAME_CACHE_TTL', 600))  # Seconds
+    # Projects with more MWD rows than this are clustered on a sample of each hole
+    CLUSTER_SCALABLE_ROWS = int(environ.get('CLUSTER_SCALABLE_ROWS', 20000))
+    CLUSTER_SAMPLE_SIZE = int(environ.get('CLUSTER_SAMPLE_SIZE', 5000))
+    # Fitted scalers/PCA/cluster models, used to label newly drilled rows without refitting
+    MODEL_DIR = environ.get('MODEL_DIR', path.join(path.dirname(basedir), 'instance', 'models'))
+    # Refit once the rows added since the last fit exceed this fraction of the fitted rows
+    CLUSTER_REFIT_FRACTION = float(environ.get('CLUSTER_REFIT_FRACTION', 0.25))
+    # Refit when new rows drift further than this many standard deviations from the fitted data
+    CLUSTER_DRIFT_THRESHOLD = float(environ.get('CLUSTER_DRIFT_THRESHOLD', 0.5))
+    # Rendered plot images, shared by the workers of a machine
+    RENDER_CACHE_DIR = environ.get('RENDER_CACHE_DIR', path.join(path.dirname(basedir), 'instance', 'renders'))
+    # Processes each web worker renders plots with. 0 renders in the web worker itself. Defaults to an even
+    # share of the machine's CPUs between the WEB_CONCURRENCY web workers (see gunicorn.conf.py)
+    RENDER_WORKERS = int(environ.get('RENDER_WORKERS',
+                                     max(1, (os.cpu_count() or 1) // int(environ.get('WEB_CONCURRENCY', 2)))))
+    # Local memory mapped copy of the MWD sensor columns of each project, read instead of the database.
+    # Disabled unless set
+    COLUMN_STORE_DIR = environ.get('COLUMN_STORE_DIR')
+    # Hold each project's MWD rows once per machine in shared memory, mapped read-only by every worker
+    SHARED_MEMORY_FRAMES = environ.get('SHARED_MEMORY_FRAMES', '0') == '1'
+    # Marker files recording which workers use each shared memory segment
+    SHARED_MEMORY_DIR = environ.get('SHARED_MEMORY_DIR', path.join(path.dirname(basedir), 'instance', 'shm-refs'))
+    # Depth bin heights the DepthRollup table is built at, and the one the hardness bar charts are drawn from
+    ROLLUP_RESOLUTIONS = [float(value) for value in environ.get('ROLLUP_RESOLUTIONS', '0.1,0.5,1.0').split(',')]
+    HARDNESS_RESOLUTION = float(environ.get('HARDNESS_RESOLUTION', 0.5))
+    # Streamed samples (POST .../stream) are written every STREAM_BATCH_ROWS samples, or STREAM_BATCH_SECONDS
+    STREAM_BATCH_ROWS = int(environ.get('STREAM_BATCH_ROWS', 500))
+    STREAM_BATCH_SECONDS = float(environ.get('STREAM_BATCH_SECONDS', 2.0))
+    # and made visible to readers (bumping the project's data version) at most every STREAM_PUBLISH_SECONDS
+    STREAM_PUBLISH_SECONDS = float(environ.get('STREAM_PUBLISH_SECONDS', 10.0))
+    # Threads each web worker runs background jobs (POST .../jobs) on
+    JOB_WORKERS = int(environ.get('JOB_WORKERS', 2))
+    # Queued and running jobs are refreshed every JOB_HEARTBEAT_SECONDS by their worker, and considered failed
+    # (e.g. the worker was killed) once not refreshed for JOB_STALE_SECONDS
+    JOB_HEARTBEAT_SECONDS = float(environ.get('JOB_HEARTBEAT_SECONDS', 15))
+    JOB_STALE_SECONDS = float(environ.get('JOB_STALE_SECONDS', 60))
+    # Requests sending PROFILE_HEADER are run under cProfile when PROFILING is on (see instrumentation.py)
+    PROFILING = False
+    PROFILE_HEADER = 'X-Profile'
+    PROFILE_DIR = environ.get('PROFILE_DIR', path.join(path.dirname(basedir), 'instance', 'profiles'))
 
 # Development configuration
 class DevConfig(Config):
     SECRET_KEY = environ.get('DEV_SECRET_KEY')
     DEBUG = True
+    PROFILING = True
 
 
 # Production Configuration
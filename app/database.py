@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+from flask import current_app, has_app_context
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, event, exc
+
+
+class PoolMetrics:
+    """
+    Counts the connection pool events of this worker process: connections opened, checkouts, checkins,
+    connections dropped because they were opened by another process, and how long connections are held.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.foreign_pid = 0
+        self.held_seconds = 0.0
+        self.max_held_seconds = 0.0
+
+    def attach(self, engine):
+        event.listen(engine, 'connect', self._connect)
+        event.listen(engine, 'checkout', self._checkout)
+        event.listen(engine, 'checkin', self._checkin)
+
+    def _connect(self, dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+        with self._lock:
+            self.connects += 1
+
+    def _checkout(self, dbapi_connection, connection_record, connection_proxy):
+        # A connection inherited through a fork shares its socket with the parent process, never reuse it
+        if connection_record.info.get('pid') != os.getpid():
+            with self._lock:
+                self.foreign_pid += 1
+            connection_record.connection = connection_proxy.connection = None
+            raise exc.DisconnectionError('Connection belongs to another process')
+        connection_record.info['checked_out'] = time.perf_counter()
+        with self._lock:
+            self.checkouts += 1
+
+    def _checkin(self, dbapi_connection, connection_record):
+        started = connection_record.info.pop('checked_out', None)
+        with self._lock:
+            self.checkins += 1
+            if started is not None:
+                held = time.perf_counter() - started
+                self.held_seconds += held
+                self.max_held_seconds = max(self.max_held_seconds, held)
+
+    def stats(self, engine):
+        pool = engine.pool
+        with self._lock:
+            stats = {'pid': os.getpid(), 'pool': pool.status(), 'connects': self.connects,
+                     'checkouts': self.checkouts, 'checkins': self.checkins, 'foreign_pid': self.foreign_pid,
+                     'mean_held_seconds': self.held_seconds / self.checkins if self.checkins else 0.0,
+                     'max_held_seconds': self.max_held_seconds}
+        for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+            if hasattr(pool, name):
+                stats[name] = getattr(pool, name)()
+        return stats
+
+
+def make_engine(config, metrics=None):
+    """
+    Creates the engine shared by the ORM models and the pandas read paths, with the pool options of a
+    configuration (an app.config mapping). Connections opened by another process (before a fork) are
+    never reused, so each worker ends up with its own pool.
+    """
+    url = config['SQLALCHEMY_DATABASE_URI']
+    options = {'pool_pre_ping': config['DB_POOL_PRE_PING'], 'pool_recycle': config['DB_POOL_RECYCLE']}
+    connect_args = {}
+    if url and not url.startswith('sqlite'):  # SQLite's pools are not sized
+        options.update(pool_size=config['DB_POOL_SIZE'], max_overflow=config['DB_MAX_OVERFLOW'],
+                       pool_timeout=config['DB_POOL_TIMEOUT'])
+    if url and url.startswith('postgres') and config['DB_STATEMENT_TIMEOUT']:
+        connect_args['options'] = f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT']}"
+    engine = create_engine(url, connect_args=connect_args, **options)
+    if metrics is not None:
+        metrics.attach(engine)
+    return engine
+
+
+class LazyEngine:
+    """
+    The engine of this worker process, created on first use from the configuration given to configure
+    (by create_app), or else from the current app's configuration or the base Config class. Attributes
+    are forwarded to the engine, so it is used like one; resolve() returns the engine itself, for the
+    libraries that check its type (pandas, the ORM session).
+    """
+    def __init__(self, default_config, metrics=None):
+        self._default_config = default_config
+        self._metrics = metrics
+        self._config = None
+        self._engine = None
+        self._lock = threading.Lock()
+
+    def configure(self, config):
+        with self._lock:
+            self._config = config
+            if self._engine is not None:  # Created from another configuration, e.g. while importing
+                self._engine.dispose()
+                self._engine = None
+
+    def resolve(self):
+        engine = self._engine
+        if engine is None:
+            with self._lock:
+                if self._engine is None:
+                    config = self._config
+                    if config is None:
+                        config = current_app.config if has_app_context() else \
+                            {name: getattr(self._default_config, name) for name in dir(self._default_config)
+                             if name.isupper()}
+                    self._engine = make_engine(config, self._metrics)
+                engine = self._engine
+        return engine
+
+    def dispose(self):
+        if self._engine is not None:
+            self._engine.dispose()
+
+    def after_fork(self):
+        # A worker forked from a process that already used the engine starts with an empty pool of its own
+        if self._engine is not None:
+            self._engine.pool = self._engine.pool.recreate()
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+
+class SharedEngineSQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy bound to an existing engine rather than one it creates per app, so the ORM session
+    and the pandas queries check connections out of the same pool.
+    """
+    def __init__(self, engine, **kwargs):
+        self.shared_engine = engine
+        super().__init__(**kwargs)
+
+    def get_engine(self, app=None, bind=None):
+        if bind is None:
+            return self.shared_engine.resolve() if isinstance(self.shared_engine, LazyEngine) else self.shared_engine
+        return super().get_engine(app, bind)
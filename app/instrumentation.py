@@ -0,0 +1,165 @@
+import bisect
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request, Response
+
+logger = logging.getLogger('app.requests')
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    """
+    A cumulative latency histogram per label set, rendered in the Prometheus text format.
+    """
+    def __init__(self, name, documentation, label_names, buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *label_values):
+        with self._lock:
+            series = self._series.setdefault(label_values, [0] * (len(self.buckets) + 1) + [0.0])
+            series[bisect.bisect_left(self.buckets, seconds)] += 1
+            series[-1] += seconds
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted(self._series.items())
+        for label_values, counts in series:
+            labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + ['+Inf'], counts[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {counts[-1]}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return '\n'.join(lines)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+request_seconds = Histogram('mwd_request_seconds', 'Latency of the API requests by resource',
+                            ('resource', 'method', 'status'))
+stage_seconds = Histogram('mwd_stage_seconds', 'Time spent in each stage of the requests (db, cluster, '
+                                               'render, encode...)', ('stage',))
+
+
+# Names of the stages open in each thread
+_open = threading.local()
+
+
+@contextmanager
+def stage(name):
+    """
+    Times a stage of the current request. The time is added to the request's Server-Timing header and
+    structured log line, and to the stage histogram of /metrics. Stages may nest; a stage entered again
+    while it is already open in the thread (e.g. a timed function calling another timed with the same
+    name) is only counted once, by the outermost one.
+    """
+    names = _open.__dict__.setdefault('names', set())
+    if name in names:
+        yield
+        return
+    names.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        names.discard(name)
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, name)
+        if has_request_context():
+            stages = g.setdefault('stages', {})
+            stages[name] = stages.get(name, 0.0) + elapsed
+
+
+def timed(name):
+    """
+    Decorator timing every call of a function as a stage (see stage).
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def metrics_text(samples=()):
+    """
+    Returns the histograms, followed by (name, type, documentation, value) samples of counters and gauges,
+    in the Prometheus text format.
+    """
+    parts = [request_seconds.render(), stage_seconds.render()]
+    for name, kind, documentation, value in samples:
+        parts.append(f'# HELP {name} {documentation}\n# TYPE {name} {kind}\n{name} {value}')
+    return '\n'.join(parts) + '\n'
+
+
+def init_app(app):
+    """
+    Times every request of the app: adds a Server-Timing header with its stages, records it in the
+    request histogram and logs it as a JSON line. With PROFILING enabled (the dev config), a request
+    carrying the PROFILE_HEADER header is run under cProfile; its stats are saved to PROFILE_DIR and the
+    slowest functions are returned in place of the response if the header's value is 'text'.
+    """
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+        g.stages = {}
+        if app.config['PROFILING'] and request.headers.get(app.config['PROFILE_HEADER']):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def record(response):
+        start = g.pop('request_start', None)
+        if start is None:
+            return response
+        total = time.perf_counter() - start
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            response = _profile_response(app, profiler, response)
+
+        resource = request.endpoint or 'unknown'
+        request_seconds.observe(total, resource, request.method, response.status_code)
+        stages = g.get('stages', {})
+        timings = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in stages.items()]
+        response.headers['Server-Timing'] = ', '.join(timings + [f'total;dur={total * 1000:.1f}'])
+        logger.info(json.dumps({'event': 'request', 'resource': resource, 'method': request.method,
+                                'path': request.path, 'status': response.status_code, 'pid': os.getpid(),
+                                'seconds': round(total, 4),
+                                'stages': {name: round(seconds, 4) for name, seconds in stages.items()}}))
+        return response
+
+
+def _profile_response(app, profiler, response):
+    directory = app.config['PROFILE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{request.endpoint}-{int(time.time() * 1000)}-{os.getpid()}.prof')
+    profiler.dump_stats(path)
+    if request.headers.get(app.config['PROFILE_HEADER']) == 'text':
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(40)
+        response = Response(output.getvalue(), mimetype='text/plain')
+    response.headers['X-Profile-File'] = path
+    return response
+
@@ -1,3 +1,5 @@
+import json
+from datetime import datetime
 from . import db, engine
 
 
@@ -5,6 +7,7 @@ from . import db, engine
 class MWD(db.Model):
     #__table__ = Table('EPIROC', metadata, Column('Time', String, primary_key = True), autoload= True)
     __tablename__ = 'MWD'
+    __table_args__ = (db.Index('ix_MWD_project_hole_depth', 'projectID', 'holeID', 'Depth'),)
     index = db.Column(db.Integer, primary_key=True)
     PenetrRate = db.Column(db.Float)
     PercPressure = db.Column(db.Float)
@@ -12,12 +15,78 @@ class MWD(db.Model):
     RotPressure = db.Column(db.Float)
     InstPentRate = db.Column(db.Float)
     holeID = db.Column(db.String(32))
-    depth = db.Column(db.Float)
+    depth = db.Column('Depth', db.Float) # Tables loaded through pandas name this column 'Depth'
     Time = db.Column(db.String(50))
     projectID = db.Column(db.String(50), primary_key=True)
     plan_name = db.Column(db.String(60))
 
 
+# Collar positions of each hole in a project
+class HolePositions(db.Model):
+    __tablename__ = 'HolePositions'
+    __table_args__ = (db.Index('ix_HolePositions_project_hole', 'projectID', 'holeID'),)
+    projectID = db.Column(db.String(50), primary_key=True)
+    holeID = db.Column(db.String(32), primary_key=True)
+    start_x = db.Column(db.Float)
+    start_y = db.Column(db.Float)
+
+
+# Version counter of the rows of a project in a table, incremented whenever they are replaced.
+# Lets every worker process tell whether its cached copies of a project are stale.
+class DataVersion(db.Model):
+    __tablename__ = 'DataVersion'
+    tablename = db.Column(db.String(64), primary_key=True)
+    projectID = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+
+
+# Creates the indexes declared on the models for tables that already exist (db.create_all() skips
+# existing tables, and tables replaced through pandas lose their indexes)
+def ensure_indexes(bind=engine):
+    for model in (MWD, HolePositions, BlastReport):
+        for index in model.__table__.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+
+# Brings tables created with an older primary key up to their model, before db.create_all(). BlastCluster
+# only holds derived data and is recreated. BlastReport, once keyed by holeID alone, is copied to
+# BlastReport_legacy, recreated, and refilled with each report under every project holding its hole in
+# HolePositions; reports of unknown holes are left in BlastReport_legacy
+def migrate_tables(bind=None):
+    from sqlalchemy import column, inspect, select, table as sql_table
+    bind = engine.resolve() if bind is None else bind
+    inspector = inspect(bind)
+    tables = set(inspector.get_table_names())
+    for model in (BlastCluster, BlastReport):
+        table = model.__table__
+        if table.name not in tables:
+            continue
+        keys = set(inspector.get_pk_constraint(table.name)['constrained_columns'])
+        if keys == {c.name for c in table.primary_key.columns}:
+            continue
+        with bind.begin() as conn:
+            if model is BlastReport:
+                legacy = 'BlastReport_legacy'
+                if legacy in tables:
+                    conn.exec_driver_sql(f'DROP TABLE "{legacy}"')
+                conn.exec_driver_sql(f'CREATE TABLE "{legacy}" AS SELECT * FROM "{table.name}"')
+                old = sql_table(table.name, *[column(name) for name in ('holeID', 'depth', 'report', 'score')])
+                reports = conn.execute(select(old)).fetchall()
+            table.drop(bind=conn)
+            table.create(bind=conn)
+            if model is BlastReport and reports and HolePositions.__tablename__ in tables:
+                positions = HolePositions.__table__
+                holes = conn.execute(select(positions.c.projectID, positions.c.holeID).distinct()).fetchall()
+                projects = {}
+                for projectID, holeID in holes:
+                    projects.setdefault(str(holeID), []).append(projectID)
+                rows = [{'projectID': projectID, 'holeID': str(holeID), 'depth': depth, 'report': report,
+                         'score': score}
+                        for holeID, depth, report, score in reports for projectID in projects.get(str(holeID), [])]
+                if rows:
+                    conn.execute(table.insert(), rows)
+
+
 # class Montana(MWD, db.Model):
 #   __tablename__ = 'Montana'
 
@@ -26,21 +95,31 @@ class MWD(db.Model):
 #   __tablename__ = 'PortInland'
 
 
-# For holding 2D MWD Data for Clustering/Plotting uses
+# For holding 2D MWD Data for Clustering/Plotting uses. Each clustering run of a project (one set of
+# clustering parameters) stores a row per MWD sample, in the order of data_access.load_project when it is
+# fit, followed by the samples labelled since (matched back to load_project by holeID and depth)
 class BlastCluster(db.Model):
     __tablename__ = 'BlastCluster'
-    holeID = db.Column(db.String(32), primary_key = True)
-    depth = db.Column(db.Float, primary_key = True) ## holeID + Depth combination as the primary keys
+    projectID = db.Column(db.String(50), primary_key = True)
+    run = db.Column(db.String(64), primary_key = True) ## Identifies the clustering parameters
+    row = db.Column(db.Integer, primary_key = True) ## Order the samples were stored in
+    version = db.Column(db.Integer) ## Data version of the project's MWD rows the labels were fit on
+    holeID = db.Column(db.String(32))
+    depth = db.Column(db.Float)
     CID = db.Column(db.Integer)
     x = db.Column(db.Float) ## MDS Coordinate
     y = db.Column(db.Float) ## MDS Coordinate
 
-    def __init__(self, holeID, depth, CID, x, y):
+    def __init__(self, holeID, depth, CID, x, y, projectID = None, run = None, row = None, version = None):
         self.holeID = holeID
         self.depth = depth
         self.CID = CID
         self.x = x
         self.y = y
+        self.projectID = projectID
+        self.run = run
+        self.row = row
+        self.version = version
 
     def serialize(self):
         return {'holeID': self.holeID, 'depth': self.depth, 'CID': self.CID, 'x': self.x, 'y': self.y}
@@ -49,21 +128,142 @@ class BlastCluster(db.Model):
 # Reports on blasting given a holeID and depth, with the report and score for the blast
 class BlastReport(db.Model):
     __tablename__ = 'BlastReport'
+    __table_args__ = (db.Index('ix_BlastReport_project_score', 'projectID', 'score'),
+                      db.Index('ix_BlastReport_project_depth', 'projectID', 'depth'))
+    projectID = db.Column(db.String(50), primary_key = True)
     holeID = db.Column(db.String(32), primary_key = True)
     depth = db.Column(db.Float)
     report = db.Column(db.String(255))
     score = db.Column(db.Integer)
 
-    def __init__(self, holeID, depth, report, score):
+    def __init__(self, holeID, depth, report, score, projectID = None):
+        self.projectID = projectID
         self.holeID = holeID
         self.depth = depth
         self.report = report
         self.score = score
 
     def serialize(self):
-        return {'holeID': self.holeID, 'depth': self.depth, 'report': self.report, 'score': self.score}
+        return {'projectID': self.projectID, 'holeID': self.holeID, 'depth': self.depth, 'report': self.report,
+                'score': self.score}
 
     def __repr__(self):
-        return f"Report(holeID = {self.holeID}, depth = {self.depth}, report = {self.report}, score = {self.score})"
+        return f"Report(projectID = {self.projectID}, holeID = {self.holeID}, depth = {self.depth}, " \
+               f"report = {self.report}, score = {self.score})"
+
 
+# Long running clustering/rendering requests, executed in the background by app/Resources/jobs.py
+class Job(db.Model):
+    __tablename__ = 'Job'
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)
+    projectID = db.Column(db.String(50))
+    params = db.Column(db.Text) ## JSON encoded arguments of the job
+    key = db.Column(db.String(40), index=True) ## Identifies identical jobs, for deduplication
+    active_key = db.Column(db.String(40), unique=True) ## key while queued or running, so only one is active
+    worker = db.Column(db.String(80)) ## host:pid of the worker process running the job
+    status = db.Column(db.String(16), nullable=False, default='queued') ## queued, running, done or failed
+    progress = db.Column(db.Float, default=0.0)
+    result = db.Column(db.Text) ## JSON encoded result, once done
+    error = db.Column(db.Text)
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+    updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow) ## Refreshed by heartbeats
 
+    def serialize(self):
+        return {'id': self.id, 'kind': self.kind, 'projectID': self.projectID, 'params': json.loads(self.params),
+                'status': self.status, 'progress': self.progress,
+                'result': json.loads(self.result) if self.result is not None else None, 'error': self.error,
+                'created': self.created.isoformat() if self.created else None,
+                'updated': self.updated.isoformat() if self.updated else None}
+
+
+# Per-hole summary of a project's MWD rows and hole positions, rebuilt on ingest (see hole_summary.py)
+class HoleSummary(db.Model):
+    __tablename__ = 'HoleSummary'
+    projectID = db.Column(db.String(50), primary_key=True)
+    holeID = db.Column(db.String(32), primary_key=True)
+    stamp = db.Column(db.String(32)) ## data_access.project_stamp of the rows it summarizes
+    row_offset = db.Column(db.Integer) ## First row of the hole in data_access.load_project
+    row_count = db.Column(db.Integer)
+    depth_min = db.Column(db.Float)
+    depth_max = db.Column(db.Float)
+    PenetrRate_min = db.Column(db.Float)
+    PenetrRate_max = db.Column(db.Float)
+    PercPressure_min = db.Column(db.Float)
+    PercPressure_max = db.Column(db.Float)
+    FeedPressure_min = db.Column(db.Float)
+    FeedPressure_max = db.Column(db.Float)
+    RotPressure_min = db.Column(db.Float)
+    RotPressure_max = db.Column(db.Float)
+    InstPentRate_min = db.Column(db.Float)
+    InstPentRate_max = db.Column(db.Float)
+    start_x = db.Column(db.Float)
+    start_y = db.Column(db.Float)
+
+
+# Most common cluster of each hole for a clustering run, written whenever the run is (re)computed
+class HoleCluster(db.Model):
+    __tablename__ = 'HoleCluster'
+    projectID = db.Column(db.String(50), primary_key=True)
+    run = db.Column(db.String(64), primary_key=True)
+    holeID = db.Column(db.String(32), primary_key=True)
+    version = db.Column(db.Integer) ## Data version of the project's MWD rows
+    CID = db.Column(db.Integer)
+
+
+# Running aggregates of the MWD rows of each hole, updated by every streamed batch of samples and rebuilt on
+# bulk ingest (see hole_aggregates.py). Each feature keeps its Welford count, mean and sum of squared deviations
+class HoleAggregate(db.Model):
+    __tablename__ = 'HoleAggregate'
+    projectID = db.Column(db.String(50), primary_key=True)
+    holeID = db.Column(db.String(32), primary_key=True)
+    rows = db.Column(db.Integer)
+    depth_min = db.Column(db.Float)
+    depth_max = db.Column(db.Float)
+    hard = db.Column(db.Integer) ## Samples of each PenetrRate hardness class (see plotting.hardness_classes)
+    medium = db.Column(db.Integer)
+    soft = db.Column(db.Integer)
+    PenetrRate_n = db.Column(db.Integer)
+    PenetrRate_mean = db.Column(db.Float)
+    PenetrRate_m2 = db.Column(db.Float)
+    PercPressure_n = db.Column(db.Integer)
+    PercPressure_mean = db.Column(db.Float)
+    PercPressure_m2 = db.Column(db.Float)
+    FeedPressure_n = db.Column(db.Integer)
+    FeedPressure_mean = db.Column(db.Float)
+    FeedPressure_m2 = db.Column(db.Float)
+    RotPressure_n = db.Column(db.Integer)
+    RotPressure_mean = db.Column(db.Float)
+    RotPressure_m2 = db.Column(db.Float)
+    InstPentRate_n = db.Column(db.Integer)
+    InstPentRate_mean = db.Column(db.Float)
+    InstPentRate_m2 = db.Column(db.Float)
+
+
+# Depth-binned summaries of the MWD rows of each hole at several resolutions, rebuilt on ingest (see rollups.py).
+# Bin `bin` of a resolution covers depths [bin * resolution, (bin + 1) * resolution)
+class DepthRollup(db.Model):
+    __tablename__ = 'DepthRollup'
+    projectID = db.Column(db.String(50), primary_key=True)
+    holeID = db.Column(db.String(32), primary_key=True)
+    resolution = db.Column(db.Float, primary_key=True) ## Bin height, in depth units
+    bin = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer) ## Data version of the project's MWD rows
+    rows = db.Column(db.Integer)
+    depth_top = db.Column(db.Float)
+    hardness = db.Column(db.Integer) ## Class of the mean PenetrRate (see plotting.hardness_classes)
+    PenetrRate_mean = db.Column(db.Float)
+    PenetrRate_min = db.Column(db.Float)
+    PenetrRate_max = db.Column(db.Float)
+    PercPressure_mean = db.Column(db.Float)
+    PercPressure_min = db.Column(db.Float)
+    PercPressure_max = db.Column(db.Float)
+    FeedPressure_mean = db.Column(db.Float)
+    FeedPressure_min = db.Column(db.Float)
+    FeedPressure_max = db.Column(db.Float)
+    RotPressure_mean = db.Column(db.Float)
+    RotPressure_min = db.Column(db.Float)
+    RotPressure_max = db.Column(db.Float)
+    InstPentRate_mean = db.Column(db.Float)
+    InstPentRate_min = db.Column(db.Float)
+    InstPentRate_max = db.Column(db.Float)
@@ -1,79 +1,462 @@
-from flask_restful import Resource, reqparse, Api
-from flask import jsonify, json, current_app as app
-from . import engine, db
-from .Resources.plotting import plot_rate, plot_cluster, encode_all_holes, pd, plot_all_features, hardness_bar_plot, \
-    all_features_update, highlight_location, cluster_positions
+from flask_restful import Resource, reqparse, Api, inputs
+from flask import jsonify, json, current_app as app, request, Response, stream_with_context
+from . import engine, db, pool_metrics
+from .instrumentation import metrics_text, timed
+from .Resources.plotting import plot_rate, plot_cluster, pd, hardness_rollup_plot, \
+    all_features_update, highlight_location, cluster_positions, plot_hole_features, hardness_bar_plots, \
+    hardness_map_plot, RENDER_VERSION
 import base64
-from .models import BlastReport
-from .Resources.Clustering import cluster_data, modify_data
+import numpy as np
+from .models import BlastReport, Job
+from .Resources.cluster_store import project_clusters, project_hole_clusters
+from .Resources.data_access import FEATURES, MWD_COLUMNS, load_project, load_hole, load_positions, project_stamp
+from .Resources.hole_summary import hole_summary, hole_depths
+from .Resources.depth_index import depth_index
+from .Resources.spatial_index import spatial_index
+from .Resources.reports import upsert_reports, delete_reports, query_reports
+from .Resources.downsample import METHODS, downsample_series
+from .Resources.rollups import depth_rollups, resolutions
+from .Resources.hardness_map import hardness_map
+from .Resources.hole_aggregates import hole_aggregates, feature_stats
+from .Resources.ingest import stream_samples
+from .Resources.cache import frame_cache
+from .Resources.render_cache import render_cache, artifact_key, not_modified, cache_headers
+from .Resources.render_pool import render_all, render_iter
+from .Resources.jobs import job_kind, submit_job, fail_stale_jobs
+import os
+import uuid
 
 
 api = Api(app)
 
 
+# Keys of the rendered images of a single hole, as used by the AllFeatures and HardnessBarChart endpoints
+def hole_artifact_keys(projectID, stamp, holeID):
+    keys = {feature: artifact_key('feature', projectID, stamp, holeID, feature, render=RENDER_VERSION)
+            for feature in FEATURES}
+    for color_version in range(3):
+        keys['Hardness' + str(color_version + 1)] = artifact_key('hardness', projectID, stamp, holeID,
+                                                                 color_version=color_version, render=RENDER_VERSION,
+                                                                 resolution=app.config['HARDNESS_RESOLUTION'])
+    keys['Location'] = artifact_key('location', projectID, stamp, holeID, render=RENDER_VERSION)
+    keys['meta'] = artifact_key('meta', projectID, stamp, holeID)
+    return keys
+
+
+# The depth rollup of a hole the hardness bar charts are drawn from
+def hardness_rollup(projectID, holeID):
+    return depth_rollups(projectID, app.config['HARDNESS_RESOLUTION'], [holeID])
+
+
+# Renders every image of the AllFeatures endpoint for a hole, in parallel on the render pool
+def render_hole_images(projectID, holeID):
+    data = load_hole(projectID, holeID)
+    positions = load_positions(projectID)
+
+    dicts, bar_charts, hole_locations = render_all([
+        (all_features_update, (data, holeID), {'encoded': False}),
+        (hardness_bar_plots, (hardness_rollup(projectID, holeID), holeID), {'color_versions': (0, 1, 2),
+                                                                           'encoded': False}),
+        (highlight_location, (positions, holeID), {'encoded': False})])
+    dicts['Hardness1'], dicts['Hardness2'], dicts['Hardness3'] = bar_charts
+    dicts['Location'] = hole_locations
+    dicts['meta'] = json.dumps({'depth': float(dicts['depth'])}).encode()
+    return dicts
+
+
+# Keys of the images of the AllPlots endpoint, by (holeID, feature)
+def all_holes_keys(projectID, stamp, holes):
+    keys = {}
+    for hole in holes:
+        for feature in FEATURES:
+            keys[(hole, feature)] = artifact_key('all_holes', projectID, stamp, hole, feature, render=RENDER_VERSION)
+        keys[(hole, 'meta')] = artifact_key('all_holes_meta', projectID, stamp, hole)
+    return keys
+
+
+# Render tasks of the AllPlots images of the given holes, one per hole, each given only its hole's rows
+def all_holes_tasks(projectID, holes):
+    data = load_project(projectID)
+    rows = data.groupby('holeID', observed=True).indices  # Row positions of every hole, in one pass
+    return [(plot_hole_features, (data.iloc[rows[hole]][['Depth'] + FEATURES], hole, FEATURES),
+             {'encoded': False}) for hole in holes]
+
+
+# The artifacts to cache from the plots of a hole
+def all_holes_artifacts(hole, plots):
+    artifacts = {(hole, feature): plots[feature] for feature in FEATURES}
+    artifacts[(hole, 'meta')] = json.dumps({'depth': float(plots['depth'])}).encode()
+    return artifacts
+
+
+# Renders the AllPlots images of the given holes across the render pool
+def render_all_holes(projectID, holes):
+    rendered = {}
+    for hole, plots in zip(holes, render_all(all_holes_tasks(projectID, holes))):
+        rendered.update(all_holes_artifacts(hole, plots))
+    return rendered
+
+
+def cluster_positions_key(projectID, stamp, data_type, model, k):
+    return artifact_key('cluster_positions', projectID, stamp, data_type=data_type, model=model, k=k,
+                        render=RENDER_VERSION)
+
+
+# Renders the hole positions colored by the most common cluster of each hole
+def render_cluster_positions(projectID, data_type, model, k):
+    # The dominant cluster of each hole, from the hole summaries when the clustering is up to date
+    cluster_id = project_hole_clusters(projectID, data_type=data_type, model=model, k=k)
+    # Positions and labels are matched by holeID through the spatial index, holes without a position left out
+    index = spatial_index(projectID)
+    rows = index.positions(cluster_id.index)
+    pos = index.frame(rows[rows >= 0])
+
+    return cluster_positions(pos, cluster_id.values[rows >= 0], encoded=False)
+
+
+# The holes of a spatial query as a list of dictionaries, distances rounded for the response
+def hole_locations(frame):
+    return frame.round(6).to_dict(orient='records')
+
+
+# The dominant cluster of each neighbour of a hole, summarized: the count and share of each cluster, and the
+# share of neighbours in the hole's own cluster
+def neighbourhood_clusters(projectID, holeID, neighbours, data_type, model, k):
+    cluster_id = project_hole_clusters(projectID, data_type=data_type, model=model, k=k)
+    own = cluster_id.get(holeID)
+    labels = cluster_id.reindex(neighbours.holeID.values)
+    counts = labels.dropna().astype(int).value_counts().sort_index()
+    clustered = int(counts.sum())
+    return {'holeID': holeID, 'CID': None if own is None else int(own), 'neighbours': len(neighbours),
+            'mean_distance': float(neighbours.distance.mean()) if len(neighbours) else None,
+            'clusters': {str(cid): {'count': int(count), 'share': count / clustered} for cid, count in counts.items()},
+            'same_cluster_share': None if own is None or not clustered else int(counts.get(int(own), 0)) / clustered}
+
+
+# Rows of a project frame where mask is set, projected to columns and paginated, as a dictionary by row
+# index along with the number of rows before pagination
+def page_rows(frame, mask, columns=None, offset=0, limit=None):
+    rows = np.flatnonzero(mask)
+    page = rows[offset:None if limit is None else offset + limit]
+    return frame.iloc[page][columns or list(frame.columns)].to_dict(orient='index'), len(rows)
+
+
+# The MWD rows in the same cluster as the row of a hole nearest to the given depth, by row index, and the
+# number of such rows. None if the project has no such hole
+def same_cluster_rows(projectID, holeID, depth, data_type, model, k, columns=None, offset=0, limit=None):
+    mwd_df = load_project(projectID)
+    # Labels of the project's rows, from the stored clustering when the data has not changed since
+    cluster_labels = project_clusters(projectID, data_type=data_type, model=model, k=k, frame=mwd_df).CID.values
+    row = depth_index(projectID, mwd_df).nearest([holeID], [depth])[0]
+    if row < 0:
+        return None, 0
+    cluster = cluster_labels[row]
+
+    return page_rows(mwd_df, cluster_labels == cluster, columns, offset, limit)
+
+
+# The nearest row and its cluster of each (holeID, depth) entry, and the rows of each of those clusters
+def cluster_membership(projectID, holeIDs, depths, data_type, model, k, columns=None, offset=0, limit=None,
+                       include_rows=True):
+    mwd_df = load_project(projectID)
+    cluster_labels = project_clusters(projectID, data_type=data_type, model=model, k=k, frame=mwd_df).CID.values
+    rows = depth_index(projectID, mwd_df).nearest(holeIDs, depths)
+    entries = []
+    for holeID, depth, row in zip(holeIDs, depths, rows):
+        found = row >= 0
+        entries.append({'holeID': holeID, 'depth': depth, 'row': int(row) if found else None,
+                        'Depth': float(mwd_df.Depth.values[row]) if found else None,
+                        'CID': int(cluster_labels[row]) if found else None})
+
+    clusters = {}
+    if include_rows:
+        for cluster in sorted({entry['CID'] for entry in entries if entry['CID'] is not None}):
+            page, total = page_rows(mwd_df, cluster_labels == cluster, columns, offset, limit)
+            clusters[str(cluster)] = {'total': total, 'offset': offset, 'rows': page}
+    return {'entries': entries, 'clusters': clusters}
+
+
+# Columns the same-cluster rows can be projected to, as a comma separated list
+def column_list(value):
+    columns = [name.strip() for name in value.split(',') if name.strip()] if isinstance(value, str) else list(value)
+    unknown = set(columns) - set(MWD_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(sorted(unknown))}")
+    return columns
+
+
+@timed('encode')
+def b64(png):
+    return base64.b64encode(png).decode()
+
+
+def png_response(png, etag, last_modified):
+    return Response(png, mimetype='image/png', headers=cache_headers(etag, last_modified))
+
+
+# Image responses are either base64 strings in the JSON (the default), or URLs to the raw PNGs
+format_parser = reqparse.RequestParser()
+format_parser.add_argument('format', type=str, choices=('base64', 'urls'), default='base64', location='args')
+
+
 class HolePlots(Resource):
     def get(self, feature, holeID, projectID):
-        data = pd.read_sql('MWD', engine)
-        data = data[data.projectID == projectID]
-
-        if feature not in data.columns:
+        if feature not in FEATURES:
             response = {
                 'error': 'An incorrect feature name was given'
             }
             return jsonify(response)
-        bytes_obj = plot_rate(holeID, data, feature)
-        img_base64 = base64.b64encode(bytes_obj.read())
+
+        stamp = project_stamp(projectID)
+        keys = {'image': artifact_key('rate', projectID, stamp, holeID, feature, render=RENDER_VERSION)}
+        etag, last_modified = render_cache.state(projectID, stamp, keys.values())
+        cached = not_modified(etag, last_modified)
+        if cached is not None:
+            return cached
+
+        images = render_cache.get_many(projectID, stamp, keys, lambda missing: {
+            'image': plot_rate(holeID, load_hole(projectID, holeID), feature).getvalue()})
 
         response = {
             'holeID': holeID,
             'Feature': feature,
-            "image": img_base64.decode()
+            "image": b64(images['image'])
         }
-        return jsonify(response)
+        return response, 200, cache_headers(etag, last_modified)
 
 
 class HoleIDByProject(Resource):
     def get(self, projectID):
-        data = pd.read_sql('MWD', engine)
-        data = data[data.projectID == projectID]
-
         dicts = []
-        for hole in data.holeID.unique():
+        for hole in hole_summary(projectID).holeID:
             dicts.append({'holeID': hole})
         return dicts
 
 
 class PlotAllHoles(Resource):
     def get(self, projectID):
-        data = pd.read_sql('MWD', engine)
-        data = data[data.projectID == projectID]
-        dicts = encode_all_holes(data)
+        image_format = format_parser.parse_args()['format']
+        stamp = project_stamp(projectID)
+        depths = hole_depths(projectID)
+        holes = list(depths.index)
+        keys = all_holes_keys(projectID, stamp, holes)
+        if image_format == 'urls':  # Only the depths of the hole summaries are sent, nothing is rendered
+            keys = {}
+            etag, last_modified = artifact_key('all_holes_urls', projectID, stamp), None
+        else:
+            etag, last_modified = render_cache.state(projectID, stamp, keys.values())
+        cached = not_modified(etag, last_modified)
+        if cached is not None:
+            return cached
+
+        # Renders only the holes with a missing image
+        images = render_cache.get_many(projectID, stamp, keys, lambda missing: render_all_holes(
+            projectID, sorted({name[0] for name in missing})))
+        dicts = []
+        for hole in holes:
+            temp_dict = {'holeID': hole, 'depth': float(depths[hole])}
+            for feature in FEATURES:
+                if image_format == 'urls':
+                    temp_dict[feature] = api.url_for(AllHolesImage, projectID=projectID, holeID=hole, feature=feature)
+                else:
+                    temp_dict[feature] = b64(images[(hole, feature)])
+            dicts.append(temp_dict)
+
+        return json.dumps(dicts), 200, cache_headers(etag, last_modified)
 
-        return json.dumps(dicts)
+
+# Streams the AllPlots images as a multipart/mixed response of raw PNGs, sending each hole as soon as
+# it is rendered
+class StreamAllHoles(Resource):
+    def get(self, projectID):
+        stamp = project_stamp(projectID)
+        depths = hole_depths(projectID)
+        holes = list(depths.index)
+        boundary = uuid.uuid4().hex
+
+        def hole_parts(hole, images):
+            depth = float(depths[hole])
+            for feature in FEATURES:
+                yield (f'--{boundary}\r\nContent-Type: image/png\r\n'
+                       f'Content-Disposition: inline; name="{feature}"; filename="{hole}_{feature}.png"\r\n'
+                       f'X-Hole-ID: {hole}\r\nX-Hole-Depth: {depth}\r\n\r\n').encode()
+                yield images[(hole, feature)]
+                yield b'\r\n'
+
+        def parts():
+            # Cached holes are sent straight away, the others as the render pool finishes them
+            keys = all_holes_keys(projectID, stamp, holes)
+            missing = []
+            for hole in holes:
+                images = {name: render_cache.get(projectID, stamp, key)
+                          for name, key in all_holes_keys(projectID, stamp, [hole]).items()}
+                if None in images.values():
+                    missing.append(hole)
+                else:
+                    yield from hole_parts(hole, images)
+            if missing:
+                for index, plots in render_iter(all_holes_tasks(projectID, missing)):
+                    images = all_holes_artifacts(missing[index], plots)
+                    for name, artifact in images.items():
+                        render_cache.put(projectID, stamp, keys[name], artifact)
+                    yield from hole_parts(missing[index], images)
+            yield f'--{boundary}--\r\n'.encode()
+
+        return Response(stream_with_context(parts()), content_type=f'multipart/mixed; boundary={boundary}')
+
+
+# One image of the AllPlots endpoint as image/png
+class AllHolesImage(Resource):
+    def get(self, projectID, holeID, feature):
+        if feature not in FEATURES:
+            return {'error': 'An incorrect feature name was given'}, 404
+        stamp = project_stamp(projectID)
+        keys = all_holes_keys(projectID, stamp, [holeID])
+        etag, last_modified = render_cache.state(projectID, stamp, [keys[(holeID, feature)]])
+        cached = not_modified(etag, last_modified)
+        if cached is not None:
+            return cached
+
+        images = render_cache.get_many(projectID, stamp, keys, lambda missing: render_all_holes(projectID, [holeID]))
+        return png_response(images[(holeID, feature)], etag, last_modified)
 
 
 # Plots all of the features of a specific holeID
 class PlotAllFeatures(Resource):
     def get(self, projectID, holeID):
-        data = pd.read_sql('MWD', engine)
-        data = data[data.projectID == projectID]
+        image_format = format_parser.parse_args()['format']
+        stamp = project_stamp(projectID)
+        keys = hole_artifact_keys(projectID, stamp, holeID)
+        if image_format == 'urls':  # The depth comes from the hole summary, nothing is rendered
+            keys = {}
+            etag, last_modified = artifact_key('hole_urls', projectID, stamp, holeID), None
+        else:
+            etag, last_modified = render_cache.state(projectID, stamp, keys.values())
+        cached = not_modified(etag, last_modified)
+        if cached is not None:
+            return cached
+
+        images = render_cache.get_many(projectID, stamp, keys, lambda missing: render_hole_images(projectID, holeID))
+        images.pop('meta', None)
+        dicts = {'holeID': holeID, 'depth': float(hole_depths(projectID).get(holeID, float('nan')))}
+        if image_format == 'urls':
+            for name in hole_artifact_keys(projectID, stamp, holeID):
+                if name != 'meta':
+                    dicts[name] = api.url_for(HoleImage, projectID=projectID, holeID=holeID, name=name)
+        else:
+            dicts.update({name: b64(png) for name, png in images.items()})
 
-        positions = pd.read_sql('HolePositions', engine)
-        positions = positions[positions.projectID == projectID]
+        return dicts, 200, cache_headers(etag, last_modified)
 
-        #dicts = plot_all_features(data, holeID)
-        dicts = all_features_update(data, holeID)
-        bar_chart1 = hardness_bar_plot(data, holeID, projectID, color_version=0)
-        bar_chart2 = hardness_bar_plot(data, holeID, projectID, color_version=1)
-        bar_chart3 = hardness_bar_plot(data, holeID, projectID, color_version=2)
-        hole_locations = highlight_location(positions, holeID)
 
-        dicts['Hardness1'] = bar_chart1
-        dicts['Hardness2'] = bar_chart2
-        dicts['Hardness3'] = bar_chart3
-        dicts['Location'] = hole_locations
+# Feature names of a comma separated list
+def feature_list(value):
+    features = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = set(features) - set(FEATURES)
+    if unknown:
+        raise ValueError(f"Unknown features: {', '.join(sorted(unknown))}")
+    return features
 
-        return dicts
+
+# The feature curves of a hole, downsampled to at most `points` (up to 5000) points per feature with LTTB
+# (or min/max per depth bucket), for clients that draw the plots themselves. As JSON by default, or with
+# format=float32 as little-endian float32 arrays: for each feature of the X-Series-Layout header (name:points)
+# its depths followed by its values
+class HoleSeries(Resource):
+    def __init__(self):
+        self.reqparse = reqparse.RequestParser()
+        self.reqparse.add_argument('features', type=feature_list, location='args', default=FEATURES)
+        self.reqparse.add_argument('points', type=int, location='args', default=1000)
+        self.reqparse.add_argument('method', type=str, choices=tuple(METHODS), location='args', default='lttb')
+        self.reqparse.add_argument('format', type=str, choices=('json', 'float32'), location='args', default='json')
+
+    def get(self, projectID, holeID):
+        args = self.reqparse.parse_args()
+        points = min(max(args['points'], 3), 5000)  # More points than a screen shows only cost time
+        stamp = project_stamp(projectID)
+        etag = artifact_key('series', projectID, stamp, holeID, features=tuple(args['features']), points=points,
+                            method=args['method'], format=args['format'])
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+
+        hole = load_hole(projectID, holeID)
+        if hole.empty:
+            return {'error': 'No hole with this holeID in the project'}, 404
+        series = downsample_series(hole, args['features'], points, args['method'])
+        headers = cache_headers(etag)
+        if args['format'] == 'float32':
+            body = b''.join(np.concatenate(arrays).astype('<f4').tobytes() for arrays in series.values())
+            headers['X-Series-Layout'] = ','.join(f'{feature}:{len(arrays[0])}' for feature, arrays in series.items())
+            headers['X-Hole-Rows'] = str(len(hole))
+            return Response(body, mimetype='application/octet-stream', headers=headers)
+        return {'holeID': holeID, 'rows': len(hole), 'method': args['method'],
+                'series': {feature: {'depth': np.round(depths.astype(float), 4).tolist(),
+                                     'value': np.round(values.astype(float), 4).tolist()}
+                           for feature, (depths, values) in series.items()}}, 200, headers
+
+
+# Live drilling ingest: POST the samples of a hole as NDJSON (one JSON object per line with a Depth and the
+# sensor columns), as the rig drills, e.g. with chunked transfer encoding. Samples are written in small
+# batches as they arrive, each updating the hole's running aggregates, and the answer summarizes the stream
+class HoleStream(Resource):
+    def post(self, projectID, holeID):
+        summary = stream_samples(projectID, holeID, request.stream, app.config['STREAM_BATCH_ROWS'],
+                                 app.config['STREAM_BATCH_SECONDS'], app.config['STREAM_PUBLISH_SECONDS'])
+        return summary, 400 if 'error' in summary else 200
+
+
+# Running aggregates of the holes of a project (all, or those given with holeID), and the project-wide
+# count, mean and variance of each feature combined from them
+class HoleAggregates(Resource):
+    def __init__(self):
+        self.reqparse = reqparse.RequestParser()
+        self.reqparse.add_argument('holeID', type=str, action='append', location='args')
+
+    def get(self, projectID):
+        args = self.reqparse.parse_args()
+        holes = hole_aggregates(projectID, args['holeID'])
+        stats = feature_stats(projectID)
+        return {'holes': holes.astype(object).where(holes.notna(), None).to_dict(orient='records'),
+                'features': stats.astype(object).where(stats.notna(), None).to_dict(orient='index')}
+
+
+# Depth-binned mean/min/max of every feature and the hardness class of each bin, at one of the rollup
+# resolutions, for the holes of a project (all, or those given with holeID)
+class Rollups(Resource):
+    def __init__(self):
+        self.reqparse = reqparse.RequestParser()
+        self.reqparse.add_argument('resolution', type=float, location='args', default=1.0)
+        self.reqparse.add_argument('holeID', type=str, action='append', location='args')
+
+    def get(self, projectID, holeID=None):
+        args = self.reqparse.parse_args()
+        holeIDs = [holeID] if holeID is not None else args['holeID']
+        try:
+            rollups = depth_rollups(projectID, args['resolution'], holeIDs)
+        except ValueError as error:
+            return {'error': str(error)}, 400
+        rollups = rollups.drop(columns='resolution')
+        return {'resolution': args['resolution'], 'resolutions': resolutions(),
+                'rollups': rollups.astype(object).where(rollups.notna(), None).to_dict(orient='records')}
+
+
+# One image of the AllFeatures endpoint (a feature, Hardness1-3 or Location) as image/png
+class HoleImage(Resource):
+    def get(self, projectID, holeID, name):
+        stamp = project_stamp(projectID)
+        keys = hole_artifact_keys(projectID, stamp, holeID)
+        if name not in keys or name == 'meta':
+            return {'error': 'An incorrect image name was given'}, 404
+        etag, last_modified = render_cache.state(projectID, stamp, [keys[name]])
+        cached = not_modified(etag, last_modified)
+        if cached is not None:
+            return cached
+
+        png = render_cache.get(projectID, stamp, keys[name])
+        if png is None:  # Renders (and caches) every image of the hole at once
+            png = render_cache.get_many(projectID, stamp, keys, lambda missing: render_hole_images(projectID, holeID))[name]
+        return png_response(png, etag, last_modified)
 
 
 class Report(Resource):
@@ -86,25 +469,64 @@ class Report(Resource):
 
     def get(self, projectID):
         args = self.reqparse.parse_args()
-        result = BlastReport.query.get(args['holeID'])
+        result = BlastReport.query.get((projectID, args['holeID']))
+        if result is None:
+            return {'error': 'No report for this holeID'}, 404
         return result.serialize()
 
     def post(self, projectID):
         args = self.reqparse.parse_args()
-        blast_report = BlastReport(holeID=args['holeID'], depth=args['depth'],
-                                   report=args['report'], score=args['score'])
-        db.session.add(blast_report)
-        db.session.commit()
-        return blast_report.serialize()
+        upsert_reports(projectID, [args])
+        return BlastReport.query.get((projectID, args['holeID'])).serialize()
 
     def delete(self, projectID):
         args = self.reqparse.parse_args()
-        result = BlastReport.query.get(args['holeID'])
+        result = BlastReport.query.get((projectID, args['holeID']))
+        if result is None:
+            return {'error': 'No report for this holeID'}, 404
         db.session.delete(result)
         db.session.commit()
         return result.serialize()
 
 
+# Reports of a project in bulk. GET lists them, filtered by holeID (repeatable), score and depth ranges
+# and paginated; POST upserts a JSON list of reports (or {'reports': [...]}) in one transaction; DELETE
+# removes the reports of a JSON list of holeIDs (or {'holeIDs': [...]})
+class Reports(Resource):
+    def __init__(self):
+        self.reqparse = reqparse.RequestParser()
+        self.reqparse.add_argument('holeID', type=str, action='append', location='args')
+        self.reqparse.add_argument('min_score', type=int, location='args')
+        self.reqparse.add_argument('max_score', type=int, location='args')
+        self.reqparse.add_argument('min_depth', type=float, location='args')
+        self.reqparse.add_argument('max_depth', type=float, location='args')
+        self.reqparse.add_argument('offset', type=int, location='args', default=0)
+        self.reqparse.add_argument('limit', type=int, location='args', default=1000)
+
+    def get(self, projectID):
+        args = self.reqparse.parse_args()
+        return query_reports(projectID, args['holeID'], args['min_score'], args['max_score'], args['min_depth'],
+                             args['max_depth'], args['offset'], args['limit'] or None)
+
+    def post(self, projectID):
+        body = request.get_json(force=True, silent=True)
+        reports = body.get('reports') if isinstance(body, dict) else body
+        if not isinstance(reports, list):
+            return {'error': 'Expected a list of reports'}, 400
+        try:
+            written = upsert_reports(projectID, reports)
+        except ValueError as error:
+            return {'error': str(error)}, 400
+        return {'projectID': projectID, 'written': written}
+
+    def delete(self, projectID):
+        body = request.get_json(force=True, silent=True)
+        holeIDs = body.get('holeIDs') if isinstance(body, dict) else body
+        if not isinstance(holeIDs, list):
+            return {'error': 'Expected a list of holeIDs'}, 400
+        return {'projectID': projectID, 'deleted': delete_reports(projectID, holeIDs)}
+
+
 class Clustering(Resource):
     def __init__(self):
         self.reqparse = reqparse.RequestParser()
@@ -116,95 +538,383 @@ class Clustering(Resource):
     def get(self, projectID):
         args = self.reqparse.parse_args()
 
-        mwd_data = pd.read_sql('MWD', engine)
-        mwd_data = mwd_data[mwd_data.projectID == projectID]
+        mwd_data = load_project(projectID)
 
-        data = modify_data(mwd_data.iloc[:, 1:6], data_type = args['data_type'])
-        cluster_labels = cluster_data(data, model = args['model'], k = args['k'])
+        clusters = project_clusters(projectID, data_type = args['data_type'], model = args['model'],
+                                    k = args['k'], frame = mwd_data)
+        cluster_labels = clusters.CID.values
         if args['data_type'] == 'weighted':
-            data2D = pd.read_sql('KMeans_WMDS', engine)
-            b64_string = plot_cluster(data2D, projectID, cluster_labels, args['model'], args['data_type'])
-        elif args['data_type'] == 'unweighted':
-            data2D = modify_data(mwd_data.iloc[:, 1:6], data_type = 'PCA')
-            data2D['Depth'] = mwd_data.Depth
+            data2D = pd.read_sql('KMeans_WMDS', engine.resolve())
             b64_string = plot_cluster(data2D, projectID, cluster_labels, args['model'], args['data_type'])
         else:
-            data['Depth'] = mwd_data.Depth
-            b64_string = plot_cluster(data, projectID, cluster_labels, args['model'], args['data_type'])
+            # The stored 2D coordinates are the first two Principal Components
+            data2D = pd.DataFrame({'PC1': clusters.x, 'PC2': clusters.y, 'Depth': mwd_data.Depth})
+            b64_string = plot_cluster(data2D, projectID, cluster_labels, args['model'], args['data_type'])
 
         response = {'cluster': b64_string}
         return response
 
 
 # Used to get entries in the same cluster as the blast
+def cluster_by_entry_parser():
+    parser = reqparse.RequestParser()
+    parser.add_argument('depth', type=float, required=True)
+    parser.add_argument('holeID', type=str, required=True)
+    parser.add_argument('data_type', type=str, required=False, default='PCA')
+    parser.add_argument('k', type=int, required=False, default=4)
+    parser.add_argument('model', type=str, required=False, default='agglom')
+    # Optional projection and pagination of the rows returned
+    parser.add_argument('columns', type=column_list, required=False)
+    parser.add_argument('offset', type=int, required=False, default=0)
+    parser.add_argument('limit', type=int, required=False)
+    return parser
+
+
 class ClusterByBlastEntry(Resource):
     def __init__(self):
-        self.reqparse = reqparse.RequestParser()
-        self.reqparse.add_argument('depth', type=float, required=True)
-        self.reqparse.add_argument('holeID', type=str, required=True)
-        self.reqparse.add_argument('data_type', type=str, required=False, default='PCA')
-        self.reqparse.add_argument('k', type=int, required=False, default=4)
-        self.reqparse.add_argument('model', type=str, required=False, default='agglom')
+        self.reqparse = cluster_by_entry_parser()
 
     def get(self, projectID):
-        mwd_df = pd.read_sql('MWD', engine)
-        mwd_df = mwd_df[mwd_df.projectID == projectID]
         args = self.reqparse.parse_args()  # Request arguments
-        # If we are doing weighted clustering, multiply the weights to the designated columns. Also
-        # Normalize the data via StandardScalar()
+        result, total = same_cluster_rows(projectID, args['holeID'], args['depth'], args['data_type'], args['model'],
+                                          args['k'], args['columns'], args['offset'], args['limit'])
+        if result is None:
+            return {'error': 'No hole with this holeID in the project'}, 404
+        return result, 200, {'X-Total-Count': str(total)}
 
-        data = modify_data(mwd_df.iloc[:, 1:6], args['data_type'])
 
-        cluster_labels = cluster_data(data, model=args['model'], k=args['k'])
-        specific_hole = mwd_df[mwd_df.holeID == args['holeID']]
-        idx_depth = specific_hole.Depth.sub(args['depth']).abs().idxmin()
-        cluster = cluster_labels[idx_depth]
-
-        same_cluster = mwd_df[cluster_labels == cluster]
+# Cluster membership of many blast entries at once. POST a JSON body with 'entries', a list of
+# {'holeID', 'depth'}, and optionally the clustering parameters, 'columns', 'offset' and 'limit' of the
+# same-cluster rows returned per cluster, or 'rows': false to return only the entries' clusters
+class ClusterByBlastEntries(Resource):
+    def __init__(self):
+        self.reqparse = reqparse.RequestParser()
+        self.reqparse.add_argument('entries', type=list, location='json', required=True)
+        self.reqparse.add_argument('data_type', type=str, location='json', default='PCA')
+        self.reqparse.add_argument('k', type=int, location='json', default=4)
+        self.reqparse.add_argument('model', type=str, location='json', default='agglom')
+        self.reqparse.add_argument('columns', type=column_list, location='json', default=['holeID', 'Depth'])
+        self.reqparse.add_argument('offset', type=int, location='json', default=0)
+        self.reqparse.add_argument('limit', type=int, location='json', default=100)
+        self.reqparse.add_argument('rows', type=bool, location='json', default=True)
 
-        #result = same_cluster.to_json(orient='index')
-        result = same_cluster.to_dict(orient = 'index')
-        return result
+    def post(self, projectID):
+        args = self.reqparse.parse_args()
+        try:
+            holeIDs = [str(entry['holeID']) for entry in args['entries']]
+            depths = [float(entry['depth']) for entry in args['entries']]
+        except (KeyError, TypeError, ValueError):
+            return {'error': 'Every entry needs a holeID and a numeric depth'}, 400
+        return cluster_membership(projectID, holeIDs, depths, args['data_type'], args['model'], args['k'],
+                                  args['columns'], args['offset'], args['limit'] or None, args['rows'])
 
 
 class HardnessBar(Resource):
     def get(self, projectID, holeID):
-        df = pd.read_sql('MWD', engine)
-        df = df[df.projectID == projectID]
-        b64_string = hardness_bar_plot(df, holeID, projectID)
+        stamp = project_stamp(projectID)
+        keys = {'image': hole_artifact_keys(projectID, stamp, holeID)['Hardness1']}
+        etag, last_modified = render_cache.state(projectID, stamp, keys.values())
+        cached = not_modified(etag, last_modified)
+        if cached is not None:
+            return cached
 
-        response = {'image': b64_string}
-        return response
+        images = render_cache.get_many(projectID, stamp, keys, lambda missing: {
+            'image': hardness_rollup_plot(hardness_rollup(projectID, holeID), holeID, encoded=False)})
+
+        response = {'image': b64(images['image'])}
+        return response, 200, cache_headers(etag, last_modified)
+
+
+# Percentiles of the hardness map, as a comma separated list of integers from 0 to 100
+# Sorted and without repeats, so equal requests share their cached map and quantile columns stay unique
+def percentile_list(value):
+    parts = value.split(',') if isinstance(value, str) else value
+    percentiles = tuple(sorted({int(part) for part in parts if str(part).strip()}))
+    if not percentiles or any(percentile < 0 or percentile > 100 for percentile in percentiles):
+        raise ValueError('Percentiles must be integers from 0 to 100')
+    return percentiles
+
+
+def hardness_map_image_key(projectID, stamp, color_version):
+    return artifact_key('hardness_map', projectID, stamp, color_version=color_version, render=RENDER_VERSION,
+                        resolution=app.config['HARDNESS_RESOLUTION'])
+
+
+# Hardness across a whole blast pattern in one request: for every hole of the project, its position, depth
+# range, share of each hardness class and dominant class (from the depth rollups), and feature percentiles.
+# The table is returned as column names and rows of values; with image=true the plan view of the holes
+# colored by hardness is included as base64
+class HardnessMap(Resource):
+    def __init__(self):
+        self.reqparse = reqparse.RequestParser()
+        self.reqparse.add_argument('percentiles', type=percentile_list, location='args', default=(10, 50, 90))
+        self.reqparse.add_argument('color_version', type=int, choices=(0, 1, 2), location='args', default=0)
+        self.reqparse.add_argument('image', type=inputs.boolean, location='args', default=False)
+
+    def get(self, projectID):
+        args = self.reqparse.parse_args()
+        stamp = project_stamp(projectID)
+        image_keys = {'image': hardness_map_image_key(projectID, stamp, args['color_version'])}
+        etag = artifact_key('hardness_map_table', projectID, stamp, percentiles=args['percentiles'],
+                            resolution=app.config['HARDNESS_RESOLUTION'],
+                            image=image_keys['image'] if args['image'] else None)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+
+        table = hardness_map(projectID, args['percentiles'])
+        response = {'projectID': projectID, 'resolution': app.config['HARDNESS_RESOLUTION'],
+                    'columns': list(table.columns),
+                    'rows': table.astype(object).where(table.notna(), None).values.tolist()}
+        if args['image']:
+            images = render_cache.get_many(projectID, stamp, image_keys, lambda missing: {
+                'image': hardness_map_plot(table, projectID, args['color_version'], encoded=False)})
+            response['image'] = b64(images['image'])
+        return response, 200, cache_headers(etag)
+
+
+# The plan view of the hardness map as image/png
+class HardnessMapImage(Resource):
+    def __init__(self):
+        self.reqparse = reqparse.RequestParser()
+        self.reqparse.add_argument('color_version', type=int, choices=(0, 1, 2), location='args', default=0)
+
+    def get(self, projectID):
+        args = self.reqparse.parse_args()
+        stamp = project_stamp(projectID)
+        keys = {'image': hardness_map_image_key(projectID, stamp, args['color_version'])}
+        etag, last_modified = render_cache.state(projectID, stamp, keys.values())
+        cached = not_modified(etag, last_modified)
+        if cached is not None:
+            return cached
+
+        images = render_cache.get_many(projectID, stamp, keys, lambda missing: {
+            'image': hardness_map_plot(hardness_map(projectID), projectID, args['color_version'], encoded=False)})
+        return png_response(images['image'], etag, last_modified)
+
+
+# Sizes and hit rates of this worker's project cache
+class CacheStats(Resource):
+    def get(self):
+        stats = frame_cache.stats()
+        stats['pid'] = os.getpid()
+        return stats
+
+
+# Request and stage latency histograms of this worker, with its cache and pool state, in the Prometheus
+# text format. Each worker keeps its own counts, so scrape every worker (or sum them) for the whole server
+class Metrics(Resource):
+    def get(self):
+        cache = frame_cache.stats()
+        pool = pool_metrics.stats(engine)
+        samples = [('mwd_frame_cache_bytes', 'gauge', 'Bytes held by the project cache', cache['bytes']),
+                   ('mwd_frame_cache_hits_total', 'counter', 'Project cache hits', cache['hits']),
+                   ('mwd_frame_cache_misses_total', 'counter', 'Project cache misses', cache['misses']),
+                   ('mwd_db_pool_checkouts_total', 'counter', 'Connections checked out of the pool',
+                    pool['checkouts']),
+                   ('mwd_db_pool_checked_out', 'gauge', 'Connections currently checked out',
+                    pool.get('checkedout', 0))]
+        return Response(metrics_text(samples), mimetype='text/plain; version=0.0.4')
+
+
+# Connection pool state and checkout counts of this worker
+class PoolStats(Resource):
+    def get(self):
+        return pool_metrics.stats(engine)
+
+
+def cluster_positions_parser():
+    parser = reqparse.RequestParser()
+    parser.add_argument('data_type', type=str, required=False, default='PCA')
+    parser.add_argument('k', type=int, required=False, default=4)
+    parser.add_argument('model', type=str, required=False, default='kmeans')
+    return parser
 
 
 class clusterPositions(Resource):
+    def __init__(self):
+        self.reqparse = cluster_positions_parser()
+
+    def get(self, projectID):
+        image, etag, last_modified = self.image(projectID)
+        if etag is None:  # Not modified
+            return image
+        return {'cluster_positions': b64(image)}, 200, cache_headers(etag, last_modified)
+
+    # Returns the png of the clustered hole positions with its ETag and Last-Modified time, or a 304
+    # response and no ETag if the client's copy is current
+    def image(self, projectID):
+        args = self.reqparse.parse_args()
+        stamp = project_stamp(projectID)
+        keys = {'image': cluster_positions_key(projectID, stamp, args['data_type'], args['model'], args['k'])}
+        etag, last_modified = render_cache.state(projectID, stamp, keys.values())
+        cached = not_modified(etag, last_modified)
+        if cached is not None:
+            return cached, None, None
+
+        images = render_cache.get_many(projectID, stamp, keys, lambda missing: {
+            'image': render_cluster_positions(projectID, args['data_type'], args['model'], args['k'])})
+        return images['image'], etag, last_modified
+
+
+# The clustered hole positions as image/png
+class clusterPositionsImage(clusterPositions):
+    def get(self, projectID):
+        image, etag, last_modified = self.image(projectID)
+        if etag is None:
+            return image
+        return png_response(image, etag, last_modified)
+
+
+# The k holes nearest to a hole, nearest first, with their positions and distances
+class HoleNeighbours(Resource):
     def __init__(self):
         self.reqparse = reqparse.RequestParser()
-        self.reqparse.add_argument('data_type', type=str, required=False, default='PCA')
-        self.reqparse.add_argument('k', type=int, required=False, default=4)
-        self.reqparse.add_argument('model', type=str, required=False, default='kmeans')
+        self.reqparse.add_argument('k', type=int, location='args', default=5)
+
+    def get(self, projectID, holeID):
+        args = self.reqparse.parse_args()
+        index = spatial_index(projectID)
+        x, y = index.coordinates([holeID])[0]
+        if np.isnan(x):
+            return {'error': 'No position for this holeID in the project'}, 404
+        neighbours = index.nearest(x, y, k=max(args['k'], 1), exclude=holeID)
+        return {'holeID': holeID, 'start_x': x, 'start_y': y, 'neighbours': hole_locations(neighbours)}
+
+
+# Holes near a point: within radius of (x, y) if radius is given, otherwise the k nearest, nearest first
+class HolesNear(Resource):
+    def __init__(self):
+        self.reqparse = reqparse.RequestParser()
+        self.reqparse.add_argument('x', type=float, location='args', required=True)
+        self.reqparse.add_argument('y', type=float, location='args', required=True)
+        self.reqparse.add_argument('radius', type=float, location='args')
+        self.reqparse.add_argument('k', type=int, location='args', default=5)
+
+    def get(self, projectID):
+        args = self.reqparse.parse_args()
+        index = spatial_index(projectID)
+        if args['radius'] is not None:
+            holes = index.within_radius(args['x'], args['y'], args['radius'])
+        else:
+            holes = index.nearest(args['x'], args['y'], k=max(args['k'], 1))
+        return {'holes': hole_locations(holes)}
+
+
+# Holes inside a bounding box, in holeID order
+class HolesWithin(Resource):
+    def __init__(self):
+        self.reqparse = reqparse.RequestParser()
+        for name in ('min_x', 'min_y', 'max_x', 'max_y'):
+            self.reqparse.add_argument(name, type=float, location='args', required=True)
 
     def get(self, projectID):
         args = self.reqparse.parse_args()
-        # Gets the position data
-        pos = pd.read_sql('HolePositions', engine)
-        pos = pos[pos.projectID == projectID]
-        # Gets the actual MWD data
-        df = pd.read_sql('MWD', engine)
-        df = df[df.projectID == projectID]
-        # Clusters the data and gets the labels
-        data = modify_data(df.iloc[:, 1:6], args['data_type'])
-        cluster_labels = cluster_data(data, model=args['model'], k=args['k'])
-        df['CID'] = cluster_labels
+        holes = spatial_index(projectID).within_box(args['min_x'], args['min_y'], args['max_x'], args['max_y'])
+        return {'holes': hole_locations(holes)}
+
 
-        cluster_id = {}
-        for hole in df.holeID.unique():
-            h = df[df.holeID == hole]
-            cluster_id[hole] = h.CID.value_counts().index[0]
+# Cluster statistics of the neighbourhood of a hole: its neighbours within radius if given, otherwise its
+# `neighbours` nearest holes, and how their dominant clusters compare with the hole's own
+class NeighbourhoodClusters(Resource):
+    def __init__(self):
+        self.reqparse = reqparse.RequestParser()
+        self.reqparse.add_argument('radius', type=float, location='args')
+        self.reqparse.add_argument('neighbours', type=int, location='args', default=8)
+        self.reqparse.add_argument('data_type', type=str, location='args', default='PCA')
+        self.reqparse.add_argument('k', type=int, location='args', default=4)
+        self.reqparse.add_argument('model', type=str, location='args', default='kmeans')
+
+    def get(self, projectID, holeID):
+        args = self.reqparse.parse_args()
+        index = spatial_index(projectID)
+        x, y = index.coordinates([holeID])[0]
+        if np.isnan(x):
+            return {'error': 'No position for this holeID in the project'}, 404
+        if args['radius'] is not None:
+            neighbours = index.within_radius(x, y, args['radius'])
+            neighbours = neighbours[neighbours.holeID != holeID]
+        else:
+            neighbours = index.nearest(x, y, k=max(args['neighbours'], 1), exclude=holeID)
+        stats = neighbourhood_clusters(projectID, holeID, neighbours, args['data_type'], args['model'], args['k'])
+        stats['holes'] = hole_locations(neighbours)
+        return stats
+
+
+# Background jobs of the heavy endpoints. Each renders into (or computes) the same results as the synchronous
+# endpoint, so once a job is done the synchronous endpoint answers from the caches
+@job_kind('cluster')
+def cluster_job(projectID, params, progress):
+    stamp = project_stamp(projectID)
+    keys = {'image': cluster_positions_key(projectID, stamp, params['data_type'], params['model'], params['k'])}
+    render_cache.get_many(projectID, stamp, keys, lambda missing: {
+        'image': render_cluster_positions(projectID, params['data_type'], params['model'], params['k'])})
+    return {'url': params['url']}
+
+
+@job_kind('cluster_by_entry')
+def cluster_by_entry_job(projectID, params, progress):
+    result, total = same_cluster_rows(projectID, params['holeID'], params['depth'], params['data_type'],
+                                      params['model'], params['k'], params.get('columns'), params.get('offset', 0),
+                                      params.get('limit'))
+    if result is None:
+        raise LookupError(f"No hole {params['holeID']} in project {projectID}")
+    return {'total': total, 'rows': result}
+
+
+@job_kind('all_plots')
+def all_plots_job(projectID, params, progress):
+    stamp = project_stamp(projectID)
+    holes = list(hole_summary(projectID).holeID)
+    keys = all_holes_keys(projectID, stamp, holes)
+    missing = [hole for hole in holes if render_cache.get(projectID, stamp, keys[(hole, 'meta')]) is None]
+    for done, (index, plots) in enumerate(render_iter(all_holes_tasks(projectID, missing)), 1):
+        for name, artifact in all_holes_artifacts(missing[index], plots).items():
+            render_cache.put(projectID, stamp, keys[name], artifact)
+        progress(done / len(missing))
+    return {'url': params['url']}
+
+
+def job_response(job, created):
+    return job.serialize(), 202 if created or job.status in ('queued', 'running') else 200, \
+        {'Location': api.url_for(JobStatus, job_id=job.id)}
+
+
+# POST starts clustering the project in the background, the image is then served by the Cluster endpoints
+class ClusterJob(Resource):
+    def __init__(self):
+        self.reqparse = cluster_positions_parser()  # Same arguments as the synchronous endpoint
+
+    def post(self, projectID):
+        args = self.reqparse.parse_args()
+        args['url'] = api.url_for(clusterPositionsImage, projectID=projectID, **args)
+        return job_response(*submit_job('cluster', projectID, args, project_stamp(projectID)))
+
+
+class ClusterByEntryJob(Resource):
+    def __init__(self):
+        self.reqparse = cluster_by_entry_parser()
+
+    def post(self, projectID):
+        args = self.reqparse.parse_args()
+        return job_response(*submit_job('cluster_by_entry', projectID, args, project_stamp(projectID)))
+
+
+# POST starts rendering the images of every hole in the background, which AllPlots then serves from the cache
+class AllPlotsJob(Resource):
+    def post(self, projectID):
+        params = {'url': api.url_for(PlotAllHoles, projectID=projectID)}
+        return job_response(*submit_job('all_plots', projectID, params, project_stamp(projectID)))
 
-        loc_string = cluster_positions(pos, list(cluster_id.values()))
-        return {'cluster_positions': loc_string}
 
+# Status, progress and (once done) result of a job
+class JobStatus(Resource):
+    def get(self, job_id):
+        fail_stale_jobs(Job.id == job_id)
+        job = Job.query.get(job_id)
+        if job is None:
+            return {'error': 'No job with this id'}, 404
+        return job.serialize()
 
 
 # Endpoints
@@ -213,9 +923,32 @@ api.add_resource(HolePlots, '/Plots/<string:holeID>/<string:feature>')
 api.add_resource(HoleIDByProject, '/<string:projectID>/GetHoleIDs')
 api.add_resource(PlotAllFeatures, '/<string:projectID>/<string:holeID>/AllFeatures')
 api.add_resource(PlotAllHoles, '/<string:projectID>/AllPlots')
+api.add_resource(StreamAllHoles, '/<string:projectID>/AllPlots/stream')
+api.add_resource(AllHolesImage, '/<string:projectID>/<string:holeID>/AllPlots/<string:feature>.png')
+api.add_resource(HoleStream, '/<string:projectID>/<string:holeID>/stream')
+api.add_resource(HoleAggregates, '/<string:projectID>/Aggregates')
+api.add_resource(Rollups, '/<string:projectID>/Rollups', '/<string:projectID>/<string:holeID>/Rollups')
+api.add_resource(HoleImage, '/<string:projectID>/<string:holeID>/images/<string:name>.png')
+api.add_resource(HoleSeries, '/<string:projectID>/<string:holeID>/series')
 api.add_resource(Report, '/<string:projectID>/BlastReport')
+api.add_resource(Reports, '/<string:projectID>/BlastReports')
 # api.add_resource(Report, '/<string:projectID>/<string:holeID>/BlastReport')
 #api.add_resource(Clustering, '/<string:projectID>/Cluster')
 api.add_resource(ClusterByBlastEntry, '/<string:projectID>/ClusterByEntry')
+api.add_resource(ClusterByBlastEntries, '/<string:projectID>/ClusterByEntry/batch')
 api.add_resource(HardnessBar, '/<string:projectID>/<string:holeID>/HardnessBarChart')
+api.add_resource(HardnessMap, '/<string:projectID>/HardnessMap')
+api.add_resource(HardnessMapImage, '/<string:projectID>/HardnessMap.png')
 api.add_resource(clusterPositions, '/<string:projectID>/Cluster')
+api.add_resource(clusterPositionsImage, '/<string:projectID>/Cluster.png')
+api.add_resource(HoleNeighbours, '/<string:projectID>/<string:holeID>/Neighbours')
+api.add_resource(NeighbourhoodClusters, '/<string:projectID>/<string:holeID>/NeighbourhoodClusters')
+api.add_resource(HolesNear, '/<string:projectID>/Holes/near')
+api.add_resource(HolesWithin, '/<string:projectID>/Holes/within')
+api.add_resource(CacheStats, '/CacheStats')
+api.add_resource(PoolStats, '/PoolStats')
+api.add_resource(Metrics, '/metrics')
+api.add_resource(ClusterJob, '/<string:projectID>/Cluster/jobs')
+api.add_resource(ClusterByEntryJob, '/<string:projectID>/ClusterByEntry/jobs')
+api.add_resource(AllPlotsJob, '/<string:projectID>/AllPlots/jobs')
+api.add_resource(JobStatus, '/jobs/<string:job_id>')
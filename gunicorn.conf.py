@@ -0,0 +1,30 @@
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# Loads the app once in the master, so workers fork from it and share its imported modules copy-on-write
+preload_app = os.environ.get('GUNICORN_PRELOAD', '0') == '1'
+
+
+# With preload, the heavy analytical modules the app imports lazily are imported in the master as well,
+# so every worker shares them instead of importing them on its first clustering or plot
+def when_ready(server):
+    if preload_app:
+        import matplotlib.figure
+        import matplotlib.backends.backend_agg
+        import sklearn.cluster
+        import sklearn.decomposition
+        import sklearn.preprocessing
+
+
+# Connections opened by the master (e.g. while a preloaded app starts) are closed before the workers are
+# forked, so no worker inherits a socket it would share with the master or its siblings
+def pre_fork(server, worker):
+    from app import engine
+    engine.dispose()
+
+
+# Each worker starts with an empty pool of its own
+def post_fork(server, worker):
+    from app import engine
+    engine.after_fork()
@@ -0,0 +1,42 @@
+import os
+import tempfile
+# The configuration is read when app is imported. Every test then gets a SQLite database of its own
+os.environ.setdefault('DATABASE_LINK', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'mwd.db'))
+
+import numpy as np
+import pandas as pd
+import pytest
+from app import create_app, engine, init_db
+from app.Resources.cache import frame_cache
+from app.Resources.cluster_store import cluster_cache
+from app.Resources.data_access import FEATURES
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app('base')
+    app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'mwd.db'}",
+                      RENDER_CACHE_DIR=str(tmp_path / 'renders'), MODEL_DIR=str(tmp_path / 'models'),
+                      COLUMN_STORE_DIR=None, SHARED_MEMORY_FRAMES=False, RENDER_WORKERS=0)
+    engine.configure(app.config)
+    frame_cache.invalidate()
+    cluster_cache.invalidate()
+    with app.app_context():
+        init_db()
+        yield app
+    engine.dispose()
+
+
+@pytest.fixture
+def mwd_rows():
+    # MWD rows of a project as exported: per_hole rows 0.1 m apart in each hole, numbered from start
+    def rows(projectID, holes, per_hole, seed=0, start=0):
+        rng = np.random.default_rng(seed)
+        count = len(holes) * per_hole
+        frame = pd.DataFrame({feature: rng.normal(2, .5, count) for feature in FEATURES})
+        frame.insert(0, 'index', np.arange(start, start + count))
+        frame.insert(1, 'projectID', projectID)
+        frame['holeID'] = np.repeat([str(hole) for hole in holes], per_hole)
+        frame['Depth'] = np.tile(np.round(np.arange(per_hole) * .1, 1), len(holes))
+        return frame
+    return rows
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+from app.Resources.cluster_store import extend_clusters, fit_clusters
+from app.Resources.data_access import FEATURES
+
+
+@pytest.fixture
+def fitted(mwd_rows):
+    frame = mwd_rows('P1', ['1', '2', '3', '4'], 50)
+    result, state = fit_clusters(frame, 'PCA', 'kmeans', k=3)
+    return frame, result, state
+
+
+def _new_hole(frame, holeID, rows, shift=0.):
+    # Rows of a newly drilled hole, with the sensor values of the first rows of the project
+    hole = frame.iloc[:rows].copy()
+    hole['holeID'] = holeID
+    hole[FEATURES] += shift
+    return pd.concat([frame, hole], ignore_index=True)
+
+
+def test_new_rows_are_labelled_without_refitting(fitted):
+    frame, result, state = fitted
+    extended = extend_clusters(_new_hole(frame, '5', 40), result, state)
+
+    assert extended is not None and len(extended) == 240
+    old = extended.iloc[:200]
+    assert (old.CID.values == result.CID.values).all()
+    assert np.allclose(old[['x', 'y']].values, result[['x', 'y']].values)
+    # The copied rows get the clusters of the rows they copy (up to the few rows near two prototypes)
+    assert (extended.CID.values[200:] == result.CID.values[:40]).mean() > .9
+
+
+def test_unchanged_rows_keep_the_result(fitted):
+    frame, result, state = fitted
+    extended = extend_clusters(frame, result, state)
+    assert (extended.CID.values == result.CID.values).all()
+
+
+@pytest.mark.parametrize('change', ['removed', 'moved', 'too_many', 'drifted', 'missing'])
+def test_refit_is_required(fitted, change):
+    frame, result, state = fitted
+    if change == 'removed':
+        frame = frame.iloc[10:]
+    elif change == 'moved':
+        frame = frame.assign(Depth=frame.Depth + .05)
+    elif change == 'too_many':
+        frame = _new_hole(frame, '5', 60)
+    elif change == 'drifted':
+        frame = _new_hole(frame, '5', 20, shift=5.)
+    else:
+        frame = _new_hole(frame, '5', 20)
+        frame.loc[210, 'RotPressure'] = np.nan
+    assert extend_clusters(frame, result, state) is None
+
+
+def test_refit_thresholds_are_configurable(fitted):
+    frame, result, state = fitted
+    frame = _new_hole(frame, '5', 60)
+    assert extend_clusters(frame, result, state, max_new_fraction=.5) is not None
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import pytest
+from app.Resources.data_access import FEATURES
+from app.Resources.hole_aggregates import batch_aggregates, merge_aggregates
+
+
+def _rows(holes, count, seed, missing=()):
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({feature: rng.normal(2, 1, count) for feature in FEATURES})
+    frame['holeID'] = rng.choice(holes, count)
+    frame['Depth'] = rng.uniform(0, 20, count)
+    frame.loc[rng.random(count) < .1, FEATURES[1]] = np.nan
+    for feature in missing:
+        frame[feature] = None  # As built from samples that never hold the feature
+    return frame
+
+
+def _sorted(aggregates):
+    return aggregates.sort_values('holeID').reset_index(drop=True)[sorted(aggregates.columns)]
+
+
+@pytest.mark.parametrize('missing', [(), ('RotPressure',), tuple(FEATURES)])
+def test_merge_matches_full_recompute(missing):
+    first = _rows(['1', '2', '3'], 400, 0)
+    second = _rows(['2', '3', '4'], 150, 1, missing)
+    merged = merge_aggregates(batch_aggregates(first), batch_aggregates(second))
+    full = batch_aggregates(pd.concat([first, second], ignore_index=True))
+    pd.testing.assert_frame_equal(_sorted(merged), _sorted(full), check_dtype=False, rtol=1e-9)
+
+
+def test_batch_with_missing_feature_counts_no_values():
+    aggregates = batch_aggregates(_rows(['1'], 20, 2, ('RotPressure',)))
+    assert aggregates.RotPressure_n.tolist() == [0]
+    assert aggregates.RotPressure_mean.isna().all()
+    assert aggregates.RotPressure_m2.tolist() == [0]
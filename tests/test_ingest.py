@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+from app import engine
+from app.Resources.data_access import FEATURES, data_version
+from app.Resources.hole_summary import hole_summary
+from app.Resources.ingest import IngestError, ingest
+
+
+def _project(projectID):
+    return pd.read_sql(f"SELECT * FROM \"MWD\" WHERE \"projectID\" = '{projectID}' ORDER BY \"index\"",
+                       engine.resolve())
+
+
+def test_replace_swaps_only_the_exported_projects(app, mwd_rows):
+    ingest(pd.concat([mwd_rows('P1', ['1', '2'], 20), mwd_rows('P2', ['7'], 10)]), 'MWD', mode='replace')
+    replaced = mwd_rows('P1', ['3'], 5, seed=1)
+    summary = ingest(replaced, 'MWD', mode='replace', chunksize=2)
+
+    assert summary['rows'] == 5 and summary['chunks'] == 3 and summary['projectIDs'] == ['P1']
+    assert _project('P1').holeID.tolist() == ['3'] * 5
+    assert np.allclose(_project('P1').PenetrRate, replaced.PenetrRate)
+    assert len(_project('P2')) == 10
+    assert data_version('MWD', 'P1') == 2 and data_version('MWD', 'P2') == 1
+    assert hole_summary('P1').holeID.tolist() == ['3']  # The post-ingest hooks ran
+
+
+def test_append_adds_rows(app, mwd_rows):
+    ingest(mwd_rows('P1', ['1'], 10), 'MWD', mode='replace')
+    ingest(mwd_rows('P1', ['2'], 10, seed=1, start=10), 'MWD', mode='append')
+
+    assert len(_project('P1')) == 20
+    assert hole_summary('P1').row_count.tolist() == [10, 10]
+
+
+def test_upsert_replaces_rows_with_the_same_keys(app, mwd_rows):
+    ingest(mwd_rows('P1', ['1'], 10), 'MWD', mode='replace')
+    update = mwd_rows('P1', ['1'], 10, seed=1).iloc[:4]
+    update = pd.concat([update, mwd_rows('P1', ['2'], 3, seed=2, start=10)])
+    ingest(update, 'MWD', mode='upsert')
+
+    stored = _project('P1')
+    assert len(stored) == 13
+    first = stored[(stored.holeID == '1') & (stored.Depth < .35)].sort_values('Depth')
+    assert np.allclose(first[FEATURES].values, update.iloc[:4][FEATURES].values)
+
+
+def test_failed_validation_writes_nothing(app, mwd_rows, monkeypatch):
+    ingest(mwd_rows('P1', ['1'], 10), 'MWD', mode='replace')
+    import app.Resources.ingest as ingest_module
+
+    def mismatch(*args):
+        raise IngestError('Checksums differ')
+    monkeypatch.setattr(ingest_module, '_validate', mismatch)
+    with pytest.raises(IngestError):
+        ingest(mwd_rows('P1', ['9'], 4, seed=3), 'MWD', mode='replace')
+    assert _project('P1').holeID.tolist() == ['1'] * 10
+    assert data_version('MWD', 'P1') == 1
+
+
+def test_unknown_mode_is_refused(app, mwd_rows):
+    with pytest.raises(ValueError):
+        ingest(mwd_rows('P1', ['1'], 2), 'MWD', mode='merge')
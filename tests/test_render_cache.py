@@ -0,0 +1,70 @@
+import os
+import pytest
+from app.Resources.data_access import project_stamp
+from app.Resources.ingest import ingest
+from app.Resources.render_cache import RenderCache, artifact_key
+
+
+@pytest.fixture
+def cache(app):
+    cache = RenderCache()
+    cache.SWEEP_INTERVAL = cache.SWEEP_GRACE = 0
+    return cache
+
+
+def _versions(app, projectID):
+    return sorted(os.listdir(os.path.join(app.config['RENDER_CACHE_DIR'], projectID)))
+
+
+def test_artifacts_of_another_version_are_not_served(cache):
+    cache.put('P1', '1.0', 'plot', b'old')
+    assert cache.get('P1', '1.0', 'plot') == b'old'
+    assert cache.get('P1', '2.0', 'plot') is None
+    assert cache.state('P1', '2.0', ['plot'])[1] is None
+    assert cache.state('P1', '1.0', ['plot'])[1] is not None
+
+
+def test_new_data_renders_again(app, cache, mwd_rows):
+    ingest(mwd_rows('P1', ['1'], 10), 'MWD', mode='replace')
+    renders = []
+
+    def render(names):
+        renders.append(names)
+        return {name: f'{name} {len(renders)}'.encode() for name in names}
+
+    def plots():
+        stamp = project_stamp('P1')
+        keys = {name: artifact_key(name, 'P1', stamp) for name in ('rate', 'cluster')}
+        return cache.get_many('P1', stamp, keys, render)
+
+    assert plots() == {'rate': b'rate 1', 'cluster': b'cluster 1'}
+    assert plots() == {'rate': b'rate 1', 'cluster': b'cluster 1'}
+    ingest(mwd_rows('P1', ['1'], 10, seed=1), 'MWD', mode='replace')
+    assert plots() == {'rate': b'rate 2', 'cluster': b'cluster 2'}
+    assert len(renders) == 2
+    assert _versions(app, 'P1') == [project_stamp('P1')]  # The older version was swept
+
+
+def test_sweep_removes_only_older_idle_versions(app, cache):
+    for version in ('1.0', '1.2', '2.1', '2.0', '3.0', 'unknown'):
+        cache.put('P1', version, 'plot', b'plot')
+    cache.sweep('P1', '2.1')
+    assert _versions(app, 'P1') == ['2.1', '3.0', 'unknown']
+
+    cache.put('P1', '1.0', 'plot', b'late')  # A slow request of a swept version still gets its artifact
+    assert cache.get('P1', '1.0', 'plot') == b'late'
+
+
+def test_sweep_keeps_recently_written_versions(app, cache):
+    cache.SWEEP_GRACE = 60
+    cache.put('P1', '1.0', 'plot', b'plot')
+    cache.sweep('P1', '2.0')
+    assert _versions(app, 'P1') == ['1.0']
+
+
+def test_sweeps_are_rate_limited(app, cache):
+    cache.SWEEP_INTERVAL = 60
+    cache.sweep('P1', '2.0')
+    cache.put('P1', '1.0', 'plot', b'plot')
+    cache.sweep('P1', '2.0')
+    assert _versions(app, 'P1') == ['1.0']
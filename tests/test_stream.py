@@ -0,0 +1,79 @@
+import json
+import threading
+import pandas as pd
+import pytest
+import app.Resources.ingest as ingest_module
+from app import engine
+from app.Resources.data_access import FEATURES, data_version
+from app.Resources.ingest import stream_samples
+
+
+def _line(depth, **values):
+    sample = {feature: 2. for feature in FEATURES}
+    sample.update(Depth=depth, **values)
+    return json.dumps({name: value for name, value in sample.items() if value is not None})
+
+
+def _stored(projectID):
+    return pd.read_sql(f"SELECT * FROM \"MWD\" WHERE \"projectID\" = '{projectID}' ORDER BY \"index\"",
+                       engine.resolve())
+
+
+def test_samples_are_written_in_batches(app):
+    lines = [_line(depth / 10) for depth in range(5)]
+    summary = stream_samples('P1', '1', lines, batch_rows=2)
+
+    assert summary['rows'] == 5 and summary['batches'] == 3 and 'error' not in summary
+    assert summary['aggregates']['rows'] == 5
+    assert _stored('P1').Depth.tolist() == [0, .1, .2, .3, .4]
+    assert data_version('MWD', 'P1') == 1
+
+
+@pytest.mark.parametrize('line, error', [
+    ('{"Depth": 1', 'Line 3: '),
+    (_line(1, RotPressure=None), 'Line 3: The sample has no RotPressure'),
+    (_line(1, FeedPressure='high'), 'Line 3: FeedPressure is not a number'),
+    (_line(1, PercPressure=float('nan')), 'Line 3: PercPressure is not a finite number'),
+    ('[1, 2]', 'Line 3: Expected a JSON object'),
+])
+def test_an_invalid_line_keeps_the_samples_before_it(app, line, error):
+    lines = [_line(0), _line(.1), line, _line(.2)]
+    summary = stream_samples('P1', '1', lines, batch_rows=10)
+
+    assert summary['error'].startswith(error)
+    assert summary['rows'] == 2
+    assert _stored('P1').Depth.tolist() == [0, .1]
+    assert data_version('MWD', 'P1') == 1  # The samples before the invalid line were published
+
+
+def test_a_failing_stream_keeps_the_samples_read(app):
+    def lines():
+        yield _line(0)
+        raise OSError('Connection reset')
+
+    with pytest.raises(OSError):
+        stream_samples('P1', '1', lines(), batch_rows=10)
+    assert len(_stored('P1')) == 1
+
+
+def test_a_pausing_stream_writes_its_batch(app, monkeypatch):
+    written = threading.Event()
+    append_samples = ingest_module.append_samples
+
+    def recorded(*args, **kwargs):
+        aggregates = append_samples(*args, **kwargs)
+        written.set()
+        return aggregates
+    monkeypatch.setattr(ingest_module, 'append_samples', recorded)
+
+    paused = []
+
+    def lines():
+        yield _line(0)
+        yield _line(.1)
+        paused.append(written.wait(5))  # The stream pauses until the samples sent so far are written
+        yield _line(.2)
+
+    summary = stream_samples('P1', '1', lines(), batch_rows=10, batch_seconds=.1)
+    assert paused == [True]
+    assert summary['rows'] == 3 and summary['batches'] == 2